@@ -27,6 +27,35 @@ main_server_host = f'http://localhost:{main_server_port}'  # 主程序后端服
 job_server_port = 8019  # job服务端口
 job_server_host = f'http://localhost:{job_server_port}/api/job'  # job服务接口
 
+# 执行自定义函数的共用线程池大小，整个进程共用，避免并发运行时无限制的创建线程
+script_executor_max_workers = int(os.environ.get('SCRIPT_EXECUTOR_MAX_WORKERS', min(32, (os.cpu_count() or 1) * 5)))
+script_run_timeout = int(os.environ.get('SCRIPT_RUN_TIMEOUT', 600))  # 单次执行自定义函数的超时时间，秒
+
+# 执行浏览器/app操作的共用线程池大小，selenium、appium 的调用是阻塞的，整个进程的ui、app执行共用
+webdriver_executor_max_workers = int(os.environ.get('WEBDRIVER_EXECUTOR_MAX_WORKERS', min(32, (os.cpu_count() or 1) * 5)))
+webdriver_action_timeout = int(os.environ.get('WEBDRIVER_ACTION_TIMEOUT', 600))  # 单次浏览器/app操作、启动浏览器/app的超时时间，秒
+# 截图压缩、落盘排队的最大张数，排满后截图等待空位，等待超时则丢弃
+screenshot_writer_max_pending = int(os.environ.get('SCREENSHOT_WRITER_MAX_PENDING', 100))
+
+# 浏览器/app会话池，用例执行完后重置会话放回池中，下一条相同浏览器/设备能力的用例直接复用
+webdriver_pool_max_idle = int(os.environ.get('WEBDRIVER_POOL_MAX_IDLE', 5))  # 每种浏览器/设备能力最多保留的空闲会话数，为0则不复用
+webdriver_pool_max_age = int(os.environ.get('WEBDRIVER_POOL_MAX_AGE', 30 * 60))  # 会话最长存活秒数，超过后关闭重建
+webdriver_pool_max_uses = int(os.environ.get('WEBDRIVER_POOL_MAX_USES', 100))  # 会话最多执行的用例数，超过后关闭重建
+webdriver_pool_idle_timeout = int(os.environ.get('WEBDRIVER_POOL_IDLE_TIMEOUT', 5 * 60))  # 空闲会话超过多少秒没被使用则关闭
+
+# 消息队列生产者，每个队列链接保持一个长连接，发送放到线程池中执行，同一链接并发发送的消息合并为一批发送
+mq_producer_max_workers = int(os.environ.get('MQ_PRODUCER_MAX_WORKERS', 8))  # 发送消息的线程池大小
+mq_producer_idle_timeout = int(os.environ.get('MQ_PRODUCER_IDLE_TIMEOUT', 60))  # 连接空闲超过多少秒则关闭，下次发送时重新连接
+mq_producer_batch_size = int(os.environ.get('MQ_PRODUCER_BATCH_SIZE', 100))  # 一批最多发送的消息数
+mq_send_timeout = int(os.environ.get('MQ_SEND_TIMEOUT', 30))  # 一批消息发送的超时时间，秒
+
+config_cache_ttl = int(os.environ.get('CONFIG_CACHE_TTL', 60))  # 配置管理的配置在进程内缓存的秒数，多进程时修改后最多这么久生效
+
+# 测试运行进程（python -m utils.client.run_worker），全局/单个服务的最多同时执行数在配置管理的 run_queue 中设置
+run_worker_max_running = int(os.environ.get('RUN_WORKER_MAX_RUNNING', 5))  # 单个运行进程最多同时执行的报告数
+run_worker_poll_interval = int(os.environ.get('RUN_WORKER_POLL_INTERVAL', 3))  # 领取队列的间隔，秒
+run_worker_heartbeat_interval = int(os.environ.get('RUN_WORKER_HEARTBEAT_INTERVAL', 10))  # 心跳间隔，秒
+
 # 默认的webhook地址，用于接收系统状态通知、系统异常/错误通知...
 _default_web_hook_type = 'ding_ding'  # 默认通知的webhook类型，见枚举类apps.enums.WebHookTypeEnum
 _default_web_hook = 'https://oapi.dingtalk.com/robot/send?'
@@ -282,6 +311,15 @@ class _Sso:
 openai_api_key = os.environ.get('OPENAI_API_KEY', '')  # OpenAI API Key
 openai_base_url = os.environ.get('OPENAI_BASE_URL', 'https://api.openai.com/v1')  # OpenAI API 基础URL
 
+# 未配置 QDRANT_URL 时使用本地磁盘存储向量，每个知识库一个目录；本地模式同一目录只能被一个进程打开，多worker部署必须配置 QDRANT_URL（gunicorn_main.py 启动时校验）
+qdrant_local_path = os.environ.get('QDRANT_LOCAL_PATH', os.path.join(basedir, 'uploads', 'qdrant'))
+qdrant_startup_sync = os.environ.get('QDRANT_STARTUP_SYNC', '1') == '1'  # 启动时是否校验向量与分块记录的一致性，补齐缺失的向量，多worker时只由一个worker执行
+knowledge_embedding_batch_size = int(os.environ.get('KNOWLEDGE_EMBEDDING_BATCH_SIZE', 10))  # 知识库文档向量化时每批的分块数
+# 向量缓存，按 (模型, 文本哈希) 缓存，重复的文本不再调用嵌入服务
+embedding_cache_path = os.environ.get('EMBEDDING_CACHE_PATH', os.path.join(basedir, 'uploads', 'embedding_cache.sqlite3'))
+embedding_cache_max_entries = int(os.environ.get('EMBEDDING_CACHE_MAX_ENTRIES', 200000))  # 磁盘中最多缓存的向量数
+embedding_cache_memory_entries = int(os.environ.get('EMBEDDING_CACHE_MEMORY_ENTRIES', 5000))  # 内存中最多缓存的向量数
+
 # 数据库类型配置
 DB_TYPE = os.environ.get('DB_TYPE', 'mysql').lower()  # mysql 或 postgresql
 
@@ -1,4 +1,6 @@
-﻿from tortoise import Tortoise
+﻿import asyncio
+
+from tortoise import Tortoise
 from tortoise.contrib.fastapi import register_tortoise
 
 from app.configs import config
@@ -87,6 +89,11 @@ def register_app_hook(app):
         # 注册自愈修复器路由
         app.include_router(healer.router, prefix='/api', tags=["Playwright Healer"])
 
+        # 后台校验知识库向量与分块记录的一致性，只补齐缺失的向量，不阻塞启动，多worker时只由一个worker执行
+        from app.services.aitestrebort.vector_store import KnowledgeBaseService
+        if config.qdrant_startup_sync and KnowledgeBaseService.try_own_vector_storage():
+            app.state.qdrant_sync_task = asyncio.create_task(KnowledgeBaseService.sync_all_knowledge_bases())
+
         app.logger.info(f'\n\n\n{"*" * 20} 服务【{app.title}】启动完成 {"*" * 20}\n\n\n'"")
         if config.is_linux:
             await send_server_status(config.token_secret_key, app.title, action_type='启动')
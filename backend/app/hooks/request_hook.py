@@ -1,8 +1,10 @@
-import json
+import random
 import uuid
 
 from fastapi import Request, Response
 
+from app.models.config.model_factory import Config
+
 
 async def set_body(request: Request, body: bytes):
     async def receive():
@@ -25,6 +27,56 @@ def check_is_log_response(path):
     ])
 
 
+async def get_body_log_rule(path):
+    """ 当前接口的body日志配置，按接口单独设置的覆盖默认的 """
+    try:
+        body_log = await Config.get_body_log()
+    except Exception:
+        body_log = {}
+    rule = {
+        "sample_rate": body_log.get("sample_rate", 1),
+        "max_bytes": body_log.get("max_bytes", 4096),
+        "exclude_content_type": body_log.get("exclude_content_type", [])
+    }
+    for route, route_rule in body_log.get("route", {}).items():
+        if route in path:
+            rule.update(route_rule)
+            break
+    return rule
+
+
+def is_exclude_content_type(content_type, rule):
+    return any(content_type.startswith(exclude) for exclude in rule["exclude_content_type"])
+
+
+def format_body(body: bytes, max_bytes: int, total_size: int = None):
+    """ 截取body的前 max_bytes 字节用于打日志 """
+    total_size = len(body) if total_size is None else total_size
+    text = body[:max_bytes].decode(errors="replace")
+    return text if total_size <= max_bytes else f'{text}...<已截断，共{total_size}字节>'
+
+
+def log_response_body(request: Request, response: Response, request_id, max_bytes):
+    """ 响应body边发送边记录前 max_bytes 字节，发送完后打日志，不把整个响应读到内存中 """
+    body_iterator = response.body_iterator
+
+    async def logged_body_iterator():
+        head, total_size = bytearray(), 0
+        try:
+            async for chunk in body_iterator:
+                if isinstance(chunk, str):
+                    chunk = chunk.encode()
+                if len(head) < max_bytes:
+                    head.extend(chunk[:max_bytes - len(head)])
+                total_size += len(chunk)
+                yield chunk
+        finally:
+            request.app.logger.info(
+                f'【{request.method}】【{request_id}】【{request.url.path}】: {format_body(bytes(head), max_bytes, total_size)}')
+
+    response.body_iterator = logged_body_iterator()
+
+
 def register_request_hook(app):
     @app.middleware("http")
     async def before_request(request: Request, call_next):
@@ -46,54 +98,43 @@ def register_request_hook(app):
         elif "ui-test" in request.url.path:
             request.app.test_type = "ui"
 
+        # body日志按接口配置采样、截断，同一个请求的请求体和响应体要么都记录，要么都不记录
+        rule = await get_body_log_rule(request.url.path)
+        is_sampled = random.random() < rule["sample_rate"]
+
         # 非文件上传接口，获取请求体并记录日志
         # 跳过流式请求的body读取
-        is_upload_file = request.headers.get("content-type", "").startswith("multipart/form-data")
+        request_content_type = request.headers.get("content-type", "")
+        is_upload_file = request_content_type.startswith("multipart/form-data")
         is_stream_request = "/stream" in request.url.path
-        
+
         request.state.is_upload_file = is_upload_file
-        
-        if not is_upload_file and not is_stream_request:
+
+        if not is_upload_file and not is_stream_request and not is_exclude_content_type(request_content_type, rule):
             # 把解析后的body保存在state对象上，方便在出错的时候保存请求数据
-            await set_body(request, await request.body())
             request.state.set_body = await get_body(request)
+            if request.query_params:
+                request_log = request.query_params
+            elif is_sampled:
+                request_log = format_body(request.state.set_body.encode(), rule["max_bytes"])
+            else:
+                request_log = '<body未采样>'
+            request.app.logger.info(f'【{request.method}】【{request_id}】【{request.url.path}】: {request_log}')
+        else:
+            # 流式请求、文件上传只记录路径，不读取body
             request.app.logger.info(
-                f'【{request.method}】【{request_id}】【{request.url.path}】: {request.query_params or request.state.set_body}')
-        elif is_stream_request:
-            # 流式请求只记录路径，不读取body
-            request.app.logger.info(
-                f'【{request.method}】【{request_id}】【{request.url.path}】: <streaming request>')
+                f'【{request.method}】【{request_id}】【{request.url.path}】: <{"streaming request" if is_stream_request else request_content_type}>')
 
         response: Response = await call_next(request)
 
-        # 打印响应 - 跳过流式响应和特定路径
-        # 检查是否是流式响应（通过路径或content-type）
-        is_streaming = (
-            "/stream" in request.url.path or 
-            response.headers.get("content-type", "").startswith("text/event-stream")
-        )
-        
-        if check_is_log_response(request.url.path) and not is_streaming:
-            try:
-                response_body = b"".join([chunk async for chunk in response.body_iterator])
-                
-                # 尝试解析JSON，如果失败则直接输出原始内容
-                try:
-                    response_data = json.loads(response_body.decode())
-                    request.app.logger.info(
-                        f'【{request.method}】【{request_id}】【{request.url.path}】: {response_data}')
-                except json.JSONDecodeError:
-                    request.app.logger.info(
-                        f'【{request.method}】【{request_id}】【{request.url.path}】: Non-JSON response')
-                
-                # 重建响应迭代器
-                async def new_body_iterator():
-                    yield response_body
-
-                response.body_iterator = new_body_iterator()
-            except Exception as e:
-                request.app.logger.warning(f'Failed to log response: {e}')
-        
+        # 打印响应 - 跳过流式响应、特定路径、不记录的content-type
+        response_content_type = response.headers.get("content-type", "")
+        is_streaming = "/stream" in request.url.path or response_content_type.startswith("text/event-stream")
+
+        if is_sampled and check_is_log_response(request.url.path) and not is_streaming \
+                and not is_exclude_content_type(response_content_type, rule):
+            log_response_body(request, response, request_id, rule["max_bytes"])
+
         return format_response(response, request)
 
 
@@ -93,6 +93,7 @@ class aitestrebortDocument(Model):
     file_size = fields.IntField(null=True, description="文件大小(字节)")
     page_count = fields.IntField(null=True, description="页数")
     word_count = fields.IntField(null=True, description="字数")
+    chunk_total = fields.IntField(null=True, description="分块总数，处理中时与已保存的分块数一起计算处理进度")
     
     # 上传信息
     uploader = fields.ForeignKeyField(
@@ -1,15 +1,104 @@
 # -*- coding: utf-8 -*-
-import asyncio
-import importlib
-import os
+import sys
 import types
-from concurrent.futures import ThreadPoolExecutor
-from functools import partial  # 处理关键字参数必备
+import builtins
+import linecache
+import threading
+import importlib
+import importlib.abc
+import importlib.util
+from functools import partial
 from typing import Callable, Any
 
 from ..base_model import fields, pydantic_model_creator, BaseModel
 from app.models.config.run_env import RunEnv
+from app.configs.config import script_executor_max_workers, script_run_timeout
 from utils.util.file_util import FileUtil
+from utils.util.thread_pool import BoundedExecutor
+
+# 编译后的自定义函数缓存，{运行环境: {脚本id: (最后修改时间, 模块名, {函数名: 函数} 或 编译异常)}}，只重新编译修改过的脚本
+_script_functions_cache = {}
+
+# 执行自定义函数的线程池，整个进程共用
+script_executor = BoundedExecutor("script-executor", script_executor_max_workers)
+
+
+class ScriptModuleFinder(importlib.abc.MetaPathFinder, importlib.abc.Loader):
+    """ 自定义函数脚本的导入器，脚本代码只保存在内存中，按 script_list.运行环境_脚本名 导入，不读写脚本文件
+    同时记录每个脚本导入了哪些脚本，被导入的脚本修改后，导入方也要重新编译才能拿到最新的函数
+    """
+
+    package = "script_list"
+
+    def __init__(self):
+        self.sources = {}  # {模块名: 脚本代码}
+        self.imports = {}  # {模块名: 该脚本导入过的脚本模块名}
+        self.lock = threading.Lock()
+
+    def find_spec(self, fullname, path=None, target=None):
+        if fullname == self.package:  # 包本身没有搜索路径，磁盘上遗留的脚本文件不会被导入
+            return importlib.util.spec_from_loader(fullname, self, is_package=True)
+        if fullname in self.sources:
+            return importlib.util.spec_from_loader(
+                fullname, self, origin=FileUtil.build_script_path(fullname.split(".", 1)[1]))
+        return None
+
+    def create_module(self, spec):
+        return None
+
+    def exec_module(self, module):
+        module_name = module.__name__
+        if module_name == self.package:
+            return
+        source = self.sources[module_name]
+        module.__file__ = module.__spec__.origin
+        # 报错堆栈中显示脚本代码
+        linecache.cache[module.__file__] = (len(source), None, source.splitlines(True), module.__file__)
+        with self.lock:
+            self.imports[module_name] = set()
+        module.__builtins__ = dict(vars(builtins), __import__=partial(self.record_import, module_name))
+        exec(compile(source, module.__file__, "exec"), module.__dict__)
+
+    def record_import(self, importer, name, globals=None, locals=None, fromlist=(), level=0):
+        """ 脚本中的 import 语句，记录导入的脚本后再按原逻辑导入 """
+        full_name = importlib.util.resolve_name("." * level + name, self.package) if level else name
+        if full_name == self.package:
+            imported = {f'{self.package}.{item}' for item in fromlist or ()}
+        elif full_name.startswith(f'{self.package}.'):
+            imported = {full_name}
+        else:
+            imported = set()
+        if imported:
+            with self.lock:
+                self.imports.setdefault(importer, set()).update(imported)
+        return builtins.__import__(name, globals, locals, fromlist, level)
+
+    def get_dependents(self, module_names: set):
+        """ 直接或间接导入了指定脚本的脚本，包含指定脚本本身 """
+        result = set(module_names)
+        with self.lock:
+            while True:
+                more = {
+                    importer for importer, imported in self.imports.items()
+                    if importer not in result and imported & result
+                }
+                if not more:
+                    return result
+                result |= more
+
+    def discard(self, module_names: set, keep_source: set):
+        """ 移除已导入的模块，不在 keep_source 中的模块同时移除脚本代码 """
+        with self.lock:
+            for module_name in module_names:
+                sys.modules.pop(module_name, None)
+                self.imports.pop(module_name, None)
+                if module_name not in keep_source:
+                    self.sources.pop(module_name, None)
+
+
+script_module_finder = ScriptModuleFinder()
+sys.modules.pop(ScriptModuleFinder.package, None)
+sys.meta_path.insert(0, script_module_finder)
 
 
 class Script(BaseModel):
@@ -26,24 +115,6 @@ class Script(BaseModel):
         table = "auto_test_python_script"
         table_description = "python脚本"
 
-    @classmethod
-    async def create_script_file(cls, env_code=None, not_create_list=[]):
-        """ 创建所有自定义函数 py 文件，默认在第一行加上运行环境
-        示例：
-            # coding:utf-8
-
-            env_code = "test"
-
-            脚本内容
-        """
-        if env_code is None:
-            env_data = await RunEnv.first().values("code")
-            env_code = env_data["code"]
-
-        for script in await cls.all():
-            if script.name not in not_create_list:
-                FileUtil.save_script_data(f'{env_code}_{script.name}', script.script_data, env_code)
-
     @classmethod
     async def get_func_by_script_id(cls, script_id_list: list, env_id=None):
         """ 获取指定脚本中的函数 """
@@ -51,34 +122,93 @@ class Script(BaseModel):
             env_data = await RunEnv.first().values("code")
         else:
             env_data = await RunEnv.filter(id=env_id).first().values("code")
-        env_code = env_data["code"]
+        return await cls.get_script_functions(script_id_list, env_data["code"])
 
-        await cls.create_script_file(env_code)  # 创建所有函数文件
+    @classmethod
+    async def get_script_functions(cls, script_id_list: list, env_code: str):
+        """ 获取指定脚本中的函数，按脚本id的顺序合并，后面的同名函数覆盖前面的 """
+        env_functions = await cls.get_env_functions(env_code)
         func_dict = {}
         for script_id in script_id_list:
-            script = await cls.filter(id=script_id).first().values("name")
-            func_list = importlib.reload(importlib.import_module(f'script_list.{env_code}_{script["name"]}'))
-            func_dict.update({
-                name: item for name, item in vars(func_list).items() if isinstance(item, types.FunctionType)
-            })
+            functions = env_functions.get(script_id)
+            if isinstance(functions, Exception):  # 脚本编译、导入出错
+                raise functions
+            func_dict.update(functions or {})
         return func_dict
 
     @classmethod
-    async def run_func(cls, func: Callable, args: tuple = None, kwargs: dict = None, timeout: int = 600) -> Any:
-        """线程安全的异步任务执行器，支持超时控制和自动资源回收"""
-        args = args or ()
-        kwargs = kwargs or {}
-        max_workers = min(50, os.cpu_count() * 5)
-        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+    async def get_env_functions(cls, env_code: str):
+        """ 运行环境下所有脚本的函数，{脚本id: {函数名: 函数} 或 编译异常}
+        按脚本的最后修改时间判断，只从数据库取出新增、修改过的脚本重新编译，没有修改过的直接使用缓存
+        """
+        version = dict(await cls.exclude(script_type="mock").values_list("id", "update_time"))
+        cache = _script_functions_cache.setdefault(env_code, {})
+        changed_id_list = [script_id for script_id, update_time in version.items()
+                           if script_id not in cache or cache[script_id][0] != update_time]
+        removed_id_list = [script_id for script_id in cache if script_id not in version]
+        if changed_id_list or removed_id_list:
+            script_list = await cls.filter(id__in=changed_id_list).values(
+                "id", "name", "update_time", "script_data") if changed_id_list else []
+            cls.compile_env_scripts(env_code, script_list, removed_id_list)
+        return {script_id: functions for script_id, (_, _, functions) in cache.items()}
+
+    @classmethod
+    def compile_env_scripts(cls, env_code: str, script_list: list, removed_id_list: list):
+        """ 重新编译修改过的脚本，以及直接或间接导入了这些脚本的脚本，单个脚本出错时记录异常，不影响其他脚本
+        出错的脚本不记录修改时间，下次获取时重新编译
+        """
+        cache = _script_functions_cache[env_code]
+        stale_modules = {cache.pop(script_id)[1] for script_id in removed_id_list}
+        for script in script_list:
+            module_name = f'{ScriptModuleFinder.package}.{env_code}_{script["name"]}'
+            if script["id"] in cache:
+                stale_modules.add(cache[script["id"]][1])  # 脚本改名后旧模块也要移除
+            stale_modules.add(module_name)
+            script_module_finder.sources[module_name] = FileUtil.build_script_data(script["script_data"], env_code)
+            cache[script["id"]] = (script["update_time"], module_name, None)
+
+        recompile_modules = script_module_finder.get_dependents(stale_modules)
+        script_module_finder.discard(recompile_modules, keep_source={item[1] for item in cache.values()})
+        for script_id, (update_time, module_name, functions) in list(cache.items()):
+            if module_name not in recompile_modules:
+                continue
             try:
-                if not kwargs:
-                    return await asyncio.wait_for(
-                        asyncio.get_running_loop().run_in_executor(executor, func, *args), timeout=timeout)
-                bound_func = partial(func, *args, **kwargs)
-                return await asyncio.wait_for(
-                    asyncio.get_running_loop().run_in_executor(executor, bound_func), timeout=timeout)
-            except Exception as e:
-                executor.shutdown(wait=True)  # 强制终止超时任务
-                raise
+                cache[script_id] = (update_time, module_name, cls.get_module_functions(
+                    importlib.import_module(module_name)))
+            except Exception as error:
+                cache[script_id] = (None, module_name, error)
+
+    @staticmethod
+    def get_module_functions(module):
+        return {name: item for name, item in vars(module).items() if isinstance(item, types.FunctionType)}
+
+    @classmethod
+    async def compile_script(cls, name: str, script_data: str, env_code: str):
+        """ 保存前校验脚本，在内存中编译执行，不写文件、不注册到 sys.modules，可以导入运行环境下已保存的脚本 """
+        await cls.get_env_functions(env_code)
+        module_name = f'{env_code}_{name}'
+        module = types.ModuleType(f'script_list.{module_name}')
+        module.__file__ = FileUtil.build_script_path(module_name)
+        exec(compile(FileUtil.build_script_data(script_data, env_code), module.__file__, "exec"), module.__dict__)
+        return cls.get_module_functions(module)
+
+    @classmethod
+    def clear_script_functions_cache(cls, script_id):
+        """ 脚本修改、删除后，让当前进程中该脚本的缓存失效，同一秒内多次修改也能拿到最新的脚本
+        其他进程根据脚本的修改时间判断是否需要重新编译
+        """
+        for cache in _script_functions_cache.values():
+            if script_id in cache:
+                cache[script_id] = (None, *cache[script_id][1:])
+
+    @classmethod
+    async def run_func(cls, func: Callable, args: tuple = None, kwargs: dict = None, timeout: int = None) -> Any:
+        """ 在进程共用的有界线程池中执行自定义函数，超时则放弃等待并抛出异常 """
+        return await script_executor.run(func, args or (), kwargs, timeout=timeout or script_run_timeout)
+
+    @classmethod
+    def get_executor_stat(cls):
+        """ 自定义函数线程池的运行指标：排队数、执行中数量、饱和度、超时数... """
+        return script_executor.get_stat()
 
 ScriptPydantic = pydantic_model_creator(Script, name="Script")
@@ -8,6 +8,8 @@ from .case import *
 from .step import *
 from .task import *
 from .report import *
+from .report_stat import *
 from .report_case import *
 from .report_step import *
 from .ai_code_generation import *
+from .run_queue import *
@@ -1,8 +1,10 @@
 # -*- coding: utf-8 -*-
 import datetime
 import time
+import traceback
 
 from ..base_model import BaseModel, fields, pydantic_model_creator
+from .report_stat import ReportStat
 from app.schemas.enums import TriggerTypeEnum
 from utils.logs.log import logger
 
@@ -162,8 +164,9 @@ class BaseReport(BaseModel):
         await self.update_report_process(process=3, status=1)
 
     async def save_report_finish(self):
-        """ 保存报告完毕 """
+        """ 保存报告完毕，报告执行完毕的标识为 process=3、status=2，此时才累加到统计汇总表 """
         await self.update_report_process(process=3, status=2)
+        await self.add_to_stat()
 
     @classmethod
     async def batch_delete_report(cls, report_list):
@@ -186,6 +189,13 @@ class BaseReport(BaseModel):
         self.is_passed = update_dict["is_passed"]
         await self.__class__.filter(id=self.id).update(**update_dict)
 
+    async def add_to_stat(self):
+        """ 执行完毕的报告累加到统计汇总表，统计失败不影响报告 """
+        try:
+            await ReportStat.add_report(self.test_type, dict(self))
+        except Exception:
+            logger.error(f'测试报告【{self.test_type}_{self.id}】累加统计失败：\n{traceback.format_exc()}')
+
     @classmethod
     async def select_is_all_status_by_batch_id(cls, batch_id, process_and_status=[1, 1]):
         """ 查询一个运行批次下离初始化状态最近的报告 """
@@ -212,18 +222,24 @@ class BaseReport(BaseModel):
 
 
 class ApiReport(BaseReport):
+    test_type = "api"
+
     class Meta:
         table = "api_test_report"
         table_description = "接口测试报告表"
 
 
 class AppReport(BaseReport):
+    test_type = "app"
+
     class Meta:
         table = "app_ui_test_report"
         table_description = "APP测试报告表"
 
 
 class UiReport(BaseReport):
+    test_type = "ui"
+
     class Meta:
         table = "web_ui_test_report"
         table_description = "web-ui测试报告表"
@@ -0,0 +1,163 @@
+# -*- coding: utf-8 -*-
+import datetime
+
+from tortoise.exceptions import IntegrityError
+from tortoise.expressions import F
+from tortoise.functions import Sum
+
+from ..base_model import BaseModel, fields, pydantic_model_creator
+from utils.logs.log import logger
+
+
+def to_datetime(value):
+    """ 时间参数转为datetime，兼容 time_calculate/get_now 返回的字符串 """
+    if value is None or isinstance(value, datetime.datetime):
+        return value
+    for time_format in ("%Y-%m-%d %H:%M:%S", "%Y-%m-%d"):
+        try:
+            return datetime.datetime.strptime(value, time_format)
+        except ValueError:
+            pass
+    return datetime.datetime.fromisoformat(value)
+
+
+class ReportStat(BaseModel):
+    """ 测试报告统计汇总表，按小时、天预先汇总执行次数
+    1、报告执行完毕时原子累加到所属的小时、天
+    2、统计、首页直接查此表，不再扫描报告表
+    3、每天凌晨按报告表重新汇总前一天的数据，修正偏差，首次上线时补历史数据
+    """
+
+    period = fields.CharField(8, description="汇总粒度，hour、day")
+    stat_time = fields.DatetimeField(index=True, description="汇总时间段的开始时间")
+    test_type = fields.CharField(8, description="测试类型，api、app、ui")
+    project_id = fields.IntField(index=True, description="服务id")
+    trigger_type = fields.CharField(16, default="", description="触发方式")
+    run_type = fields.CharField(16, default="", description="报告类型，task/suite/case/api")
+    run_user = fields.IntField(default=0, description="触发执行的用户")
+    run_count = fields.IntField(default=0, description="执行次数")
+    pass_count = fields.IntField(default=0, description="通过次数")
+    fail_count = fields.IntField(default=0, description="不通过次数")
+    case_count = fields.IntField(default=0, description="执行的用例数")
+    step_count = fields.IntField(default=0, description="执行的步骤数")
+    api_count = fields.IntField(default=0, description="执行的接口数")
+
+    class Meta:
+        table = "auto_test_report_stat"
+        table_description = "测试报告统计汇总表"
+        unique_together = ("period", "stat_time", "test_type", "project_id", "trigger_type", "run_type", "run_user")
+
+    count_fields = ("run_count", "pass_count", "fail_count", "case_count", "step_count", "api_count")
+
+    @staticmethod
+    def get_period_time(create_time):
+        """ 报告所属的小时、天 """
+        hour = create_time.replace(minute=0, second=0, microsecond=0, tzinfo=None)
+        return {"hour": hour, "day": hour.replace(hour=0)}
+
+    @staticmethod
+    def get_dimension(test_type, report: dict):
+        trigger_type = report.get("trigger_type")
+        return {
+            "test_type": test_type,
+            "project_id": report["project_id"],
+            "trigger_type": getattr(trigger_type, "value", trigger_type) or "",
+            "run_type": report.get("run_type") or "",
+            "run_user": report.get("create_user") or 0
+        }
+
+    @staticmethod
+    def get_counter(report: dict):
+        stat = (report.get("summary") or {}).get("stat", {})
+        is_passed = 1 if report.get("is_passed") == 1 else 0
+        return {
+            "run_count": 1,
+            "pass_count": is_passed,
+            "fail_count": 1 - is_passed,
+            "case_count": stat.get("test_case", {}).get("total", 0),
+            "step_count": stat.get("test_step", {}).get("total", 0),
+            "api_count": stat.get("count", {}).get("api", 0)
+        }
+
+    @classmethod
+    async def add_report(cls, test_type, report: dict):
+        """ 报告执行完毕，累加到所属的小时、天 """
+        dimension, counter = cls.get_dimension(test_type, report), cls.get_counter(report)
+        for period, stat_time in cls.get_period_time(report["create_time"]).items():
+            await cls.increase(dict(period=period, stat_time=stat_time, **dimension), counter)
+
+    @classmethod
+    async def increase(cls, dimension, counter):
+        """ 原子累加，没有这一行则插入，并发插入冲突时改为累加 """
+        update_dict = {key: F(key) + value for key, value in counter.items()}
+        if await cls.filter(**dimension).update(**update_dict):
+            return
+        try:
+            await cls.create(**dimension, **counter)
+        except IntegrityError:
+            await cls.filter(**dimension).update(**update_dict)
+
+    @classmethod
+    async def get_stat(cls, test_type, start_time=None, end_time=None, group_by=(), **kwargs):
+        """ 汇总时间段内的统计
+        开始时间是整天的查按天汇总的数据，否则查按小时汇总的数据
+        统计时间是时间段的开始时间，所以结束时间不含等号，结束时间传第二天0点时不会把第二天算进来
+        group_by 为空时返回 {统计字段: 值}，否则返回 [{分组字段: 值, 统计字段: 值}]
+        """
+        start_time, end_time = to_datetime(start_time), to_datetime(end_time)
+        is_day = start_time is None or start_time == start_time.replace(hour=0, minute=0, second=0, microsecond=0)
+        query = cls.filter(test_type=test_type, period="day" if is_day else "hour", **kwargs)
+        if start_time:
+            query = query.filter(stat_time__gte=cls.get_period_time(start_time)["day" if is_day else "hour"])
+        if end_time:
+            query = query.filter(stat_time__lt=end_time)
+
+        query = query.annotate(**{f'sum_{field}': Sum(field) for field in cls.count_fields})
+        sum_fields = [f'sum_{field}' for field in cls.count_fields]
+        if group_by:
+            stat_list = await query.group_by(*group_by).values(*group_by, *sum_fields)
+        else:
+            stat_list = [await query.first().values(*sum_fields) or {}]
+        for stat in stat_list:
+            for field in cls.count_fields:
+                stat[field] = int(stat.pop(f'sum_{field}', None) or 0)
+        return stat_list if group_by else stat_list[0]
+
+    @classmethod
+    async def rebuild(cls, test_type, report_model, start_time=None, end_time=None, batch_size=2000):
+        """ 按报告表重新汇总 [start_time, end_time) 的统计，时间为整天，不传开始时间则从头汇总 """
+        time_filter = {}
+        if start_time:
+            time_filter["create_time__gte"] = start_time
+        if end_time:
+            time_filter["create_time__lt"] = end_time
+
+        counter_dict = {}
+        last_id = 0
+        while True:
+            report_list = await report_model.filter(id__gt=last_id, process=3, status=2, **time_filter).order_by("id").limit(
+                batch_size).values(
+                "id", "project_id", "trigger_type", "run_type", "create_user", "is_passed", "create_time", "summary")
+            if not report_list:
+                break
+            last_id = report_list[-1]["id"]
+            for report in report_list:
+                dimension, counter = cls.get_dimension(test_type, report), cls.get_counter(report)
+                for period, stat_time in cls.get_period_time(report["create_time"]).items():
+                    key = tuple(dict(period=period, stat_time=stat_time, **dimension).items())
+                    total = counter_dict.setdefault(key, dict.fromkeys(cls.count_fields, 0))
+                    for field, value in counter.items():
+                        total[field] += value
+
+        stat_filter = {"test_type": test_type}
+        if start_time:
+            stat_filter["stat_time__gte"] = start_time
+        if end_time:
+            stat_filter["stat_time__lt"] = end_time
+        await cls.filter(**stat_filter).delete()
+        for key, counter in counter_dict.items():
+            await cls.increase(dict(key), counter)
+        logger.info(f'{test_type}测试报告统计重新汇总完成，时间段：{start_time} ~ {end_time}，汇总数据：{len(counter_dict)}条')
+
+
+ReportStatPydantic = pydantic_model_creator(ReportStat, name="ReportStat")
@@ -1,8 +1,70 @@
 # -*- coding: utf-8 -*-
-import time
+import asyncio
+import traceback
 
 from ..base_model import BaseModel, fields, pydantic_model_creator
 from ...schemas.enums import ReportStepStatusEnum
+from utils.logs.log import logger
+
+
+class ReportStepUpdateBuffer:
+    """ 步骤执行进度、结果的写缓冲
+    同一个步骤的多次更新先在内存中合并，达到时间阈值、数量阈值，或者用例执行结束时再批量写库
+    """
+
+    def __init__(self, flush_interval=1, max_size=50, **kwargs):
+        self.flush_interval = flush_interval  # 最长间隔多少秒写一次库，保证报告页面能准实时看到进度
+        self.max_size = max_size  # 缓冲的步骤数达到多少立即写库
+        self.pending = {}  # {(model, report_step_id): {字段: 值}}
+        self.flush_task = None
+        self.lock = asyncio.Lock()
+
+    async def add(self, model, report_step_id, update_dict):
+        """ 把更新放到缓冲中，同一个步骤的后一次更新覆盖前一次的同名字段 """
+        self.pending.setdefault((model, report_step_id), {}).update(update_dict)
+        if len(self.pending) >= self.max_size:
+            await self.flush()
+        elif self.flush_task is None or self.flush_task.done():
+            self.flush_task = asyncio.create_task(self.flush_later())
+
+    async def flush_later(self):
+        await asyncio.sleep(self.flush_interval)
+        try:
+            await asyncio.shield(self.flush())  # 写库过程中不被取消，避免丢数据
+        except Exception:
+            # 没写成功的数据已放回缓冲，下次写库或用例执行结束时重试
+            logger.error(f'步骤执行进度写库失败，{len(self.pending)}个步骤待重试：\n{traceback.format_exc()}')
+
+    async def flush(self):
+        """ 把缓冲的数据写库，只更新了进度/结果的步骤，相同的更新内容合并为一条 update
+        写库出错时，没写成功的数据放回缓冲（缓冲中更新的值优先），再抛出异常
+        """
+        async with self.lock:
+            pending, self.pending = self.pending, {}
+            written = set()
+            try:
+                same_update_dict = {}  # {(model, ((字段, 值), ...)): [report_step_id]}
+                for (model, report_step_id), update_dict in pending.items():
+                    if "step_data" in update_dict or "summary" in update_dict:
+                        await model.filter(id=report_step_id).update(**update_dict)
+                        written.add((model, report_step_id))
+                    else:
+                        same_update_dict.setdefault(
+                            (model, tuple(sorted(update_dict.items()))), []).append(report_step_id)
+                for (model, update_items), report_step_id_list in same_update_dict.items():
+                    await model.filter(id__in=report_step_id_list).update(**dict(update_items))
+                    written.update((model, report_step_id) for report_step_id in report_step_id_list)
+            except Exception:
+                for key, update_dict in pending.items():
+                    if key not in written:
+                        self.pending[key] = {**update_dict, **self.pending.get(key, {})}
+                raise
+
+    async def close(self):
+        """ 用例执行结束，取消定时写库，并把剩下的数据写库，写库失败时抛出异常 """
+        if self.flush_task and not self.flush_task.done():
+            self.flush_task.cancel()
+        await self.flush()
 
 
 class BaseReportStep(BaseModel):
@@ -27,6 +89,10 @@ class BaseReportStep(BaseModel):
         default={},
         description="步骤的统计")
 
+    update_buffer = None  # 执行测试时由Runner设置的写缓冲，没有设置则直接写库
+    pause_poll_interval = 1  # 暂停时查询状态的间隔秒数，在其他进程修改的状态要靠查询才能感知
+    _status_changed_events = {}  # 当前进程中等待放行的步骤，{(步骤表, 步骤id): asyncio.Event}，本进程修改状态时立即唤醒
+
     class Meta:
         abstract = True  # 不生成表
 
@@ -82,19 +148,39 @@ class BaseReportStep(BaseModel):
             await cls.filter(report_case_id=report_case_id, id__gte=report_step_id).update(status=status)
         elif report_id is None and report_case_id is None and report_step_id:  # 更新指定数据的状态
             await cls.filter(id=report_step_id).update(status=status)
+        cls.notify_status_changed()
+
+    @classmethod
+    def notify_status_changed(cls):
+        """ 唤醒当前进程中这张表所有等待放行的步骤，由它们各自重新查询状态 """
+        for (model, _), event in list(cls._status_changed_events.items()):
+            if model is cls:
+                event.set()
 
     @classmethod
     async def get_resport_step_with_status(cls, resport_step_id, time_out=60):
-        """ 如果步骤的状态是暂停，则等暂停完毕或者暂停超时结束后再返回，模拟debug """
-        while time_out >= 0:
-            report_step = await cls.filter(id=resport_step_id).first()
-            if report_step.status == "pause":  # 如果设置了当前步骤为暂停执行，则每5秒查询一次状态有没有变更
-                time_out -= 5
-                time.sleep(5)
-                if time_out >= 5:  # 最后一次循环就不重置 report_step 变量了
-                    report_step = None
-                continue
-            return report_step
+        """ 如果步骤的状态是暂停，则等暂停完毕或者暂停超时结束后再返回，模拟debug
+        等待时不阻塞事件循环：本进程修改状态时立即被唤醒，其他进程修改的状态每 pause_poll_interval 秒查询一次
+        """
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + time_out
+        key = (cls, resport_step_id)
+        event = cls._status_changed_events.setdefault(key, asyncio.Event())
+        try:
+            while True:
+                event.clear()
+                report_step = await cls.filter(id=resport_step_id).first()
+                if report_step.status != "pause":
+                    return report_step
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                try:
+                    await asyncio.wait_for(event.wait(), timeout=min(cls.pause_poll_interval, remaining))
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            cls._status_changed_events.pop(key, None)
 
         # 步骤暂停超时过后还没有放行，把后面的所有步骤都改为停止执行
         await cls.update_status(None, report_step.report_case_id, report_step.id, "stop")
@@ -133,9 +219,16 @@ class BaseReportStep(BaseModel):
             elif step_meta_data["stat"]["elapsed_ms"] > response_time_level.get("slow", 300):
                 case_summary["stat"]["response_time"]["slow"].append(report_step_id)
 
+    async def save_step_update(self, update_dict: dict):
+        """ 保存步骤的更新，有写缓冲则放到缓冲中合并写库 """
+        if self.update_buffer:
+            await self.update_buffer.add(self.__class__, self.id, update_dict)
+        else:
+            await self.__class__.filter(id=self.id).update(**update_dict)
+
     async def update_report_step_data(self, **kwargs):
         """ 更新测试数据 """
-        await self.__class__.filter(id=self.id).update(**kwargs)
+        await self.save_step_update(kwargs)
 
     async def update_test_result(self, result, step_data):
         """ 更新测试状态 """
@@ -144,7 +237,7 @@ class BaseReportStep(BaseModel):
             if isinstance(step_data, dict):
                 step_data = self.dumps(step_data)
             update_dict["step_data"] = step_data
-        await self.__class__.filter(id=self.id).update(**update_dict)
+        await self.save_step_update(update_dict)
 
     async def test_is_running(self, step_data=None):
         if isinstance(step_data, dict):
@@ -179,7 +272,7 @@ class BaseReportStep(BaseModel):
                 step_data = self.dumps(step_data)
             update_dict["step_data"] = step_data
 
-        await self.__class__.filter(id=self.id).update(**update_dict)
+        await self.save_step_update(update_dict)
 
     async def test_is_start_parse(self, step_data=None):
         if isinstance(step_data, dict):
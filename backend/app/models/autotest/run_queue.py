@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+from datetime import datetime, timedelta
+
+from ..base_model import BaseModel, fields, pydantic_model_creator
+from app.schemas.enums import RunQueueStatusEnum
+
+
+class RunQueue(BaseModel):
+    """ 测试运行队列，接口服务只负责入队，由独立的运行进程领取执行 """
+
+    test_type = fields.CharField(8, index=True, description="测试类型，api、app、ui")
+    project_id = fields.IntField(index=True, description="服务id")
+    report_id = fields.IntField(index=True, description="测试报告id")
+    run_kwargs = fields.JSONField(default={}, description="运行参数")
+    status = fields.CharEnumField(
+        RunQueueStatusEnum, default=RunQueueStatusEnum.WAITING, index=True,
+        description="运行状态，waiting：排队中、running：执行中、done：执行完毕、fail：执行失败")
+    worker_id = fields.CharField(128, null=True, description="领取执行的运行进程")
+    heartbeat_time = fields.DatetimeField(null=True, description="运行进程最后一次心跳时间")
+    start_time = fields.DatetimeField(null=True, description="开始执行时间")
+    end_time = fields.DatetimeField(null=True, description="执行结束时间")
+    retry_count = fields.IntField(default=0, description="运行进程失联后，被重新放回队列的次数")
+    error_msg = fields.TextField(null=True, default=None, description="执行失败的原因")
+
+    class Meta:
+        table = "auto_test_run_queue"
+        table_description = "测试运行队列"
+
+    @classmethod
+    async def enqueue(cls, test_type, project_id, report_id, run_kwargs, user_id=None):
+        """ 把要运行的报告放入队列 """
+        return await cls.create(
+            test_type=test_type, project_id=project_id, report_id=report_id, run_kwargs=run_kwargs,
+            create_user=user_id, update_user=user_id
+        )
+
+    @classmethod
+    async def get_running_count(cls):
+        """ 全局执行中的数量、每个服务执行中的数量 """
+        running_list = await cls.filter(status=RunQueueStatusEnum.RUNNING).values("test_type", "project_id")
+        project_running = {}
+        for running in running_list:
+            key = f'{running["test_type"]}_{running["project_id"]}'
+            project_running[key] = project_running.get(key, 0) + 1
+        return len(running_list), project_running
+
+    @classmethod
+    async def claim(cls, worker_id, queue_config, limit=1):
+        """ 按入队顺序领取待执行的数据，遵守全局和单个服务的最多同时执行数
+        用 "status=waiting" 作为条件更新，多个运行进程同时领取同一条时只有一个能成功
+        领取后再检查一次全局数量，超出则放回，避免多个进程同时领取导致超过全局限制
+        """
+        running_count, project_running = await cls.get_running_count()
+        limit = min(limit, queue_config["max_running"] - running_count)
+        if limit <= 0:
+            return []
+
+        claimed_list = []
+        waiting_list = await cls.filter(status=RunQueueStatusEnum.WAITING).order_by("id").limit(limit * 10).all()
+        for item in waiting_list:
+            key = f'{item.test_type}_{item.project_id}'
+            if project_running.get(key, 0) >= queue_config["project"].get(key, queue_config["project_max_running"]):
+                continue
+            now = datetime.now()
+            if await cls.filter(id=item.id, status=RunQueueStatusEnum.WAITING).update(
+                    status=RunQueueStatusEnum.RUNNING, worker_id=worker_id, heartbeat_time=now, start_time=now,
+                    update_time=now) != 1:
+                continue  # 已被其他运行进程领取
+
+            if (await cls.get_running_count())[0] > queue_config["max_running"]:
+                await item.release()
+                break
+            item.worker_id, item.status = worker_id, RunQueueStatusEnum.RUNNING
+            project_running[key] = project_running.get(key, 0) + 1
+            claimed_list.append(item)
+            if len(claimed_list) >= limit:
+                break
+        return claimed_list
+
+    async def release(self):
+        """ 放回队列，不计入重新排队次数 """
+        await self.__class__.filter(id=self.id, status=RunQueueStatusEnum.RUNNING).update(
+            status=RunQueueStatusEnum.WAITING, worker_id=None, heartbeat_time=None, start_time=None,
+            update_time=datetime.now())
+
+    @classmethod
+    async def heartbeat(cls, worker_id, id_list):
+        """ 刷新运行进程正在执行的数据的心跳时间 """
+        if id_list:
+            await cls.filter(id__in=id_list, worker_id=worker_id, status=RunQueueStatusEnum.RUNNING).update(
+                heartbeat_time=datetime.now())
+
+    @classmethod
+    async def requeue_orphan(cls, heartbeat_time_out, max_retry):
+        """ 运行进程失联（心跳超时）的数据重新放回队列，超过重新排队次数的置为失败
+        以心跳时间作为更新条件，多个运行进程同时处理同一条时只有一个能成功
+        返回 (重新排队的列表, 置为失败的列表)
+        """
+        requeue_list, fail_list = [], []
+        for item in await cls.filter(
+                status=RunQueueStatusEnum.RUNNING,
+                heartbeat_time__lt=datetime.now() - timedelta(seconds=heartbeat_time_out)).all():
+            query_set = cls.filter(id=item.id, status=RunQueueStatusEnum.RUNNING, heartbeat_time=item.heartbeat_time)
+            now = datetime.now()
+            if item.retry_count >= max_retry:
+                if await query_set.update(
+                        status=RunQueueStatusEnum.FAIL, error_msg=f"运行进程【{item.worker_id}】失联，且已重试{max_retry}次",
+                        end_time=now, update_time=now) == 1:
+                    fail_list.append(item)
+            elif await query_set.update(
+                    status=RunQueueStatusEnum.WAITING, worker_id=None, heartbeat_time=None, start_time=None,
+                    retry_count=item.retry_count + 1, update_time=now) == 1:
+                requeue_list.append(item)
+        return requeue_list, fail_list
+
+    async def run_finish(self, worker_id, error_msg=None):
+        """ 执行结束 """
+        await self.__class__.filter(id=self.id, worker_id=worker_id).update(
+            status=RunQueueStatusEnum.FAIL if error_msg else RunQueueStatusEnum.DONE, error_msg=error_msg,
+            end_time=datetime.now(), update_time=datetime.now()
+        )
+
+
+RunQueuePydantic = pydantic_model_creator(RunQueue, name="RunQueue")
@@ -1,10 +1,15 @@
+import time
+
 from selenium.webdriver.common.keys import Keys
 
 from ..base_model import fields, pydantic_model_creator, NumFiled
 from app.configs.config import data_type_mapping, skip_if_type_mapping, run_model, extracts_mapping, assert_mapping_list, \
     http_method, api_suite_list, ui_suite_list, run_type, ui_assert_mapping_list, ui_extract_mapping_list, \
     ui_action_mapping_list, browser_name, app_key_code, server_os_mapping, phone_os_mapping, \
-    make_user_info_mapping, make_user_language_mapping, test_type
+    make_user_info_mapping, make_user_language_mapping, test_type, config_cache_ttl
+
+# 配置值的进程内缓存，{配置名: (过期时间, 配置值)}，通过配置管理修改时主动清除，其他进程最多 config_cache_ttl 秒后生效
+_config_cache = {}
 
 class ConfigType(NumFiled):
     """ 配置类型表 """
@@ -31,7 +36,25 @@ class Config(NumFiled):
 
     @classmethod
     async def get_config(cls, name: str):
-        """ 获取配置 """
+        """ 获取配置，优先从进程内缓存取 """
+        cache = _config_cache.get(name)
+        if cache and cache[0] > time.monotonic():
+            return cache[1]
+        value = await cls.get_config_from_db(name)
+        _config_cache[name] = (time.monotonic() + config_cache_ttl, value)
+        return value
+
+    @classmethod
+    def clear_config_cache(cls, name: str = None):
+        """ 清除配置缓存，不传name则全部清除 """
+        if name is None:
+            _config_cache.clear()
+        else:
+            _config_cache.pop(name, None)
+
+    @classmethod
+    async def get_config_from_db(cls, name: str):
+        """ 从数据库获取配置 """
         data = await cls.filter(name=name).first().values("value")
         if data:
             return data["value"]
@@ -46,7 +69,15 @@ class Config(NumFiled):
                 "response_time_level": [0.5, 1, 2],
                 "pause_step_time_out": 300,
                 "appium_new_command_timeout": 120,
-                "run_time_out": 60
+                "run_time_out": 60,
+                "http_client_pool": '{"max_connections_per_host": 20, "max_keepalive_connections": 10, "keepalive_expiry": 30, "http2": false}',
+                "run_case_concurrency": '{"default": 5, "project": {}, "env": {}}',
+                "run_queue": '{"max_running": 10, "project_max_running": 3, "project": {}, "heartbeat_time_out": 60, "max_retry": 2}',
+                "report_step_buffer": '{"flush_interval": 1, "max_size": 50}',
+                "screenshot_policy": '{"mode": "always", "every_n": 5, "quality": 60}',
+                "element_wait": '{"default": {"initial_interval": 0.1, "max_interval": 1, "backoff": 1.5}, "project": {}, "element": {}}',
+                "body_log": '{"sample_rate": 1, "max_bytes": 4096, "exclude_content_type": ["multipart/form-data", "application/octet-stream", "text/event-stream", "image/", "video/", "application/zip", "application/vnd."], "route": {"/report/detail": {"max_bytes": 1024}}}',
+                "report_detail_cleanup": '{"keep_days": 15, "batch_size": 1000, "batch_interval": 0.5, "max_run_seconds": 3600, "dry_run": false}'
             }
             return default_values.get(name, "")
 
@@ -108,6 +139,63 @@ class Config(NumFiled):
     async def get_response_time_level(cls):
         return cls.loads(await cls.get_config("response_time_level"))
 
+    @classmethod
+    async def get_http_client_pool(cls):
+        """ 接口测试连接池配置，每个host的最大连接数、保持的连接数、连接保持时间、是否启用http2 """
+        return cls.loads(await cls.get_config("http_client_pool"))
+
+    @classmethod
+    async def get_run_case_concurrency(cls):
+        """ 并行执行用例的并发数，project 的 key 为 {run_type}_{project_id}，env 的 key 为运行环境code """
+        return cls.loads(await cls.get_config("run_case_concurrency"))
+
+    @classmethod
+    async def get_run_queue(cls):
+        """ 运行队列配置，全局最多同时执行数、单个服务默认最多同时执行数、指定服务的最多同时执行数、心跳超时秒数、最多重新排队次数 """
+        return cls.loads(await cls.get_config("run_queue"))
+
+    @classmethod
+    async def get_report_step_buffer(cls):
+        """ 步骤执行进度写缓冲配置，最长间隔多少秒写一次库、缓冲多少个步骤写一次库 """
+        return cls.loads(await cls.get_config("report_step_buffer"))
+
+    @classmethod
+    async def get_screenshot_policy(cls):
+        """ ui、app执行的截图策略
+        mode: always 每个步骤执行前后都截图、on_fail 只在步骤失败时截图、assert_only 只在有断言的步骤截图、every_n 每N个步骤截一次图
+        every_n: mode为every_n时的间隔步骤数
+        quality: 截图压缩为jpg的质量，1~95
+        """
+        return cls.loads(await cls.get_config("screenshot_policy"))
+
+    @classmethod
+    async def get_element_wait(cls):
+        """ ui、app查找元素的等待策略，先每 initial_interval 秒查一次，之后每次间隔乘以 backoff，最长 max_interval 秒查一次
+        project 的 key 为 {run_type}_{project_id}，element 的 key 为元素id，优先级：element > project > default
+        """
+        return cls.loads(await cls.get_config("element_wait"))
+
+    @classmethod
+    async def get_body_log(cls):
+        """ 请求、响应body的日志配置
+        sample_rate: 记录body的比例，0~1
+        max_bytes: body最多记录多少字节，超出的截断
+        exclude_content_type: 不记录body的content-type（前缀匹配）
+        route: 按接口单独设置，{接口路径包含的字符串: {上面的配置项}}
+        """
+        return cls.loads(await cls.get_config("body_log"))
+
+    @classmethod
+    async def get_report_detail_cleanup(cls):
+        """ 清理报告详细数据的配置
+        keep_days: 保留最近多少天的数据
+        batch_size: 每批删除的数据条数
+        batch_interval: 每批之间间隔的秒数，控制删除速度
+        max_run_seconds: 单次最多执行的秒数，没清理完的下次接着清理
+        dry_run: 为true时只统计会删除多少数据，不删除
+        """
+        return cls.loads(await cls.get_config("report_detail_cleanup"))
+
     @classmethod
     async def get_wait_time_out(cls):
         return await cls.get_config("wait_time_out")
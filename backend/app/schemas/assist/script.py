@@ -1,5 +1,4 @@
 import re
-import importlib
 import traceback
 
 from typing import Optional
@@ -7,7 +6,6 @@ from pydantic import Field
 
 from ..base_form import BaseForm, PaginationForm, ChangeSortForm
 from ...models.assist.model_factory import Script
-from utils.util.file_util import FileUtil
 
 
 class FindScriptForm(PaginationForm):
@@ -79,13 +77,12 @@ class CreatScriptForm(BaseForm):
                     if func_name.startswith(self.name) is False:
                         raise ValueError(f'函数【{func_name}】命名格式错误，请以【脚本名_函数名】命名')
 
-            # 把自定义函数脚本内容写入到python脚本中,
-            await Script.create_script_file(default_env)  # 重新发版时会把文件全部删除，所以全部创建
-            FileUtil.save_script_data(f'{default_env}_{self.name}', self.script_data, env=default_env)
-
-            # 动态导入脚本，语法有错误则不保存
+            # 在内存中编译执行脚本，语法有错误则不保存，与执行时使用同一套导入逻辑，mock脚本依赖请求数据，只校验语法
             try:
-                script_obj = importlib.reload(importlib.import_module(f'script_list.{default_env}_{self.name}'))
+                if self.script_type == 'mock':
+                    compile(self.script_data, f'mock_{self.name}', "exec")
+                else:
+                    await Script.compile_script(self.name, self.script_data, default_env)
             except Exception as e:
                 raise ValueError({
                     "msg": "语法错误，请检查",
@@ -94,6 +94,14 @@ class ReportStepStatusEnum(str, Enum):
     STOP = "stop"  # 中断
 
 
+class RunQueueStatusEnum(str, Enum):
+    """ 运行队列状态 """
+    WAITING = "waiting"  # 排队中
+    RUNNING = "running"  # 执行中
+    DONE = "done"  # 执行完毕
+    FAIL = "fail"  # 执行失败
+
+
 class SendReportTypeEnum(str, Enum):
     """ 发送报告方式 """
     NOT_SEND = "not_send"  # 不发送
@@ -0,0 +1,273 @@
+"""
+向量缓存
+按 (模型, 规范化后文本的哈希) 缓存向量，所有嵌入调用先查缓存，只对未命中的文本调用嵌入服务
+内存 LRU + SQLite 落盘，多进程共用同一个缓存文件，超出容量按最近访问时间淘汰
+"""
+import os
+import re
+import time
+import asyncio
+import sqlite3
+import hashlib
+import logging
+import threading
+import unicodedata
+from array import array
+from collections import OrderedDict
+from typing import List, Optional, Callable, Awaitable, Dict, Any, Tuple
+
+from app.configs.config import embedding_cache_path, embedding_cache_max_entries, embedding_cache_memory_entries
+
+logger = logging.getLogger(__name__)
+
+_whitespace_pattern = re.compile(r'\s+')
+
+
+def normalize_text(text: str) -> str:
+    """规范化文本：统一 unicode 形式、合并连续空白、去掉首尾空白，只是空白不同的文本视为同一文本"""
+    return _whitespace_pattern.sub(' ', unicodedata.normalize('NFC', text or '')).strip()
+
+
+def get_cache_key(model: str, text: str) -> str:
+    """缓存键，模型不同向量不同，需要区分"""
+    return hashlib.sha256(f'{model}\x00{normalize_text(text)}'.encode('utf-8')).hexdigest()
+
+
+class EmbeddingCache:
+    """
+    向量缓存
+
+    - 内存中保留最近使用的 memory_entries 条，命中时不访问磁盘
+    - 磁盘中最多保留 max_entries 条，超出后按最近访问时间淘汰最旧的 10%
+    - 命中时的访问时间先记在内存中，每 touch_interval 秒批量写一次
+    - 磁盘条数在进程内累计，超出容量或每 count_sync_interval 秒才 COUNT(*) 校准一次（多进程共用同一文件）
+    - 向量以 float32 存储，检索精度不受影响
+    """
+
+    touch_interval = 60
+    count_sync_interval = 600
+
+    def __init__(self, path: Optional[str], max_entries: int, memory_entries: int):
+        self.path = path
+        self.max_entries = max_entries
+        self.memory_entries = memory_entries
+        self._lock = threading.Lock()
+        self._memory: "OrderedDict[str, List[float]]" = OrderedDict()
+        self._conn = None
+        self._pending_touch: Dict[str, float] = {}  # 待写入的访问时间，{缓存键: 访问时间}
+        self._last_touch_time = time.monotonic()
+        self._disk_count = 0  # 磁盘条数估计值
+        self._count_sync_time = 0.0
+        self.memory_hit_count = self.disk_hit_count = self.miss_count = self.write_count = self.evict_count = 0
+
+        if path:
+            try:
+                os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+                self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+                self._conn.execute('PRAGMA journal_mode=WAL')
+                self._conn.execute('PRAGMA synchronous=NORMAL')
+                self._conn.execute(
+                    'CREATE TABLE IF NOT EXISTS embedding_cache ('
+                    'key TEXT PRIMARY KEY, model TEXT, vector BLOB, access_time REAL)')
+                self._conn.execute(
+                    'CREATE INDEX IF NOT EXISTS idx_embedding_cache_access_time ON embedding_cache(access_time)')
+                self._sync_count()
+            except Exception as e:
+                logger.warning(f"Failed to open embedding cache {path}, only memory cache will be used: {e}")
+                self._conn = None
+
+    def _memory_set(self, key: str, vector: List[float]):
+        self._memory[key] = vector
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+
+    def get_many(self, model: str, texts: List[str]) -> Tuple[List[str], List[Optional[List[float]]]]:
+        """
+        批量查询缓存
+
+        Args:
+            model: 模型标识
+            texts: 文本列表
+
+        Returns:
+            (缓存键列表, 向量列表)，未命中的向量为 None
+        """
+        keys = [get_cache_key(model, text) for text in texts]
+        vectors: List[Optional[List[float]]] = [None] * len(keys)
+        disk_keys = []
+        found: Dict[str, List[float]] = {}
+        with self._lock:
+            for index, key in enumerate(keys):
+                if key in self._memory:
+                    self._memory.move_to_end(key)
+                    vectors[index] = self._memory[key]
+                    self.memory_hit_count += 1
+                else:
+                    disk_keys.append(key)
+
+            if disk_keys and self._conn is not None:
+                try:
+                    unique_keys = list(dict.fromkeys(disk_keys))
+                    for start in range(0, len(unique_keys), 500):
+                        batch = unique_keys[start:start + 500]
+                        rows = self._conn.execute(
+                            f'SELECT key, vector FROM embedding_cache WHERE key IN ({",".join("?" * len(batch))})',
+                            batch).fetchall()
+                        found.update((key, array('f', vector).tolist()) for key, vector in rows)
+                    now = time.time()
+                    self._pending_touch.update((key, now) for key in found)
+                    self._flush_touch()
+                except Exception as e:
+                    logger.warning(f"Failed to read embedding cache: {e}")
+                for key, vector in found.items():
+                    self._memory_set(key, vector)
+
+            for index, key in enumerate(keys):
+                if vectors[index] is None:
+                    vectors[index] = found.get(key)
+                    if vectors[index] is None:
+                        self.miss_count += 1
+                    else:
+                        self.disk_hit_count += 1
+        return keys, vectors
+
+    def set_many(self, model: str, keys: List[str], vectors: List[List[float]]):
+        """
+        批量写入缓存
+
+        Args:
+            model: 模型标识
+            keys: 缓存键列表
+            vectors: 向量列表
+        """
+        if not keys:
+            return
+        with self._lock:
+            for key, vector in zip(keys, vectors):
+                self._memory_set(key, list(vector))
+            self.write_count += len(keys)
+            if self._conn is None:
+                return
+            try:
+                now = time.time()
+                # 相同的键向量相同，已存在的不重复写入
+                cursor = self._conn.executemany(
+                    'INSERT OR IGNORE INTO embedding_cache (key, model, vector, access_time) VALUES (?, ?, ?, ?)',
+                    [(key, model, array('f', vector).tobytes(), now) for key, vector in zip(keys, vectors)])
+                self._disk_count += max(cursor.rowcount, 0)
+                self._flush_touch()
+                self._evict()
+            except Exception as e:
+                logger.warning(f"Failed to write embedding cache: {e}")
+
+    def _sync_count(self):
+        """按 COUNT(*) 校准磁盘条数"""
+        self._disk_count = self._conn.execute('SELECT COUNT(*) FROM embedding_cache').fetchone()[0]
+        self._count_sync_time = time.monotonic()
+
+    def _flush_touch(self, force: bool = False):
+        """批量写入命中时记录的访问时间，距上次写入不到 touch_interval 秒时跳过"""
+        if not self._pending_touch or (not force and time.monotonic() - self._last_touch_time < self.touch_interval):
+            return
+        pending, self._pending_touch = self._pending_touch, {}
+        self._last_touch_time = time.monotonic()
+        self._conn.executemany(
+            'UPDATE embedding_cache SET access_time=? WHERE key=?',
+            [(access_time, key) for key, access_time in pending.items()])
+
+    def _evict(self):
+        """超出容量时按最近访问时间淘汰最旧的 10%，条数估计值超出容量或到了校准时间才查询实际条数"""
+        if time.monotonic() - self._count_sync_time > self.count_sync_interval or self._disk_count > self.max_entries:
+            self._sync_count()
+        if self._disk_count <= self.max_entries:
+            return
+        self._flush_touch(force=True)
+        evict_count = self._disk_count - self.max_entries + max(self.max_entries // 10, 1)
+        self._conn.execute(
+            'DELETE FROM embedding_cache WHERE key IN '
+            '(SELECT key FROM embedding_cache ORDER BY access_time LIMIT ?)', (evict_count,))
+        self._disk_count -= evict_count
+        self.evict_count += evict_count
+        logger.info(f"Evicted {evict_count} embeddings from cache")
+
+    def embed(self, model: str, texts: List[str], embed_func: Callable[[List[str]], List[List[float]]]) -> List[List[float]]:
+        """
+        先查缓存，只对未命中的文本调用 embed_func（同一批中重复的文本只嵌入一次）
+
+        Args:
+            model: 模型标识
+            texts: 文本列表
+            embed_func: 嵌入函数，输入文本列表，返回向量列表
+
+        Returns:
+            与 texts 一一对应的向量列表
+        """
+        keys, vectors = self.get_many(model, texts)
+        miss_keys, miss_texts = self._get_miss(keys, vectors, texts)
+        if miss_texts:
+            miss_vectors = embed_func(miss_texts)
+            self._fill(keys, vectors, miss_keys, miss_vectors)
+            self.set_many(model, miss_keys, miss_vectors)
+        return vectors
+
+    async def aembed(
+        self, model: str, texts: List[str], embed_func: Callable[[List[str]], Awaitable[List[List[float]]]]
+    ) -> List[List[float]]:
+        """embed 的异步版本，embed_func 为协程函数，读写缓存放到线程中执行，等待 SQLite 锁时不阻塞事件循环"""
+        keys, vectors = await asyncio.to_thread(self.get_many, model, texts)
+        miss_keys, miss_texts = self._get_miss(keys, vectors, texts)
+        if miss_texts:
+            miss_vectors = await embed_func(miss_texts)
+            self._fill(keys, vectors, miss_keys, miss_vectors)
+            await asyncio.to_thread(self.set_many, model, miss_keys, miss_vectors)
+        return vectors
+
+    @staticmethod
+    def _get_miss(keys, vectors, texts):
+        """未命中的键和文本，相同的键只取一次"""
+        miss = {}
+        for key, vector, text in zip(keys, vectors, texts):
+            if vector is None and key not in miss:
+                miss[key] = text
+        return list(miss.keys()), list(miss.values())
+
+    @staticmethod
+    def _fill(keys, vectors, miss_keys, miss_vectors):
+        if len(miss_keys) != len(miss_vectors):
+            raise ValueError(f"嵌入服务返回的向量数量不一致，请求 {len(miss_keys)} 条，返回 {len(miss_vectors)} 条")
+        miss_dict = dict(zip(miss_keys, miss_vectors))
+        for index, key in enumerate(keys):
+            if vectors[index] is None:
+                vectors[index] = miss_dict[key]
+
+    def clear(self):
+        """清空缓存"""
+        with self._lock:
+            self._memory.clear()
+            self._pending_touch.clear()
+            if self._conn is not None:
+                self._conn.execute('DELETE FROM embedding_cache')
+                self._disk_count = 0
+
+    def get_stat(self) -> Dict[str, Any]:
+        """缓存指标"""
+        with self._lock:
+            disk_entries = self._disk_count if self._conn is not None else None
+            hit_count = self.memory_hit_count + self.disk_hit_count
+            total = hit_count + self.miss_count
+            return {
+                "memory_entries": len(self._memory),
+                "disk_entries": disk_entries,
+                "max_entries": self.max_entries,
+                "memory_hit_count": self.memory_hit_count,
+                "disk_hit_count": self.disk_hit_count,
+                "miss_count": self.miss_count,
+                "hit_rate": round(hit_count / total, 4) if total else None,
+                "write_count": self.write_count,
+                "evict_count": self.evict_count
+            }
+
+
+# 进程内共用一个缓存实例
+embedding_cache = EmbeddingCache(embedding_cache_path, embedding_cache_max_entries, embedding_cache_memory_entries)
@@ -0,0 +1,286 @@
+"""
+向量索引
+向量归一化后连续存放在一个矩阵中，一次矩阵运算完成检索，支持增量增删和落盘
+"""
+import os
+import json
+import logging
+import threading
+from typing import List, Dict, Any, Optional, Sequence, Callable
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # Windows 下没有 fcntl，单进程运行
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+
+def normalize(embeddings) -> np.ndarray:
+    """按行归一化，零向量保持为零"""
+    matrix = np.asarray(embeddings, dtype=np.float32)
+    if matrix.ndim == 1:
+        matrix = matrix.reshape(1, -1)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1
+    return matrix / norms
+
+
+def top_k_similarity(matrix: np.ndarray, query: np.ndarray, top_k: int):
+    """矩阵与归一化后的查询向量做一次点积，取相似度最高的top_k，返回 (行号, 相似度)，按相似度倒序"""
+    if matrix.shape[0] == 0 or top_k <= 0:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+    scores = matrix @ query
+    top_k = min(top_k, scores.shape[0])
+    if top_k < scores.shape[0]:
+        rows = np.argpartition(-scores, top_k - 1)[:top_k]
+    else:
+        rows = np.arange(scores.shape[0])
+    rows = rows[np.argsort(-scores[rows], kind="stable")]
+    return rows, scores[rows]
+
+
+class EmbeddingIndex:
+    """
+    内存向量索引
+
+    - 向量在写入时归一化，检索时只需一次矩阵乘法即为余弦相似度
+    - 按容量倍增预分配矩阵，增量添加不需要每次拷贝
+    - 删除时用最后一行填补空位，保持矩阵连续
+    - 可选落盘（npy + json），重启后直接加载，不需要重新向量化；其他进程落盘后，检索、修改前按文件修改时间重新加载
+    - 多进程修改同一个索引时用 update，在文件锁内完成 重新加载→修改→落盘，不会互相覆盖
+    """
+
+    def __init__(self, dimension: Optional[int] = None, persist_path: Optional[str] = None):
+        self.dimension = dimension
+        self.persist_path = persist_path
+        self._lock = threading.RLock()
+        self._save_lock = threading.Lock()
+        self._file_mtime = None  # 最近一次加载/落盘时索引文件的修改时间
+        self._matrix = np.empty((0, dimension or 0), dtype=np.float32)
+        self._count = 0
+        self._ids: List[str] = []
+        self._id_to_row: Dict[str, int] = {}
+        self._metadata: Dict[str, Dict[str, Any]] = {}
+
+        if persist_path and os.path.exists(persist_path):
+            self.load()
+
+    def __len__(self):
+        return self._count
+
+    def __contains__(self, item_id):
+        return str(item_id) in self._id_to_row
+
+    def _reserve(self, size: int):
+        """确保矩阵容量足够"""
+        capacity = self._matrix.shape[0]
+        if size <= capacity:
+            return
+        new_matrix = np.empty((max(size, capacity * 2, 64), self.dimension), dtype=np.float32)
+        new_matrix[:self._count] = self._matrix[:self._count]
+        self._matrix = new_matrix
+
+    def add(
+        self,
+        ids: Sequence[Any],
+        embeddings: Sequence[Sequence[float]],
+        metadata_list: Optional[Sequence[Dict[str, Any]]] = None
+    ):
+        """
+        添加向量，id已存在则覆盖
+
+        Args:
+            ids: 向量ID列表
+            embeddings: 向量列表
+            metadata_list: 元数据列表
+        """
+        if not ids:
+            return
+        vectors = normalize(embeddings)
+        if len(ids) != vectors.shape[0]:
+            raise ValueError("ids 与 embeddings 数量不一致")
+
+        with self._lock:
+            if self.dimension is None:
+                self.dimension = vectors.shape[1]
+                self._matrix = np.empty((0, self.dimension), dtype=np.float32)
+            if vectors.shape[1] != self.dimension:
+                raise ValueError(f"向量维度不一致，索引为 {self.dimension}，传入为 {vectors.shape[1]}")
+
+            self._reserve(self._count + len(ids))
+            for index, item_id in enumerate(ids):
+                item_id = str(item_id)
+                row = self._id_to_row.get(item_id)
+                if row is None:
+                    row = self._count
+                    self._id_to_row[item_id] = row
+                    self._ids.append(item_id)
+                    self._count += 1
+                self._matrix[row] = vectors[index]
+                if metadata_list is not None:
+                    self._metadata[item_id] = metadata_list[index] or {}
+
+    def remove(self, ids: Sequence[Any]) -> int:
+        """
+        删除向量
+
+        Args:
+            ids: 向量ID列表
+
+        Returns:
+            实际删除的数量
+        """
+        removed = 0
+        with self._lock:
+            for item_id in ids:
+                item_id = str(item_id)
+                row = self._id_to_row.pop(item_id, None)
+                if row is None:
+                    continue
+                self._metadata.pop(item_id, None)
+                last_row = self._count - 1
+                if row != last_row:
+                    # 用最后一行填补被删除的位置
+                    last_id = self._ids[last_row]
+                    self._matrix[row] = self._matrix[last_row]
+                    self._ids[row] = last_id
+                    self._id_to_row[last_id] = row
+                self._ids.pop()
+                self._count -= 1
+                removed += 1
+        return removed
+
+    def clear(self):
+        """清空索引"""
+        with self._lock:
+            self._matrix = np.empty((0, self.dimension or 0), dtype=np.float32)
+            self._count = 0
+            self._ids = []
+            self._id_to_row = {}
+            self._metadata = {}
+
+    def search(
+        self,
+        query_embedding: Sequence[float],
+        top_k: int = 5,
+        score_threshold: Optional[float] = None
+    ) -> List[Dict[str, Any]]:
+        """
+        相似度检索
+
+        Args:
+            query_embedding: 查询向量
+            top_k: 返回结果数量
+            score_threshold: 相似度阈值
+
+        Returns:
+            [{"id": 向量ID, "similarity": 相似度, "metadata": 元数据}]，按相似度倒序
+        """
+        query = normalize(query_embedding)[0]
+        with self._lock:
+            if self._count == 0:
+                return []
+            if query.shape[0] != self.dimension:
+                raise ValueError(f"查询向量维度不一致，索引为 {self.dimension}，传入为 {query.shape[0]}")
+            rows, scores = top_k_similarity(self._matrix[:self._count], query, top_k)
+            results = []
+            for row, score in zip(rows.tolist(), scores.tolist()):
+                if score_threshold is not None and score < score_threshold:
+                    break
+                item_id = self._ids[row]
+                results.append({
+                    "id": item_id,
+                    "similarity": float(score),
+                    "metadata": self._metadata.get(item_id, {})
+                })
+            return results
+
+    def save(self, path: Optional[str] = None):
+        """
+        落盘，先写临时文件再替换，避免写一半时进程退出导致文件损坏
+
+        Args:
+            path: 保存路径，不传则使用 persist_path
+        """
+        path = path or self.persist_path
+        if not path:
+            raise ValueError("未指定索引保存路径")
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+
+        with self._lock:
+            matrix = self._matrix[:self._count].copy()
+            meta = {"dimension": self.dimension, "ids": list(self._ids), "metadata": dict(self._metadata)}
+
+        with self._save_lock:
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            with open(tmp_path, "wb") as f:
+                np.save(f, matrix, allow_pickle=False)
+            with open(f"{tmp_path}.json", "w", encoding="utf-8") as f:
+                json.dump(meta, f, ensure_ascii=False)
+            os.replace(tmp_path, path)
+            os.replace(f"{tmp_path}.json", f"{path}.json")
+            if path == self.persist_path:
+                self._file_mtime = os.path.getmtime(f"{path}.json")
+        logger.info(f"Saved embedding index to {path}: {matrix.shape[0]} vectors")
+
+    def load(self, path: Optional[str] = None):
+        """
+        从磁盘加载
+
+        Args:
+            path: 加载路径，不传则使用 persist_path
+        """
+        path = path or self.persist_path
+        with open(path, "rb") as f:
+            matrix = np.load(f, allow_pickle=False)
+        with open(f"{path}.json", "r", encoding="utf-8") as f:
+            meta = json.load(f)
+
+        with self._lock:
+            self.dimension = meta["dimension"]
+            self._matrix = np.ascontiguousarray(matrix, dtype=np.float32).reshape(-1, self.dimension or 0)
+            self._ids = meta["ids"]
+            self._count = len(self._ids)
+            self._id_to_row = {item_id: row for row, item_id in enumerate(self._ids)}
+            self._metadata = meta.get("metadata", {})
+            if path == self.persist_path:
+                self._file_mtime = os.path.getmtime(f"{path}.json")
+        logger.info(f"Loaded embedding index from {path}: {self._count} vectors")
+
+    def update(self, func: Callable, *args, **kwargs):
+        """
+        修改索引并落盘，在跨进程的文件锁内先加载其他进程的修改再执行，多进程同时修改时不会丢失彼此的数据
+        不落盘的索引直接执行
+
+        Args:
+            func: 修改索引的方法，如 self.add、self.remove
+
+        Returns:
+            func 的返回值
+        """
+        if not self.persist_path:
+            return func(*args, **kwargs)
+        os.makedirs(os.path.dirname(os.path.abspath(self.persist_path)), exist_ok=True)
+        with open(f"{self.persist_path}.lock", "w") as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)  # 关闭文件时释放
+            self.reload_if_changed()
+            result = func(*args, **kwargs)
+            self.save()
+            return result
+
+    def reload_if_changed(self) -> bool:
+        """索引文件被其他进程更新过则重新加载，返回是否重新加载"""
+        if not self.persist_path:
+            return False
+        try:
+            mtime = os.path.getmtime(f"{self.persist_path}.json")
+        except OSError:
+            return False
+        if mtime == self._file_mtime:
+            return False
+        self.load()
+        return True
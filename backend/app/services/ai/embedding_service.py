@@ -2,6 +2,7 @@
 嵌入服务
 支持多种嵌入模型的统一接口
 """
+import os
 import logging
 import asyncio
 from typing import List, Dict, Any, Optional, Union
@@ -9,6 +10,10 @@ import numpy as np
 import httpx
 from datetime import datetime
 
+from app.configs.config import basedir
+from .embedding_index import EmbeddingIndex, normalize, top_k_similarity
+from .embedding_cache import embedding_cache
+
 logger = logging.getLogger(__name__)
 
 
@@ -81,9 +86,10 @@ class EmbeddingService:
     async def create_embeddings(
         self,
         texts: Union[str, List[str]],
-        model: Optional[str] = None
+        model: Optional[str] = None,
+        use_cache: bool = True
     ) -> List[List[float]]:
-        """创建文本嵌入"""
+        """创建文本嵌入，默认先查向量缓存，只对未缓存的文本调用嵌入服务"""
         try:
             if isinstance(texts, str):
                 texts = [texts]
@@ -91,13 +97,18 @@ class EmbeddingService:
             model = model or self.config.get("model", "text-embedding-ada-002")
             
             if self.provider in ["openai", "azure_openai"]:
-                return await self._openai_embeddings(texts, model)
+                embed_func = self._openai_embeddings
             elif self.provider == "ollama":
-                return await self._ollama_embeddings(texts, model)
+                embed_func = self._ollama_embeddings
             elif self.provider == "custom":
-                return await self._custom_embeddings(texts, model)
+                embed_func = self._custom_embeddings
             else:
                 raise ValueError(f"Unsupported provider: {self.provider}")
+            
+            if not use_cache:
+                return await embed_func(texts, model)
+            cache_model = f"{self.config.get('base_url') or self.config.get('azure_endpoint') or self.provider}:{model}"
+            return await embedding_cache.aembed(cache_model, texts, lambda miss_texts: embed_func(miss_texts, model))
                 
         except Exception as e:
             logger.error(f"Create embeddings failed: {e}")
@@ -181,35 +192,62 @@ class EmbeddingService:
     async def similarity_search(
         self,
         query_embedding: List[float],
-        document_embeddings: List[List[float]],
+        document_embeddings: Union[List[List[float]], np.ndarray, EmbeddingIndex],
         top_k: int = 5
     ) -> List[Dict[str, Any]]:
-        """相似度搜索"""
+        """
+        相似度搜索，一次矩阵运算计算全部余弦相似度
+        传入 EmbeddingIndex 时直接使用写入时已归一化的矩阵，返回 [{"id", "similarity", "metadata"}]
+        传入临时的一批向量时在这里归一化，返回 [{"index": 行号, "similarity"}]
+        """
         try:
-            # 计算余弦相似度
-            similarities = []
-            query_norm = np.linalg.norm(query_embedding)
-            
-            for i, doc_embedding in enumerate(document_embeddings):
-                doc_norm = np.linalg.norm(doc_embedding)
-                if query_norm == 0 or doc_norm == 0:
-                    similarity = 0.0
-                else:
-                    similarity = np.dot(query_embedding, doc_embedding) / (query_norm * doc_norm)
-                
-                similarities.append({
-                    "index": i,
-                    "similarity": float(similarity)
-                })
-            
-            # 按相似度排序并返回top_k
-            similarities.sort(key=lambda x: x["similarity"], reverse=True)
-            return similarities[:top_k]
+            if isinstance(document_embeddings, EmbeddingIndex):
+                return document_embeddings.search(query_embedding, top_k)
+            if len(document_embeddings) == 0:
+                return []
+            rows, scores = top_k_similarity(normalize(document_embeddings), normalize(query_embedding)[0], top_k)
+            return [
+                {"index": row, "similarity": score}
+                for row, score in zip(rows.tolist(), scores.tolist())
+            ]
             
         except Exception as e:
             logger.error(f"Similarity search failed: {e}")
             raise
     
+    async def index_texts(
+        self,
+        ids: List[Any],
+        texts: List[str],
+        metadata_list: Optional[List[Dict[str, Any]]] = None,
+        index_name: str = "default",
+        model: Optional[str] = None
+    ) -> int:
+        """向量化文本并写入向量索引，id已存在则覆盖，写入后落盘，返回写入数量"""
+        index = get_embedding_index(index_name)
+        embeddings = await self.create_embeddings(texts, model)
+        await asyncio.to_thread(index.update, index.add, ids, embeddings, metadata_list)
+        return len(ids)
+    
+    async def remove_from_index(self, ids: List[Any], index_name: str = "default") -> int:
+        """从向量索引中删除，删除后落盘，返回实际删除数量"""
+        index = get_embedding_index(index_name)
+        return await asyncio.to_thread(index.update, index.remove, ids)
+    
+    async def search(
+        self,
+        query: str,
+        top_k: int = 5,
+        index_name: str = "default",
+        score_threshold: Optional[float] = None,
+        model: Optional[str] = None
+    ) -> List[Dict[str, Any]]:
+        """向量化查询文本，在向量索引中检索，返回 [{"id", "similarity", "metadata"}]"""
+        index = get_embedding_index(index_name)
+        query_embedding = (await self.create_embeddings(query, model))[0]
+        await asyncio.to_thread(index.reload_if_changed)
+        return index.search(query_embedding, top_k, score_threshold)
+    
     async def chunk_text(
         self,
         text: str,
@@ -260,9 +298,11 @@ class EmbeddingService:
         text: str,
         chunk_size: int = 1000,
         chunk_overlap: int = 200,
-        model: Optional[str] = None
+        model: Optional[str] = None,
+        index_name: Optional[str] = None,
+        document_id: Optional[str] = None
     ) -> List[Dict[str, Any]]:
-        """处理文档：分块并生成嵌入"""
+        """处理文档：分块并生成嵌入，传了 index_name 时同时写入向量索引，分块id为 文档id:分块序号"""
         try:
             # 分块
             chunks = await self.chunk_text(text, chunk_size, chunk_overlap)
@@ -282,6 +322,16 @@ class EmbeddingService:
                 chunk["embedding_model"] = model or self.config.get("model")
                 chunk["created_at"] = datetime.now().isoformat()
             
+            if index_name:
+                index = get_embedding_index(index_name)
+                await asyncio.to_thread(
+                    index.update,
+                    index.add,
+                    [f"{document_id}:{chunk['id']}" for chunk in chunks],
+                    [chunk["embedding"] for chunk in chunks],
+                    [{"document_id": document_id, "text": chunk["text"]} for chunk in chunks]
+                )
+            
             return chunks
             
         except Exception as e:
@@ -318,6 +368,18 @@ async def get_embedding_service(config_name: str = "default") -> EmbeddingServic
     return _embedding_services[config_name]
 
 
+# 全局向量索引管理，{索引名: EmbeddingIndex}
+_embedding_indexes: Dict[str, EmbeddingIndex] = {}
+
+
+def get_embedding_index(name: str = "default", persist: bool = True) -> EmbeddingIndex:
+    """获取向量索引实例，persist为True时落盘到 uploads/embedding_index 下，启动后自动加载"""
+    if name not in _embedding_indexes:
+        persist_path = os.path.join(basedir, "uploads", "embedding_index", f"{name}.npy") if persist else None
+        _embedding_indexes[name] = EmbeddingIndex(persist_path=persist_path)
+    return _embedding_indexes[name]
+
+
 async def cleanup_embedding_services():
     """清理所有嵌入服务实例"""
     for service in _embedding_services.values():
@@ -0,0 +1,213 @@
+"""
+关键词倒排索引
+BM25 打分，支持中文分词，按文档增量维护，向量检索不可用时代替全量扫描分块
+"""
+import re
+import math
+import asyncio
+import logging
+import threading
+from collections import Counter
+from typing import List, Dict, Any, Optional, Tuple
+
+try:
+    import jieba
+    jieba.setLogLevel(logging.WARNING)
+except ImportError:  # 未安装 jieba 时中文按相邻两个字切分
+    jieba = None
+
+logger = logging.getLogger(__name__)
+
+_token_pattern = re.compile(r'[\u4e00-\u9fff]+|[a-z0-9_]+')
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    分词：英文、数字按单词切分并转小写，中文优先用 jieba 搜索引擎模式，否则切成相邻两个字（单个字保持不变）
+
+    Args:
+        text: 文本
+
+    Returns:
+        词列表
+    """
+    tokens = []
+    for segment in _token_pattern.findall((text or '').lower()):
+        if segment.isascii():
+            tokens.append(segment)
+        elif jieba is not None:
+            tokens.extend(word for word in jieba.cut_for_search(segment) if word.strip())
+        elif len(segment) == 1:
+            tokens.append(segment)
+        else:
+            tokens.extend(segment[index:index + 2] for index in range(len(segment) - 1))
+    return tokens
+
+
+class KeywordIndex:
+    """
+    单个知识库的 BM25 倒排索引
+
+    - 只存词频和分块元数据，不存分块内容，命中后再按ID查询内容
+    - 以文档为单位增量维护：对比已完成文档的 (ID, 处理完成时间)，只加载新增、重新处理的文档的分块，删除已不存在的文档
+    - 其他进程处理、删除了文档，下次检索时同样会按差异更新，不需要额外通知
+    """
+
+    k1 = 1.5
+    b = 0.75
+
+    def __init__(self, knowledge_base_id: str):
+        self.knowledge_base_id = knowledge_base_id
+        self._lock = threading.RLock()
+        self._sync_lock = asyncio.Lock()
+        self.postings: Dict[str, Dict[str, int]] = {}  # {词: {分块ID: 词频}}
+        self.chunk_length: Dict[str, int] = {}  # {分块ID: 分块词数}
+        self.chunk_terms: Dict[str, List[str]] = {}  # {分块ID: [词]}，删除时只需处理这些词的倒排表
+        self.chunk_metadata: Dict[str, Dict[str, Any]] = {}  # {分块ID: 元数据}
+        self.document_chunks: Dict[str, List[str]] = {}  # {文档ID: [分块ID]}
+        self.document_version: Dict[str, Any] = {}  # {文档ID: 处理完成时间}
+        self.total_length = 0
+
+    def __len__(self):
+        return len(self.chunk_length)
+
+    def add_document(self, document_id: str, version: Any, chunks: List[Dict[str, Any]]):
+        """
+        添加文档的分块，文档已存在则先删除
+
+        Args:
+            document_id: 文档ID
+            version: 文档版本（处理完成时间）
+            chunks: [{"id", "content", "chunk_index", "document_title"}]
+        """
+        document_id = str(document_id)
+        tokenized = [(str(chunk['id']), Counter(tokenize(chunk['content'])), chunk) for chunk in chunks]
+        with self._lock:
+            self.remove_document(document_id)
+            chunk_ids = []
+            for chunk_id, term_freq, chunk in tokenized:
+                for term, freq in term_freq.items():
+                    self.postings.setdefault(term, {})[chunk_id] = freq
+                length = sum(term_freq.values())
+                self.chunk_length[chunk_id] = length
+                self.chunk_terms[chunk_id] = list(term_freq)
+                self.total_length += length
+                self.chunk_metadata[chunk_id] = {
+                    'document_id': document_id,
+                    'document_title': chunk.get('document_title'),
+                    'chunk_index': chunk.get('chunk_index')
+                }
+                chunk_ids.append(chunk_id)
+            self.document_chunks[document_id] = chunk_ids
+            self.document_version[document_id] = version
+
+    def remove_document(self, document_id: str):
+        """
+        删除文档的所有分块
+
+        Args:
+            document_id: 文档ID
+        """
+        document_id = str(document_id)
+        with self._lock:
+            self.document_version.pop(document_id, None)
+            for chunk_id in self.document_chunks.pop(document_id, []):
+                for term in self.chunk_terms.pop(chunk_id, []):
+                    posting = self.postings.get(term)
+                    if posting is not None:
+                        posting.pop(chunk_id, None)
+                        if not posting:
+                            del self.postings[term]
+                self.total_length -= self.chunk_length.pop(chunk_id, 0)
+                self.chunk_metadata.pop(chunk_id, None)
+
+    def search(self, query: str, top_k: int = 5, score_threshold: float = 0.0) -> List[Tuple[str, float]]:
+        """
+        BM25 检索
+        分数除以查询词在理想情况下的最高分，归一化到 0~1，与向量检索的阈值含义保持接近
+
+        Args:
+            query: 查询文本
+            top_k: 返回结果数量
+            score_threshold: 分数阈值
+
+        Returns:
+            [(分块ID, 分数)]，按分数倒序
+        """
+        query_terms = set(tokenize(query))
+        with self._lock:
+            chunk_count = len(self.chunk_length)
+            if not chunk_count or not query_terms:
+                return []
+            avg_length = self.total_length / chunk_count or 1
+            scores: Dict[str, float] = {}
+            max_score = 0.0
+            for term in query_terms:
+                posting = self.postings.get(term)
+                if not posting:
+                    continue
+                idf = math.log(1 + (chunk_count - len(posting) + 0.5) / (len(posting) + 0.5))
+                max_score += idf * (self.k1 + 1)
+                for chunk_id, freq in posting.items():
+                    norm = self.k1 * (1 - self.b + self.b * self.chunk_length[chunk_id] / avg_length)
+                    scores[chunk_id] = scores.get(chunk_id, 0.0) + idf * freq * (self.k1 + 1) / (freq + norm)
+            # 查询中有索引里不存在的词时，按全部查询词的比例打折
+            coverage = sum(1 for term in query_terms if term in self.postings) / len(query_terms)
+
+        if not scores or max_score <= 0:
+            return []
+        results = [
+            (chunk_id, score / max_score * coverage) for chunk_id, score in scores.items()
+            if score / max_score * coverage >= score_threshold
+        ]
+        results.sort(key=lambda item: item[1], reverse=True)
+        return results[:top_k]
+
+    async def sync(self):
+        """按文档的处理完成时间与数据库对比，增量更新索引"""
+        from app.models.aitestrebort.knowledge import aitestrebortDocument, aitestrebortDocumentChunk
+
+        async with self._sync_lock:
+            documents = await aitestrebortDocument.filter(
+                knowledge_base_id=self.knowledge_base_id, status='completed'
+            ).values_list('id', 'title', 'processed_at')
+            current = {str(doc_id): (title, processed_at) for doc_id, title, processed_at in documents}
+
+            for document_id in set(self.document_version) - set(current):
+                self.remove_document(document_id)
+
+            changed = {
+                document_id: value for document_id, value in current.items()
+                if document_id not in self.document_version or self.document_version[document_id] != value[1]
+            }
+            if not changed:
+                return
+
+            chunk_dict: Dict[str, List[Dict[str, Any]]] = {document_id: [] for document_id in changed}
+            for chunk in await aitestrebortDocumentChunk.filter(document_id__in=list(changed)).values(
+                    'id', 'document_id', 'chunk_index', 'content'):
+                document_id = str(chunk['document_id'])
+                chunk['document_title'] = changed[document_id][0]
+                chunk_dict[document_id].append(chunk)
+
+            # 分词是 CPU 密集操作，放到线程中执行
+            for document_id, chunks in chunk_dict.items():
+                await asyncio.to_thread(self.add_document, document_id, changed[document_id][1], chunks)
+            logger.info(f"Keyword index of KB {self.knowledge_base_id} updated {len(changed)} documents, "
+                        f"total {len(self)} chunks")
+
+
+_keyword_indexes: Dict[str, KeywordIndex] = {}
+
+
+def get_keyword_index(knowledge_base_id: str) -> KeywordIndex:
+    """获取知识库的关键词索引，进程内每个知识库一个"""
+    knowledge_base_id = str(knowledge_base_id)
+    if knowledge_base_id not in _keyword_indexes:
+        _keyword_indexes[knowledge_base_id] = KeywordIndex(knowledge_base_id)
+    return _keyword_indexes[knowledge_base_id]
+
+
+def remove_keyword_index(knowledge_base_id: str) -> Optional[KeywordIndex]:
+    """删除知识库时移除索引"""
+    return _keyword_indexes.pop(str(knowledge_base_id), None)
@@ -4,6 +4,7 @@ aitestrebort 知识库管理服务
 """
 import os
 import time
+import asyncio
 import logging
 from typing import Optional, List, Dict, Any
 from fastapi import Request, Depends, UploadFile, File
@@ -16,6 +17,9 @@ from app.models.aitestrebort.knowledge import (
     aitestrebortKnowledgeQuery, aitestrebortKnowledgeConfig
 )
 from .vector_store import VectorStoreManager, KnowledgeBaseService, DocumentProcessor
+from .qdrant_manager import QdrantManager
+from .keyword_index import remove_keyword_index
+from app.services.ai.embedding_cache import embedding_cache
 from utils.logs.log import logger
 
 
@@ -387,6 +391,15 @@ async def delete_knowledge_base(request: Request, project_id: int, kb_id: str):
         # 删除知识库（级联删除文档和分块）
         await kb.delete()
         
+        # 关闭并删除该知识库的向量集合
+        try:
+            await asyncio.to_thread(
+                QdrantManager.remove_instance, f"kb_{kb_id}", os.getenv('QDRANT_URL', None), True,
+                os.getenv('QDRANT_API_KEY', None))
+        except Exception as e:
+            logger.warning(f"Failed to delete vector collection of KB {kb_id}: {e}")
+        remove_keyword_index(kb_id)
+        
         return request.app.delete_success(data={"message": "知识库删除成功"})
         
     except DoesNotExist:
@@ -465,6 +478,7 @@ async def get_documents(request: Request, project_id: int, kb_id: str, params: d
                 'page_count': doc.page_count,
                 'word_count': doc.word_count,
                 'chunk_count': chunk_count,
+                'progress': KnowledgeBaseService.get_document_progress(doc, chunk_count),
                 'error_message': doc.error_message,
                 'uploader_name': uploader_name,
                 'uploaded_at': doc.uploaded_at.isoformat(),
@@ -946,6 +960,7 @@ async def get_document_detail(request: Request, project_id: int, kb_id: str, doc
             'page_count': doc.page_count,
             'word_count': doc.word_count,
             'chunk_count': chunk_count,
+            'progress': KnowledgeBaseService.get_document_progress(doc, chunk_count),
             'error_message': doc.error_message,
             'uploaded_at': doc.uploaded_at.isoformat(),
             'processed_at': doc.processed_at.isoformat() if doc.processed_at else None
@@ -1076,7 +1091,11 @@ async def delete_document(request: Request, project_id: int, kb_id: str, doc_id:
         if doc.file_path and os.path.exists(doc.file_path):
             os.remove(doc.file_path)
         
-        # TODO: 从向量存储中删除
+        # 从向量存储中删除
+        kb_service = KnowledgeBaseService(str(kb.id))
+        await kb_service.initialize()
+        if kb_service.qdrant_manager:
+            await asyncio.to_thread(kb_service.qdrant_manager.delete_by_document_id, str(doc.id))
         
         # 删除数据库记录（会级联删除分块）
         await doc.delete()
@@ -1185,7 +1204,7 @@ async def get_system_status(request: Request):
                 
                 # 测试嵌入服务
                 test_text = "系统健康检查测试"
-                await embedding_service.create_embeddings(test_text)
+                await embedding_service.create_embeddings(test_text, use_cache=False)
                 
                 logger.info("向量模型连接正常")
             else:
@@ -1204,7 +1223,8 @@ async def get_system_status(request: Request):
             'processing_documents': processing_docs,
             'total_chunks': total_chunks,
             'system_status': system_status,
-            'status_message': status_message
+            'status_message': status_message,
+            'embedding_cache': embedding_cache.get_stat()
         }
         
         return request.app.get_success(data=data)
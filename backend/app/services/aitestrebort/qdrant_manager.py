@@ -3,8 +3,10 @@ Qdrant 向量数据库管理器
 提供向量存储、检索等核心功能
 """
 import os
+import shutil
 import logging
 import hashlib
+import threading
 from typing import List, Dict, Any, Optional
 from qdrant_client import QdrantClient
 from qdrant_client.models import (
@@ -17,19 +19,26 @@ from langchain_qdrant import QdrantVectorStore
 from langchain_core.documents import Document as LangChainDocument
 from langchain.embeddings.base import Embeddings
 
+from app.configs.config import qdrant_local_path
+
 logger = logging.getLogger(__name__)
 
 
 class QdrantManager:
     """Qdrant 向量数据库管理器"""
     
+    # 进程内缓存的管理器，{(集合名称, Qdrant服务地址): QdrantManager}，复用客户端、集合和 LangChain 包装对象
+    _instances: Dict[tuple, "QdrantManager"] = {}
+    _instances_lock = threading.Lock()
+    
     def __init__(
         self,
         collection_name: str,
         embeddings: Embeddings,
         qdrant_url: Optional[str] = None,
         qdrant_api_key: Optional[str] = None,
-        vector_size: int = 1536  # OpenAI ada-002 默认维度
+        vector_size: int = 1536,  # OpenAI ada-002 默认维度
+        qdrant_path: Optional[str] = None
     ):
         """
         初始化 Qdrant 管理器
@@ -37,13 +46,16 @@ class QdrantManager:
         Args:
             collection_name: 集合名称
             embeddings: 嵌入模型
-            qdrant_url: Qdrant 服务地址（默认使用内存模式）
+            qdrant_url: Qdrant 服务地址（不传则使用本地磁盘存储）
             qdrant_api_key: Qdrant API Key
             vector_size: 向量维度
+            qdrant_path: 本地存储目录，默认为 qdrant_local_path/集合名称
         """
         self.collection_name = collection_name
         self.embeddings = embeddings
         self.vector_size = vector_size
+        self.qdrant_path = None
+        self._vector_store = None
         
         # 初始化 Qdrant 客户端
         if qdrant_url:
@@ -55,9 +67,17 @@ class QdrantManager:
             )
             logger.info(f"Connected to Qdrant server at {qdrant_url}")
         else:
-            # 使用本地内存模式（开发测试用）
-            self.client = QdrantClient(":memory:")
-            logger.info("Using Qdrant in-memory mode")
+            # 使用本地磁盘存储，每个集合一个目录，重启后向量不丢失
+            self.qdrant_path = qdrant_path or os.path.join(qdrant_local_path, collection_name)
+            os.makedirs(self.qdrant_path, exist_ok=True)
+            try:
+                self.client = QdrantClient(path=self.qdrant_path)
+            except RuntimeError as e:
+                # 本地存储有文件锁，已被其他进程打开（如多 worker 部署）
+                raise RuntimeError(
+                    f"Qdrant 本地存储 {self.qdrant_path} 已被其他进程占用，多进程部署请配置 QDRANT_URL 使用 Qdrant 服务：{e}"
+                ) from e
+            logger.info(f"Using Qdrant local storage at {self.qdrant_path}")
         
         # 确保集合存在
         self._ensure_collection()
@@ -69,6 +89,15 @@ class QdrantManager:
             collections = self.client.get_collections().collections
             collection_names = [col.name for col in collections]
             
+            if self.collection_name in collection_names:
+                # 嵌入模型更换导致维度不一致时，已有向量不可用，重建集合后由一致性校验重新向量化
+                existing_size = self.client.get_collection(self.collection_name).config.params.vectors.size
+                if existing_size != self.vector_size:
+                    logger.warning(
+                        f"Collection {self.collection_name} vector size {existing_size} != {self.vector_size}, recreating")
+                    self.client.delete_collection(self.collection_name)
+                    collection_names.remove(self.collection_name)
+            
             if self.collection_name not in collection_names:
                 # 创建集合
                 self.client.create_collection(
@@ -86,18 +115,156 @@ class QdrantManager:
             logger.error(f"Failed to ensure collection: {e}")
             raise
     
+    @classmethod
+    def get_instance(
+        cls,
+        collection_name: str,
+        embeddings: Embeddings,
+        qdrant_url: Optional[str] = None,
+        qdrant_api_key: Optional[str] = None,
+        vector_size: int = 1536
+    ) -> "QdrantManager":
+        """
+        获取进程内缓存的管理器，不存在或向量维度变化时才新建
+        
+        Args:
+            collection_name: 集合名称
+            embeddings: 嵌入模型
+            qdrant_url: Qdrant 服务地址
+            qdrant_api_key: Qdrant API Key
+            vector_size: 向量维度
+            
+        Returns:
+            QdrantManager 实例
+        """
+        key = (collection_name, qdrant_url)
+        with cls._instances_lock:
+            manager = cls._instances.get(key)
+            if manager is not None and manager.vector_size != vector_size:
+                manager.close()
+                manager = None
+            if manager is None:
+                manager = cls(
+                    collection_name=collection_name,
+                    embeddings=embeddings,
+                    qdrant_url=qdrant_url,
+                    qdrant_api_key=qdrant_api_key,
+                    vector_size=vector_size
+                )
+                cls._instances[key] = manager
+            elif manager.embeddings is not embeddings:
+                manager.embeddings = embeddings
+                manager._vector_store = None
+            return manager
+    
+    @classmethod
+    def remove_instance(
+        cls,
+        collection_name: str,
+        qdrant_url: Optional[str] = None,
+        delete_storage: bool = False,
+        qdrant_api_key: Optional[str] = None
+    ):
+        """
+        移除缓存的管理器并关闭客户端
+        
+        Args:
+            collection_name: 集合名称
+            qdrant_url: Qdrant 服务地址
+            delete_storage: 是否同时删除集合（本地模式会删除存储目录）
+            qdrant_api_key: Qdrant API Key，当前进程没有打开该集合时用新的客户端删除集合
+        """
+        with cls._instances_lock:
+            manager = cls._instances.pop((collection_name, qdrant_url), None)
+        if manager is None:
+            if not delete_storage:
+                return
+            if qdrant_url:
+                client = QdrantClient(url=qdrant_url, api_key=qdrant_api_key, timeout=60)
+                try:
+                    client.delete_collection(collection_name)
+                    logger.info(f"Deleted collection: {collection_name}")
+                finally:
+                    client.close()
+                return
+            storage_path = os.path.join(qdrant_local_path, collection_name)
+        else:
+            storage_path = manager.qdrant_path
+            if delete_storage and qdrant_url:
+                manager.client.delete_collection(collection_name)
+            manager.close()
+        
+        if delete_storage and storage_path and os.path.exists(storage_path):
+            shutil.rmtree(storage_path, ignore_errors=True)
+            logger.info(f"Deleted Qdrant local storage: {storage_path}")
+    
+    def close(self):
+        """关闭客户端，本地模式会释放存储目录的文件锁"""
+        try:
+            self.client.close()
+        except Exception as e:
+            logger.warning(f"Failed to close Qdrant client: {e}")
+    
     def get_vector_store(self) -> QdrantVectorStore:
         """
-        获取 LangChain 的 QdrantVectorStore 实例
+        获取 LangChain 的 QdrantVectorStore 实例，同一个管理器只创建一次
         
         Returns:
             QdrantVectorStore 实例
         """
-        return QdrantVectorStore(
-            client=self.client,
-            collection_name=self.collection_name,
-            embedding=self.embeddings
-        )
+        if self._vector_store is None:
+            self._vector_store = QdrantVectorStore(
+                client=self.client,
+                collection_name=self.collection_name,
+                embedding=self.embeddings
+            )
+        return self._vector_store
+    
+    def get_point_documents(self, batch_size: int = 1000) -> Dict[str, Optional[str]]:
+        """
+        获取集合中所有向量ID及其所属文档，用于与分块记录做一致性校验
+        
+        Args:
+            batch_size: 每次滚动读取的数量
+            
+        Returns:
+            {向量ID: 文档ID}，没有记录文档ID的为 None
+        """
+        point_documents, offset = {}, None
+        while True:
+            points, offset = self.client.scroll(
+                collection_name=self.collection_name,
+                limit=batch_size,
+                offset=offset,
+                with_payload=['metadata.document_id'],
+                with_vectors=False
+            )
+            for point in points:
+                document_id = ((point.payload or {}).get('metadata') or {}).get('document_id')
+                point_documents[str(point.id)] = str(document_id) if document_id else None
+            if offset is None:
+                return point_documents
+    
+    def delete_points(self, point_ids: List[str]) -> bool:
+        """
+        按向量ID删除
+        
+        Args:
+            point_ids: 向量ID列表
+            
+        Returns:
+            是否成功
+        """
+        try:
+            self.client.delete(
+                collection_name=self.collection_name,
+                points_selector=models.PointIdsList(points=point_ids)
+            )
+            logger.info(f"Deleted {len(point_ids)} vectors from {self.collection_name}")
+            return True
+        except Exception as e:
+            logger.error(f"Failed to delete vectors: {e}")
+            return False
     
     def add_documents(
         self,
@@ -140,6 +307,45 @@ class QdrantManager:
             logger.error(f"Failed to add documents: {e}")
             raise
     
+    def add_embeddings(
+        self,
+        documents: List[LangChainDocument],
+        embeddings: List[List[float]],
+        ids: List[str],
+        document_id: Optional[str] = None
+    ) -> List[str]:
+        """
+        使用已经计算好的向量添加文档，不再重复调用嵌入模型
+        payload 格式与 QdrantVectorStore 保持一致，检索时可直接使用
+        
+        Args:
+            documents: LangChain 文档列表
+            embeddings: 与文档一一对应的向量
+            ids: 与文档一一对应的向量ID
+            document_id: 文档ID（用于元数据），不传则使用文档元数据中的 document_id
+            
+        Returns:
+            向量ID列表
+        """
+        try:
+            points = []
+            for doc, vector, point_id in zip(documents, embeddings, ids):
+                metadata = dict(doc.metadata or {})
+                if document_id:
+                    metadata['document_id'] = document_id
+                points.append(PointStruct(
+                    id=point_id,
+                    vector=vector,
+                    payload={'page_content': doc.page_content, 'metadata': metadata}
+                ))
+            self.client.upsert(collection_name=self.collection_name, points=points)
+            logger.info(f"Added {len(points)} vectors to Qdrant")
+            return list(ids)
+            
+        except Exception as e:
+            logger.error(f"Failed to add embeddings: {e}")
+            raise
+    
     def similarity_search(
         self,
         query: str,
@@ -4,6 +4,7 @@
 """
 import os
 import time
+import asyncio
 import hashlib
 import logging
 import json
@@ -33,6 +34,14 @@ import requests
 import uuid
 
 from .qdrant_manager import QdrantManager
+from .keyword_index import get_keyword_index
+from app.services.ai.embedding_cache import embedding_cache
+from app.configs.config import knowledge_embedding_batch_size, qdrant_local_path
+
+try:
+    import fcntl
+except ImportError:  # Windows 下没有 fcntl
+    fcntl = None
 
 logger = logging.getLogger(__name__)
 
@@ -42,22 +51,26 @@ class DashScopeEmbeddings(Embeddings):
     阿里云百炼（DashScope）嵌入服务
     """
     
-    def __init__(self, api_key: str, model: str = "text-embedding-v1"):
+    def __init__(self, api_key: str, model: str = "text-embedding-v1", use_cache: bool = True):
         self.api_key = api_key
         self.model = model
+        self.use_cache = use_cache
         
         # DashScope API端点
         self.embeddings_url = "https://dashscope.aliyuncs.com/api/v1/services/embeddings/text-embedding/text-embedding"
+        self.cache_model = f"{self.embeddings_url}:{self.model}"
         
         logger.info(f"DashScopeEmbeddings initialized: model: {self.model}")
     
     def embed_documents(self, texts: List[str]) -> List[List[float]]:
-        """嵌入多个文档"""
-        return self._embed_texts(texts)
+        """嵌入多个文档，已缓存的文本不再调用API"""
+        if not self.use_cache:
+            return self._embed_texts(texts)
+        return embedding_cache.embed(self.cache_model, texts, self._embed_texts)
     
     def embed_query(self, text: str) -> List[float]:
         """嵌入单个查询"""
-        return self._embed_texts([text])[0]
+        return self.embed_documents([text])[0]
     
     def _embed_texts(self, texts: List[str]) -> List[List[float]]:
         """调用DashScope嵌入API"""
@@ -133,9 +146,10 @@ class OllamaEmbeddings(Embeddings):
     Ollama嵌入服务,支持本地运行的BGE-M3等模型
     """
     
-    def __init__(self, base_url: str, model: str):
+    def __init__(self, base_url: str, model: str, use_cache: bool = True):
         self.base_url = base_url.rstrip('/')
         self.model = model
+        self.use_cache = use_cache
         
         # 构建嵌入API端点
         # Ollama使用 /api/embeddings 端点
@@ -143,16 +157,23 @@ class OllamaEmbeddings(Embeddings):
             self.embeddings_url = f"{self.base_url}/api/embeddings"
         else:
             self.embeddings_url = self.base_url
+        self.cache_model = f"{self.embeddings_url}:{self.model}"
             
         logger.info(f"OllamaEmbeddings initialized: {self.embeddings_url}, model: {self.model}")
     
     def embed_documents(self, texts: List[str]) -> List[List[float]]:
-        """嵌入多个文档"""
-        return [self.embed_query(text) for text in texts]
+        """嵌入多个文档，已缓存的文本不再调用API"""
+        if not self.use_cache:
+            return self._embed_uncached(texts)
+        return embedding_cache.embed(self.cache_model, texts, self._embed_uncached)
     
     def embed_query(self, text: str) -> List[float]:
         """嵌入单个查询"""
-        return self._embed_text(text)
+        return self.embed_documents([text])[0]
+    
+    def _embed_uncached(self, texts: List[str]) -> List[List[float]]:
+        """Ollama 接口一次只能嵌入一条文本"""
+        return [self._embed_text(text) for text in texts]
     
     def _embed_text(self, text: str) -> List[float]:
         """调用Ollama嵌入API"""
@@ -212,13 +233,14 @@ class CustomEmbeddings(Embeddings):
     自定义嵌入服务，支持多种API提供商
     """
     
-    def __init__(self, api_base_url: str, api_key: str, model_name: str):
+    def __init__(self, api_base_url: str, api_key: str, model_name: str, use_cache: bool = True):
         # 清理API密钥，移除可能的Bearer前缀
         if api_key and api_key.startswith("Bearer "):
             api_key = api_key[7:].strip()
         
         self.api_key = api_key
         self.model_name = model_name
+        self.use_cache = use_cache
         
         # 清理base_url，移除可能的端点路径
         base_url = api_base_url.rstrip('/')
@@ -246,16 +268,19 @@ class CustomEmbeddings(Embeddings):
         # 构建完整的嵌入API端点
         self.api_base_url = base_url
         self.embeddings_url = f"{base_url}/embeddings"
+        self.cache_model = f"{self.embeddings_url}:{self.model_name}"
         
         logger.info(f"CustomEmbeddings initialized: {self.embeddings_url}, model: {self.model_name}")
     
     def embed_documents(self, texts: List[str]) -> List[List[float]]:
-        """嵌入多个文档"""
-        return self._embed_texts(texts)
+        """嵌入多个文档，已缓存的文本不再调用API"""
+        if not self.use_cache:
+            return self._embed_texts(texts)
+        return embedding_cache.embed(self.cache_model, texts, self._embed_texts)
     
     def embed_query(self, text: str) -> List[float]:
         """嵌入单个查询"""
-        return self._embed_texts([text])[0]
+        return self.embed_documents([text])[0]
     
     def _embed_texts(self, texts: List[str]) -> List[List[float]]:
         """调用嵌入API"""
@@ -530,6 +555,7 @@ class VectorStoreManager:
     """
     
     _embeddings_cache = {}
+    _dimension_cache = {}  # {id(嵌入模型实例): 向量维度}，避免每次初始化知识库都请求一次嵌入服务
     _global_config_cache = None
     
     @classmethod
@@ -605,6 +631,24 @@ class VectorStoreManager:
         
         return cls._embeddings_cache[cache_key]
     
+    @classmethod
+    async def get_embedding_dimension(cls, embeddings: Embeddings) -> int:
+        """
+        获取嵌入模型的向量维度，每个嵌入模型实例只检测一次
+        
+        Args:
+            embeddings: 嵌入模型实例
+            
+        Returns:
+            向量维度
+        """
+        cache_key = id(embeddings)
+        if cache_key not in cls._dimension_cache:
+            test_embedding = await asyncio.to_thread(embeddings.embed_query, "test")
+            cls._dimension_cache[cache_key] = len(test_embedding)
+            logger.info(f"Detected embedding dimension: {cls._dimension_cache[cache_key]}")
+        return cls._dimension_cache[cache_key]
+    
     @classmethod
     async def test_embedding_connection(cls, config_data: Dict[str, Any]) -> Dict[str, Any]:
         """
@@ -623,14 +667,16 @@ class VectorStoreManager:
             if embedding_service == 'ollama':
                 embeddings = OllamaEmbeddings(
                     base_url=config_data.get('api_base_url', 'http://localhost:11434'),
-                    model=config_data.get('model_name', 'bge-m3')
+                    model=config_data.get('model_name', 'bge-m3'),
+                    use_cache=False
                 )
             else:
                 # OpenAI兼容的API服务
                 embeddings = CustomEmbeddings(
                     api_base_url=config_data['api_base_url'],
                     api_key=config_data.get('api_key', ''),
-                    model_name=config_data['model_name']
+                    model_name=config_data['model_name'],
+                    use_cache=False
                 )
             
             # 测试嵌入
@@ -660,6 +706,8 @@ class KnowledgeBaseService:
     知识库服务
     """
     
+    _owner_lock_file = None  # 拿到本地向量存储和启动校验的 worker 持有的文件锁
+    
     def __init__(self, knowledge_base_id: str):
         self.knowledge_base_id = knowledge_base_id
         self.processor = None
@@ -691,10 +739,7 @@ class KnowledgeBaseService:
             
             # 自动检测向量维度
             try:
-                # 生成一个测试嵌入来获取实际维度
-                test_embedding = self.embeddings.embed_query("test")
-                vector_size = len(test_embedding)
-                logger.info(f"Detected embedding dimension: {vector_size}")
+                vector_size = await VectorStoreManager.get_embedding_dimension(self.embeddings)
             except Exception as e:
                 logger.warning(f"Failed to detect embedding dimension: {e}")
                 # 回退到默认值
@@ -709,7 +754,17 @@ class KnowledgeBaseService:
                     elif 'mxbai' in global_config.model_name.lower():
                         vector_size = 1024  # mxbai-embed-large
             
-            self.qdrant_manager = QdrantManager(
+            # 本地存储同一目录只能被一个进程打开，只由拿到文件锁的 worker 打开，其他 worker 降级为关键词检索
+            if not qdrant_url and not self.try_own_vector_storage():
+                logger.info(
+                    f"Qdrant local storage is owned by another worker, KB {self.knowledge_base_id} "
+                    f"falls back to keyword search in this worker, set QDRANT_URL to share vectors between workers")
+                self.qdrant_manager = None
+                return
+            
+            # 同一进程内复用已打开的客户端和集合，本地存储在重启后可直接加载
+            self.qdrant_manager = await asyncio.to_thread(
+                QdrantManager.get_instance,
                 collection_name=collection_name,
                 embeddings=self.embeddings,
                 qdrant_url=qdrant_url,
@@ -751,7 +806,7 @@ class KnowledgeBaseService:
             if document.url:
                 # 网页内容
                 logger.info(f"Loading from URL: {document.url}")
-                langchain_docs = self.processor.load_url(document.url)
+                langchain_docs = await asyncio.to_thread(self.processor.load_url, document.url)
             elif document.file_path:
                 # 文件内容
                 logger.info(f"Loading from file: {document.file_path}")
@@ -762,8 +817,9 @@ class KnowledgeBaseService:
                     raise FileNotFoundError(f"文件不存在: {document.file_path}")
                 
                 try:
-                    langchain_docs = self.processor.load_document(
-                        document.file_path, 
+                    langchain_docs = await asyncio.to_thread(
+                        self.processor.load_document,
+                        document.file_path,
                         document.document_type
                     )
                 except ModuleNotFoundError as e:
@@ -801,50 +857,19 @@ class KnowledgeBaseService:
             
             # 分割文档
             logger.info(f"Splitting documents into chunks...")
-            chunks = self.processor.split_documents(langchain_docs)
+            chunks = await asyncio.to_thread(self.processor.split_documents, langchain_docs)
             logger.info(f"Created {len(chunks)} chunks")
             
-            # 删除旧的分块
+            # 删除旧的分块和向量
             old_chunks = await aitestrebortDocumentChunk.filter(document=document).count()
             if old_chunks > 0:
                 logger.info(f"Deleting {old_chunks} old chunks")
                 await aitestrebortDocumentChunk.filter(document=document).delete()
+                if self.qdrant_manager:
+                    await asyncio.to_thread(self.qdrant_manager.delete_by_document_id, str(document.id))
             
-            # 创建新的分块并向量化
-            logger.info(f"Creating and embedding {len(chunks)} chunks...")
-            for i, chunk in enumerate(chunks):
-                if i % 10 == 0:
-                    logger.info(f"Processing chunk {i+1}/{len(chunks)}")
-                
-                # 生成嵌入（embed_query是同步方法，不需要await）
-                embedding = self.embeddings.embed_query(chunk.page_content)
-                embedding_hash = hashlib.md5(str(embedding).encode()).hexdigest()
-                
-                # 保存分块
-                await aitestrebortDocumentChunk.create(
-                    document=document,
-                    chunk_index=i,
-                    content=chunk.page_content,
-                    embedding_hash=embedding_hash,
-                    start_index=chunk.metadata.get('start_index'),
-                    end_index=chunk.metadata.get('end_index'),
-                    page_number=chunk.metadata.get('page')
-                )
-            
-            logger.info(f"All chunks created and embedded successfully")
-            
-            # 存储到 Qdrant 向量数据库
-            if self.qdrant_manager:
-                try:
-                    logger.info("Storing vectors to Qdrant...")
-                    vector_ids = self.qdrant_manager.add_documents(
-                        documents=chunks,
-                        document_id=str(document.id)
-                    )
-                    logger.info(f"Successfully stored {len(vector_ids)} vectors to Qdrant")
-                except Exception as e:
-                    logger.error(f"Failed to store vectors to Qdrant: {e}")
-                    # 不影响文档处理流程，继续执行
+            # 分批向量化，每个分块只嵌入一次，同一份向量同时用于分块记录和 Qdrant
+            await self.embed_and_save_chunks(document, chunks)
             
             # 更新文档状态
             from datetime import datetime
@@ -879,6 +904,155 @@ class KnowledgeBaseService:
                 'chunks_count': 0
             }
     
+    async def embed_and_save_chunks(self, document, chunks: List[LangChainDocument]):
+        """
+        分批向量化分块：嵌入请求放到线程中执行，不阻塞事件循环
+        分块总数记录在文档上，每批向量化完成后批量写入分块记录、写入 Qdrant，已保存的分块数即为处理进度
+        
+        Args:
+            document: 文档实例
+            chunks: 分块列表
+        """
+        from app.models.aitestrebort.knowledge import aitestrebortDocument, aitestrebortDocumentChunk
+        
+        document.chunk_total = len(chunks)
+        await aitestrebortDocument.filter(id=document.id).update(chunk_total=document.chunk_total)
+        for start in range(0, len(chunks), knowledge_embedding_batch_size):
+            batch = chunks[start:start + knowledge_embedding_batch_size]
+            embeddings = await asyncio.to_thread(
+                self.embeddings.embed_documents, [chunk.page_content for chunk in batch])
+            chunk_ids = [uuid.uuid4() for _ in batch]
+            
+            await aitestrebortDocumentChunk.bulk_create([
+                aitestrebortDocumentChunk(
+                    id=chunk_id,
+                    document=document,
+                    chunk_index=start + index,
+                    content=chunk.page_content,
+                    vector_id=str(chunk_id) if self.qdrant_manager else None,
+                    embedding_hash=hashlib.md5(str(embedding).encode()).hexdigest(),
+                    start_index=chunk.metadata.get('start_index'),
+                    end_index=chunk.metadata.get('end_index'),
+                    page_number=chunk.metadata.get('page')
+                ) for index, (chunk, embedding, chunk_id) in enumerate(zip(batch, embeddings, chunk_ids))
+            ])
+            
+            # 存储到 Qdrant 向量数据库，失败不影响文档处理流程
+            if self.qdrant_manager:
+                try:
+                    await asyncio.to_thread(
+                        self.qdrant_manager.add_embeddings,
+                        batch, embeddings, [str(chunk_id) for chunk_id in chunk_ids], str(document.id)
+                    )
+                except Exception as e:
+                    logger.error(f"Failed to store vectors to Qdrant: {e}")
+            
+            logger.info(f"Embedded chunks {start + len(batch)}/{len(chunks)} of document {document.id}")
+    
+    async def sync_vectors(self) -> Dict[str, int]:
+        """
+        校验 Qdrant 中的向量与分块记录是否一致：
+        缺失向量的分块（如存储目录丢失、更换嵌入模型后集合被重建）重新向量化写入，
+        已删除文档的向量、已完成文档中没有对应分块的向量删除，处理中、待处理、失败的文档不动
+        
+        Returns:
+            {"missing": 补齐的向量数, "orphan": 删除的向量数}
+        """
+        from app.models.aitestrebort.knowledge import aitestrebortDocument, aitestrebortDocumentChunk
+        
+        result = {'missing': 0, 'orphan': 0}
+        if not self.qdrant_manager:
+            return result
+        
+        chunks = await aitestrebortDocumentChunk.filter(
+            document__knowledge_base_id=self.knowledge_base_id,
+            document__status='completed'
+        ).prefetch_related('document').all()
+        document_status = {
+            str(document_id): status for document_id, status in await aitestrebortDocument.filter(
+                knowledge_base_id=self.knowledge_base_id).values_list('id', 'status')
+        }
+        point_documents = await asyncio.to_thread(self.qdrant_manager.get_point_documents)
+        point_ids = set(point_documents)
+        chunk_dict = {str(chunk.vector_id or chunk.id): chunk for chunk in chunks}
+        
+        orphan_ids = [
+            point_id for point_id, document_id in point_documents.items()
+            if point_id not in chunk_dict and document_status.get(document_id, 'completed') == 'completed'
+        ]
+        if orphan_ids:
+            await asyncio.to_thread(self.qdrant_manager.delete_points, orphan_ids)
+            result['orphan'] = len(orphan_ids)
+        
+        missing_list = [(vector_id, chunk) for vector_id, chunk in chunk_dict.items() if vector_id not in point_ids]
+        for start in range(0, len(missing_list), knowledge_embedding_batch_size):
+            batch = missing_list[start:start + knowledge_embedding_batch_size]
+            documents = [
+                LangChainDocument(
+                    page_content=chunk.content,
+                    metadata={
+                        'source': chunk.document.title,
+                        'page': chunk.page_number,
+                        'start_index': chunk.start_index,
+                        'document_id': str(chunk.document_id)
+                    }
+                ) for _, chunk in batch
+            ]
+            embeddings = await asyncio.to_thread(
+                self.embeddings.embed_documents, [doc.page_content for doc in documents])
+            await asyncio.to_thread(
+                self.qdrant_manager.add_embeddings, documents, embeddings, [vector_id for vector_id, _ in batch])
+            result['missing'] += len(batch)
+        
+        if result['missing'] or result['orphan']:
+            logger.info(f"Synced vectors for KB {self.knowledge_base_id}: {result}")
+        return result
+    
+    @classmethod
+    def try_own_vector_storage(cls) -> bool:
+        """
+        多 worker 时只由一个 worker 打开 Qdrant 本地存储、执行启动时的一致性校验：
+        先拿到文件锁的 worker 负责，锁持有到进程退出，重复调用直接返回结果
+        没有 fcntl 的平台（Windows，单 worker 运行）直接返回 True
+        """
+        if fcntl is None or cls._owner_lock_file is not None:
+            return True
+        os.makedirs(qdrant_local_path, exist_ok=True)
+        lock_file = open(os.path.join(qdrant_local_path, '.owner.lock'), 'w')
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            return False
+        cls._owner_lock_file = lock_file
+        return True
+    
+    @classmethod
+    async def sync_all_knowledge_bases(cls):
+        """启动时校验所有启用的知识库，只对缺失的向量重新向量化，单个知识库失败不影响其他知识库"""
+        from app.models.aitestrebort.knowledge import aitestrebortKnowledgeBase
+        
+        for kb_id in await aitestrebortKnowledgeBase.filter(is_active=True).values_list('id', flat=True):
+            try:
+                service = cls(str(kb_id))
+                await service.initialize()
+                await service.sync_vectors()
+            except Exception as e:
+                logger.error(f"Failed to sync vectors for KB {kb_id}: {e}")
+    
+    @staticmethod
+    def get_document_progress(document, chunk_count: int) -> Optional[Dict[str, int]]:
+        """
+        文档的处理进度，按文档上的分块总数和已保存的分块数计算，任意进程都能查到，不在处理中返回 None
+        
+        Args:
+            document: 文档实例
+            chunk_count: 已保存的分块数
+        """
+        if document.status != 'processing' or not document.chunk_total:
+            return None
+        return {'total': document.chunk_total, 'processed': min(chunk_count, document.chunk_total)}
+    
     async def search_knowledge(
         self,
         query: str,
@@ -896,8 +1070,6 @@ class KnowledgeBaseService:
         Returns:
             搜索结果列表
         """
-        import asyncio
-        
         try:
             if not self.qdrant_manager:
                 logger.warning("Qdrant manager not initialized, falling back to database search")
@@ -932,7 +1104,7 @@ class KnowledgeBaseService:
         score_threshold: float = 0.1
     ) -> List[Dict[str, Any]]:
         """
-        降级搜索（使用数据库文本匹配）
+        降级搜索（使用关键词倒排索引 BM25 检索）
         
         Args:
             query: 查询文本
@@ -942,85 +1114,50 @@ class KnowledgeBaseService:
         Returns:
             搜索结果列表
         """
-        from app.models.aitestrebort.knowledge import aitestrebortDocumentChunk
-        
         try:
-            # 获取所有分块
-            chunks = await aitestrebortDocumentChunk.filter(
-                document__knowledge_base_id=self.knowledge_base_id,
-                document__status='completed'
-            ).prefetch_related('document').all()
-            
-            logger.info(f"Found {len(chunks)} chunks to search")
-            
-            if not chunks:
-                logger.warning("No chunks found in knowledge base")
-                return []
-            
-            # 改进的文本匹配（支持分词）
-            logger.info("Performing improved text matching")
-            results = []
-            
-            # 分词查询
-            import re
-            query_lower = query.lower()
-            # 提取中文字符和英文单词
-            chinese_chars = re.findall(r'[\u4e00-\u9fff]+', query)
-            english_words = re.findall(r'[a-zA-Z]+', query_lower)
-            
-            query_terms = chinese_chars + english_words
-            if not query_terms:
-                query_terms = [query_lower]
-            
-            logger.info(f"Query terms: {query_terms}, score_threshold: {score_threshold}")
-            
-            matched_count = 0
-            for chunk in chunks:
-                content_lower = chunk.content.lower()
-                
-                # 计算匹配度
-                match_count = 0
-                total_match_length = 0
-                for term in query_terms:
-                    term_lower = term.lower()
-                    if term_lower in content_lower:
-                        match_count += 1
-                        # 计算匹配长度占比
-                        total_match_length += len(term)
-                
-                # 如果至少匹配一个词，就加入结果
-                if match_count > 0:
-                    # 改进的评分算法：考虑匹配词数和匹配长度
-                    term_match_score = match_count / len(query_terms)
-                    length_match_score = total_match_length / len(query)
-                    score = (term_match_score * 0.7 + length_match_score * 0.3)
-                    
-                    matched_count += 1
-                    
-                    # 应用相似度阈值
-                    if score >= score_threshold:
-                        results.append({
-                            'content': chunk.content,
-                            'score': score,
-                            'metadata': {
-                                'document_id': str(chunk.document.id),
-                                'document_title': chunk.document.title,
-                                'chunk_index': chunk.chunk_index
-                            }
-                        })
-                    else:
-                        logger.debug(f"Chunk score {score:.2f} below threshold {score_threshold}")
-            
-            logger.info(f"Matched {matched_count} chunks, {len(results)} passed threshold")
-            
-            # 按分数排序
-            results.sort(key=lambda x: x['score'], reverse=True)
-            
-            logger.info(f"Search completed, found {len(results)} matching chunks")
-            
-            # 返回前top_k个结果
-            return results[:top_k]
-            
+            return await self.keyword_search(query, top_k, score_threshold)
         except Exception as e:
             logger.error(f"Fallback search failed: {e}")
             return []
+    
+    async def keyword_search(
+        self,
+        query: str,
+        top_k: int = 5,
+        score_threshold: float = 0.1
+    ) -> List[Dict[str, Any]]:
+        """
+        关键词检索：先按文档差异增量更新倒排索引，命中后只查询前 top_k 个分块的内容
+        
+        Args:
+            query: 查询文本
+            top_k: 返回结果数量
+            score_threshold: 分数阈值（BM25 分数归一化到 0~1）
+            
+        Returns:
+            搜索结果列表
+        """
+        from app.models.aitestrebort.knowledge import aitestrebortDocumentChunk
+        
+        keyword_index = get_keyword_index(self.knowledge_base_id)
+        await keyword_index.sync()
+        hits = keyword_index.search(query, top_k, score_threshold)
+        if not hits:
+            return []
+        
+        content_dict = {
+            str(chunk_id): content for chunk_id, content in await aitestrebortDocumentChunk.filter(
+                id__in=[chunk_id for chunk_id, _ in hits]).values_list('id', 'content')
+        }
+        
+        results = []
+        for chunk_id, score in hits:
+            if chunk_id not in content_dict:  # 索引更新后分块已被删除
+                continue
+            results.append({
+                'content': content_dict[chunk_id],
+                'score': score,
+                'metadata': dict(keyword_index.chunk_metadata.get(chunk_id, {}))
+            })
+        logger.info(f"Keyword search completed, found {len(results)} matching chunks")
+        return results
@@ -84,7 +84,7 @@ async def send_message_to_queue(request: Request, form: schema.SendMessageForm):
 
     match queue_instance["queue_type"]:
         case QueueTypeEnum.RABBIT_MQ:
-            send_res = send_rabbit_mq(
+            send_res = await send_rabbit_mq(
                 queue_instance["host"],
                 queue_instance["port"],
                 queue_instance["account"],
@@ -93,7 +93,7 @@ async def send_message_to_queue(request: Request, form: schema.SendMessageForm):
                 form.message
             )
         case QueueTypeEnum.ROCKET_MQ:
-            send_res = send_rocket_mq(
+            send_res = await send_rocket_mq(
                 queue_instance["host"],
                 queue_instance["access_id"],
                 queue_instance["access_key"],
@@ -104,7 +104,7 @@ async def send_message_to_queue(request: Request, form: schema.SendMessageForm):
                 form.options
             )
         case QueueTypeEnum.ACTIVE_MQ:
-            send_res = send_active_mq(
+            send_res = await send_active_mq(
                 queue_instance["host"],
                 queue_instance["port"],
                 queue_instance["account"],
@@ -1,7 +1,5 @@
-import importlib
-import sys
-import types
 import traceback
+from datetime import datetime
 
 from fastapi import Request, Depends
 
@@ -35,16 +33,11 @@ async def copy_script(request: Request, form: schema.GetScriptForm):
 
 async def debug_script(request: Request, form: schema.DebugScriptForm):
     script = await Script.validate_is_exist("数据不存在", id=form.id)
-    name, expression = f'{form.env}_{script.name}', form.expression
-    await Script.create_script_file(form.env)  # 把自定义函数脚本内容写入到python脚本中
+    expression = form.expression
 
-    # 动态导入脚本
+    # 获取编译后的脚本函数，脚本没有修改过则直接取缓存
     try:
-        import_path = f'script_list.{name}'
-        func_list = importlib.reload(importlib.import_module(import_path))
-        module_functions_dict = {
-            name: item for name, item in vars(func_list).items() if isinstance(item, types.FunctionType)
-        }
+        module_functions_dict = await Script.get_script_functions([script.id], form.env)
         ext_func = extract_functions(expression)
         func_info = parse_function(ext_func[0])
         func_name, args, kwargs = func_info["func_name"], func_info["args"], func_info["kwargs"]
@@ -59,20 +52,24 @@ async def debug_script(request: Request, form: schema.DebugScriptForm):
             "expression": form.expression,
             "result": result,
             "script_print": script_print,
-            "script": FileUtil.get_func_data_by_script_name(f'{form.env}_{script.name}')
+            "script": FileUtil.build_script_data(script.script_data, form.env)
         })
     except Exception as e:
-        sys.stdout = sys.__stdout__  # 恢复输出到console
+        RedirectPrintLogToMemory.redirect_to_default()  # 恢复输出到console
         error_data = "\n".join("{}".format(traceback.format_exc()).split("↵"))
         request.app.logger.error(error_data)
         return request.app.fail(msg="语法错误，请检查", result={
             "env": form.env,
             "expression": form.expression,
             "result": error_data,
-            "script": FileUtil.get_func_data_by_script_name(f'{form.env}_{script.name}')
+            "script": FileUtil.build_script_data(script.script_data, form.env)
         })
 
 
+async def get_script_executor_stat(request: Request):
+    return request.app.get_success(data=Script.get_executor_stat())
+
+
 async def get_script(request: Request, form: schema.GetScriptForm = Depends()):
     script = await Script.validate_is_exist("数据不存在", id=form.id)
     return request.app.get_success(data=script)
@@ -88,7 +85,9 @@ async def add_script(request: Request, form: schema.CreatScriptForm):
 async def change_script(request: Request, form: schema.EditScriptForm):
     save_func_permissions = await Config.get_save_func_permissions()
     await form.validate_request(request.state.user, save_func_permissions)
-    await Script.filter(id=form.id).update(**form.get_update_data(request.state.user.id))
+    # 显式更新修改时间，各进程根据修改时间判断脚本缓存是否失效
+    await Script.filter(id=form.id).update(**form.get_update_data(request.state.user.id), update_time=datetime.now())
+    Script.clear_script_functions_cache(form.id)
     return request.app.put_success()
 
 
@@ -114,4 +113,5 @@ async def delete_script(request: Request, form: schema.DeleteScriptForm):
             raise ValueError(f'{name}【{project["name"]}】已引用此脚本文件，请先解除依赖再删除')
 
     await script.model_delete()
+    Script.clear_script_functions_cache(form.id)
     return request.app.delete_success()
@@ -1,11 +1,9 @@
-from fastapi import Request, Depends, BackgroundTasks
+from fastapi import Request, Depends
 
-from utils.client.run_api_test import RunCase as RunApiCase
-from utils.client.run_ui_test import RunCase as RunUiCase
 from app.schemas.enums import CaseStatusEnum
 from ...models.autotest.model_factory import ApiCaseSuite, ApiCase, ApiStep, AppCaseSuite, AppCase, AppStep, \
     UiCaseSuite, UiCase, UiStep, ApiProject, AppProject, UiProject, ApiProjectEnv, AppProjectEnv, UiProjectEnv, \
-    ApiReport, AppReport, UiReport, AppRunServer, AppRunPhone
+    ApiReport, AppReport, UiReport, AppRunServer, AppRunPhone, RunQueue
 from ...models.config.config import Config
 from ...models.config.run_env import RunEnv
 from ...models.system.user import User
@@ -198,12 +196,12 @@ async def delete_case(request: Request, form: schema.DeleteCaseForm):
     return request.app.delete_success()
 
 
-async def run_case(request: Request, form: schema.RunCaseForm, background_tasks: BackgroundTasks):
-    case_runner, project_model, project_env_model, suite_model, case_model, step_model, report_model = RunApiCase, ApiProject, ApiProjectEnv, ApiCaseSuite, ApiCase, ApiStep, ApiReport
+async def run_case(request: Request, form: schema.RunCaseForm):
+    project_model, project_env_model, suite_model, case_model, step_model, report_model = ApiProject, ApiProjectEnv, ApiCaseSuite, ApiCase, ApiStep, ApiReport
     if request.app.test_type == "app":
-        case_runner, project_model, project_env_model, suite_model, case_model, step_model, report_model = RunUiCase, AppProject, AppProjectEnv, AppCaseSuite, AppCase, AppStep, AppReport
+        project_model, project_env_model, suite_model, case_model, step_model, report_model = AppProject, AppProjectEnv, AppCaseSuite, AppCase, AppStep, AppReport
     elif request.app.test_type == "ui":
-        case_runner, project_model, project_env_model, suite_model, case_model, step_model, report_model = RunUiCase, UiProject, UiProjectEnv, UiCaseSuite, UiCase, UiStep, UiReport
+        project_model, project_env_model, suite_model, case_model, step_model, report_model = UiProject, UiProjectEnv, UiCaseSuite, UiCase, UiStep, UiReport
 
     case_id_list = [data["id"] for data in await case_model.filter(id__in=form.id_list).all().values("id")]
     if not case_id_list or len(case_id_list) == 0:
@@ -236,12 +234,12 @@ async def run_case(request: Request, form: schema.RunCaseForm, background_tasks:
             run_type="case", env=env_code, trigger_type="page", temp_variables=form.temp_variables,
             summary=summary, create_user=user_id, update_user=user_id
         )
-        # 后台任务运行测试
-        background_tasks.add_task(case_runner(
-            report_id=report.id, case_id_list=case_id_list, is_async=form.is_async, env_code=env_code, env_name=env["name"],
-            browser=form.browser, temp_variables=form.temp_variables, run_type=request.app.test_type,
-            appium_config=appium_config, insert_to=form.insert_to
-        ).parse_and_run)
+        # 放入运行队列，由运行进程领取执行
+        await RunQueue.enqueue(request.app.test_type, suite["project_id"], report.id, {
+            "case_id_list": case_id_list, "is_async": form.is_async, "env_code": env_code, "env_name": env["name"],
+            "browser": form.browser, "temp_variables": form.temp_variables, "appium_config": appium_config,
+            "insert_to": form.insert_to
+        }, user_id)
 
     return request.app.trigger_success({
         "batch_id": batch_id,
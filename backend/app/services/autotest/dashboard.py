@@ -3,7 +3,7 @@ from tortoise import functions, expressions
 
 
 from app.models.autotest.model_factory import ApiProject as Project, ApiModule as Module, ApiMsg as Api, \
-    ApiCase as Case, ApiStep as Step, ApiTask as Task, ApiReport as Report
+    ApiCase as Case, ApiStep as Step, ApiTask as Task, ReportStat
 from utils.util.time_util import get_now, time_calculate, get_week_start_and_end
 from app.schemas.enums import DataStatusEnum, CaseStatusEnum
 
@@ -21,9 +21,26 @@ async def get_data_by_time(model):
     ).first().values('last_day_add', 'to_day_add', 'last_week_add', 'current_week_add', 'last_month_add')
 
 
+async def get_report_data_by_time(test_type="api"):
+    """ 获取测试报告时间维度的统计，从统计汇总表取 """
+    last_start_time, last_end_time = get_week_start_and_end(1)
+    current_start_time, current_end_time = get_week_start_and_end(0)
+    time_range = {
+        "last_day_add": [time_calculate(-1), time_calculate(0)],
+        "to_day_add": [time_calculate(0), get_now()],
+        "last_week_add": [last_start_time, last_end_time],
+        "current_week_add": [current_start_time, current_end_time],
+        "last_month_add": [time_calculate(-30), get_now()]
+    }
+    return {
+        key: (await ReportStat.get_stat(test_type, start_time, end_time))["run_count"]
+        for key, (start_time, end_time) in time_range.items()
+    }
+
+
 async def get_api_test_title(request: Request):
     return request.app.get_success([
-        {"name": "report", "title": "测试报告数", "total": await Report.filter().all().count()},
+        {"name": "report", "title": "测试报告数", "total": (await ReportStat.get_stat("api"))["run_count"]},
         {"name": "api", "title": "接口数", "total": await Api.filter().all().count()},
         {"name": "case", "title": "用例数", "total": await Case.filter().all().count()},
         {"name": "step", "title": "测试步骤数", "total": await Step.filter().all().count()}
@@ -174,24 +191,17 @@ async def get_api_test_task(request: Request):
 
 
 async def get_api_test_report(request: Request):
-    res = await Report.annotate(
-        all=functions.Count('id'),
-        is_passed_count=functions.Count('id', _filter=expressions.Q(is_passed=1)),
-        not_passed_count=functions.Count('id', _filter=expressions.Q(is_passed__not=1)),
-        api_report_count=functions.Count('id', _filter=expressions.Q(run_type="api")),
-        case_report_count=functions.Count('id', _filter=expressions.Q(run_type="case")),
-        suite_report_count=functions.Count('id', _filter=expressions.Q(run_type="set")),
-        task_report_count=functions.Count('id', _filter=expressions.Q(run_type="task"))
-    ).first().values(
-        'all',
-        'is_passed_count',
-        'not_passed_count',
-        'api_report_count',
-        'case_report_count',
-        'suite_report_count',
-        'task_report_count'
-    )
-    time_data = await get_data_by_time(Report)
+    run_type_count = {stat["run_type"]: stat for stat in await ReportStat.get_stat("api", group_by=["run_type"])}
+    res = {
+        "all": sum(stat["run_count"] for stat in run_type_count.values()),
+        "is_passed_count": sum(stat["pass_count"] for stat in run_type_count.values()),
+        "not_passed_count": sum(stat["fail_count"] for stat in run_type_count.values()),
+        **{
+            f'{name}_report_count': run_type_count.get(run_type, {}).get("run_count", 0)
+            for name, run_type in [("api", "api"), ("case", "case"), ("suite", "set"), ("task", "task")]
+        }
+    }
+    time_data = await get_report_data_by_time("api")
     return request.app.success("获取成功", data={
         "title": "测试报告",
         "options": [
@@ -1,54 +1,41 @@
+import datetime
+
 from fastapi import Request, Depends
 
-from ...models.autotest.model_factory import ApiReport as Report, ApiProject as Project
+from ...models.autotest.model_factory import ApiProject as Project, ReportStat
 from app.models.config.model_factory import BusinessLine
+from app.models.system.model_factory import User
 from utils.util.time_util import time_calculate, get_now
 from ...schemas.autotest import stat as schema
 
 
-async def get_use_stat(time_slot, project_list: list = [], get_card=False):
-    """ 获取时间段的统计 """
-    page_trigger_count, page_trigger_pass_count, page_trigger_pass_rate = 0, 0, 0  # 页面触发使用次数维度
-    patrol_count, patrol_pass_count, patrol_pass_rate = 0, 0, 0  # 巡检维度
-
-    start_time, end_time = time_calculate(time_slot), get_now()
-    time_filter = {"create_time__range": [start_time, end_time]}
-
-    if get_card:
-        # 人工使用（页面触发）统计
-        page_trigger_count = await Report.filter(**time_filter, trigger_type='page').count()
-        if page_trigger_count > 0:
-            page_trigger_pass_count = await Report.filter(**time_filter, trigger_type='page', is_passed=1).count()
-            page_trigger_pass_rate = round(page_trigger_pass_count / page_trigger_count, 4)
-
-        # cron巡检统计
-        patrol_count = await Report.filter(**time_filter, trigger_type='cron').count()
-        if patrol_count > 0:
-            patrol_pass_count = await Report.filter(**time_filter, trigger_type='cron', is_passed=1).count()
-            patrol_pass_rate = round(patrol_pass_count / patrol_count, 4)
-    else:
-        if project_list:
-            # 人工使用（页面触发）统计
-            page_trigger_count = await Report.filter(**time_filter, project_id__in=project_list, trigger_type='page').count()
-            if page_trigger_count > 0:
-                page_trigger_pass_count = await Report.filter(**time_filter, project_id__in=project_list, trigger_type='page', is_passed=1).count()
-                page_trigger_pass_rate = round(page_trigger_pass_count / page_trigger_count, 4)
-
-            # cron巡检统计
-            patrol_count = await Report.filter(**time_filter, project_id__in=project_list, trigger_type='page').count()
-            if patrol_count > 0:
-                patrol_pass_count = await Report.filter(**time_filter, project_id__in=project_list, trigger_type='cron', is_passed=1).count()
-                patrol_pass_rate = round(patrol_pass_count / patrol_count, 4)
+def format_use_stat(stat_list):
+    """ 按触发方式汇总的统计转为人工使用、巡检维度的统计 """
+    count_dict = {"page": [0, 0], "cron": [0, 0]}  # {触发方式: [执行次数, 通过次数]}
+    for stat in stat_list:
+        if stat["trigger_type"] in count_dict:
+            count_dict[stat["trigger_type"]][0] += stat["run_count"]
+            count_dict[stat["trigger_type"]][1] += stat["pass_count"]
+    (page_trigger_count, page_trigger_pass_count), (patrol_count, patrol_pass_count) = count_dict["page"], count_dict["cron"]
     return {
         "page_trigger_count": page_trigger_count,
         "page_trigger_pass_count": page_trigger_pass_count,
-        "page_trigger_pass_rate": page_trigger_pass_rate,
+        "page_trigger_pass_rate": round(page_trigger_pass_count / page_trigger_count, 4) if page_trigger_count else 0,
         "patrol_count": patrol_count,
         "patrol_pass_count": patrol_pass_count,
-        "patrol_pass_rate": patrol_pass_rate
+        "patrol_pass_rate": round(patrol_pass_count / patrol_count, 4) if patrol_count else 0
     }
 
 
+async def get_use_stat(time_slot, project_list: list = [], get_card=False):
+    """ 获取时间段的统计，从统计汇总表取 """
+    if not get_card and not project_list:
+        return format_use_stat([])
+    filter_dict = {} if get_card else {"project_id__in": project_list}
+    stat_list = await ReportStat.get_stat(
+        "api", time_calculate(time_slot), get_now(), group_by=["trigger_type"], **filter_dict)
+    return format_use_stat(stat_list)
+
 
 async def get_use_card(request: Request, form: schema.UseCountForm = Depends()):
     use_stat = await get_use_stat(form.time_slot, get_card=True)
@@ -60,11 +47,18 @@ async def get_use_chart(request: Request, form: schema.UseCountForm = Depends())
     page_trigger_count_list, page_trigger_pass_count_list, page_trigger_pass_rate_list = [], [], []  # 页面使用维度
     patrol_count_list, patrol_pass_count_list, patrol_pass_rate_list = [], [], []  # 巡检维度
 
+    # 一次查出所有服务的统计，再按业务线汇总
+    project_business = {
+        project["id"]: project["business_id"] for project in await Project.filter().values("id", "business_id")}
+    business_stat_dict = {}
+    for stat in await ReportStat.get_stat(
+            "api", time_calculate(form.time_slot), get_now(), group_by=["project_id", "trigger_type"]):
+        business_stat_dict.setdefault(project_business.get(stat["project_id"]), []).append(stat)
+
     business_list = await BusinessLine.filter().values("id", "name")  # [{"id", 1, "name": "公共业务线"}]
     for business_line in business_list:
         options_list.append(business_line["name"])
-        project_id_list = await Project.filter(business_id=business_line["id"]).values("id")  # [{"id", 1}]
-        business_stat = await get_use_stat(form.time_slot, [data["id"] for data in project_id_list])
+        business_stat = format_use_stat(business_stat_dict.get(business_line["id"], []))
 
         page_trigger_count_list.append(business_stat.get("page_trigger_count", 0))
         page_trigger_pass_count_list.append(business_stat.get("page_trigger_pass_count", 0))
@@ -89,78 +83,24 @@ async def get_report_chart(request: Request, form: schema.AnalyseForm = Depends(
     filter_dict = {"project_id__in": [data["id"] for data in project_list]}
     if form.trigger_type:
         filter_dict["trigger_type"] = form.trigger_type.value
+    start_time = end_time = None
     if form.start_time:
-        # 处理日期时间格式兼容性
-        from app.tools.db_compatibility import DatabaseCompatibility
-        import datetime
-        
-        if DatabaseCompatibility.is_postgresql():
-            # PostgreSQL需要datetime对象
-            try:
-                start_dt = datetime.datetime.strptime(form.start_time, "%Y-%m-%d")
-                end_dt = datetime.datetime.strptime(form.end_time, "%Y-%m-%d")
-                # 设置结束时间为当天的23:59:59
-                end_dt = end_dt.replace(hour=23, minute=59, second=59)
-                filter_dict["create_time__range"] = [start_dt, end_dt]
-            except ValueError:
-                # 如果解析失败，尝试其他格式
-                try:
-                    start_dt = datetime.datetime.fromisoformat(form.start_time.replace('Z', '+00:00'))
-                    end_dt = datetime.datetime.fromisoformat(form.end_time.replace('Z', '+00:00'))
-                    filter_dict["create_time__range"] = [start_dt, end_dt]
-                except ValueError:
-                    # 如果都失败了，使用字符串（可能会报错，但至少有错误信息）
-                    filter_dict["create_time__range"] = [form.start_time, form.end_time]
-        else:
-            # MySQL可以使用字符串
-            filter_dict["create_time__range"] = [form.start_time, form.end_time]
-
-    # 执行次数维度统计
-    all_count = await Report.filter(**filter_dict).count()
-    pass_count = await Report.filter(**filter_dict, is_passed=1).count()
+        start_time = datetime.datetime.strptime(form.start_time[:10], "%Y-%m-%d")
+        end_time = datetime.datetime.strptime(form.end_time[:10], "%Y-%m-%d").replace(hour=23, minute=59, second=59)
+
+    # 执行次数维度统计、创建人执行次数统计，都从统计汇总表取
+    stat_list = await ReportStat.get_stat("api", start_time, end_time, group_by=["run_user"], **filter_dict)
+    all_count = sum(stat["run_count"] for stat in stat_list)
+    pass_count = sum(stat["pass_count"] for stat in stat_list)
     fail_count = all_count - pass_count
 
-    # 创建人执行次数统计 - 使用数据库兼容的SQL
-    from app.tools.db_compatibility import DatabaseCompatibility
-    
-    if DatabaseCompatibility.is_postgresql():
-        # PostgreSQL语法
-        user_count_sql = f"""
-            SELECT "user"."name" AS name, count("user"."id") AS value
-            FROM "system_user" "user",
-                 "api_test_report" "report",
-                 "api_test_project" "project"
-            WHERE "report"."project_id" = "project"."id"
-              AND "project"."business_id" = {form.business_id}
-              AND "user"."id" = "report"."create_user"
-        """
-        if form.trigger_type:
-            user_count_sql += f"""AND "report"."trigger_type" = '{form.trigger_type.value}' \n"""
-        if form.start_time:
-            # 对于PostgreSQL，使用处理过的datetime对象
-            if 'create_time__range' in filter_dict:
-                start_dt, end_dt = filter_dict['create_time__range']
-                user_count_sql += f"""AND "report"."create_time" BETWEEN '{start_dt}' AND '{end_dt}' \n"""
-        user_count_sql += """GROUP BY "report"."create_user", "user"."name" """
-    else:
-        # MySQL语法
-        user_count_sql = f"""
-            SELECT user.name AS name, count(user.id) AS value
-            FROM system_user user,
-                 api_test_report report,
-                 api_test_project project
-            WHERE report.project_id = project.id
-              AND project.business_id = {form.business_id}
-              AND user.id = report.create_user
-        """
-        if form.trigger_type:
-            user_count_sql += f"""AND report.trigger_type = '{form.trigger_type.value}' \n"""
-        if form.start_time:
-            user_count_sql += f"""AND report.create_time between '{form.start_time}' and '{form.end_time}' \n"""
-        user_count_sql += """GROUP BY report.create_user"""
-    
-    request.app.logger.info(f'api.report.stat.analyse.user_count_sql: {user_count_sql}')
-    user_count_list = await DatabaseCompatibility.execute_raw_sql(user_count_sql)
+    user_dict = {
+        user["id"]: user["name"]
+        for user in await User.filter(id__in=[stat["run_user"] for stat in stat_list]).values("id", "name")}
+    user_count_list = [
+        {"name": user_dict[stat["run_user"]], "value": stat["run_count"]}
+        for stat in stat_list if stat["run_user"] in user_dict and stat["run_count"]
+    ]
 
     return request.app.get_success({
         "use_count": {
@@ -1,14 +1,12 @@
-from fastapi import Request, Depends, BackgroundTasks
+from fastapi import Request, Depends
 
 from ...models.autotest.model_factory import ApiReport, ApiCase, ApiCaseSuite, ApiTask, AppReport, AppCase, \
     AppCaseSuite, AppTask, UiReport, UiCase, UiCaseSuite, UiTask, ApiStep, AppStep, UiStep, ApiProject, AppProject, \
-    UiProject, AppRunServer, AppRunPhone
+    UiProject, AppRunServer, AppRunPhone, RunQueue
 from ...models.config.config import Config
 from ...models.config.run_env import RunEnv
 from ...models.system.user import User
 from ...schemas.autotest import task as schema
-from utils.client.run_api_test import RunCase as RunApiCase
-from utils.client.run_ui_test import RunCase as RunUiCase
 from ...schemas.enums import DataStatusEnum
 
 
@@ -85,12 +83,12 @@ async def disable_task(request: Request, form: schema.GetTaskForm):
     return request.app.success("任务禁用成功")
 
 
-async def run_task(request: Request, form: schema.RunTaskForm, background_tasks: BackgroundTasks):
-    task_model, case_runner, project_model, suite_model, case_model, step_model, report_model = ApiTask, RunApiCase, ApiProject, ApiCaseSuite, ApiCase, ApiStep, ApiReport
+async def run_task(request: Request, form: schema.RunTaskForm):
+    task_model, project_model, suite_model, case_model, step_model, report_model = ApiTask, ApiProject, ApiCaseSuite, ApiCase, ApiStep, ApiReport
     if request.app.test_type == "app":
-        task_model, case_runner, project_model, suite_model, case_model, step_model, report_model = AppTask, RunUiCase, AppProject, AppCaseSuite, AppCase, AppStep, AppReport
+        task_model, project_model, suite_model, case_model, step_model, report_model = AppTask, AppProject, AppCaseSuite, AppCase, AppStep, AppReport
     elif request.app.test_type == "ui":
-        task_model, case_runner, project_model, suite_model, case_model, step_model, report_model = UiTask, RunUiCase, UiProject, UiCaseSuite, UiCase, UiStep, UiReport
+        task_model, project_model, suite_model, case_model, step_model, report_model = UiTask, UiProject, UiCaseSuite, UiCase, UiStep, UiReport
 
     task = await task_model.validate_is_exist("任务不存在", id=form.id_list[0])
     case_id_list = await suite_model.get_case_id(case_model, task.project_id, task.suite_ids, task.case_ids)
@@ -124,12 +122,12 @@ async def run_task(request: Request, form: schema.RunTaskForm, background_tasks:
             summary=summary, create_user=user_id, update_user=user_id
         )
 
-        # 后台任务运行测试
-        background_tasks.add_task(case_runner(
-            report_id=report.id, case_id_list=case_id_list, is_async=form.is_async, env_code=env_code, env_name=env["name"],
-            browser=form.browser or task.conf["browser"], task_dict=dict(task), temp_variables=form.temp_variables, run_type=request.app.test_type,
-            extend={}, appium_config=appium_config
-        ).parse_and_run)
+        # 放入运行队列，由运行进程领取执行
+        await RunQueue.enqueue(request.app.test_type, task.project_id, report.id, {
+            "case_id_list": case_id_list, "is_async": form.is_async, "env_code": env_code, "env_name": env["name"],
+            "browser": form.browser or task.conf["browser"], "task_id": task.id, "temp_variables": form.temp_variables,
+            "extend": {}, "appium_config": appium_config
+        }, user_id)
 
     return request.app.trigger_success({
         "batch_id": batch_id,
@@ -61,6 +61,7 @@ async def change_config_api_validator(request: Request, form: schema.AddApiDefau
     conf_value = conf.loads(conf["value"])
     conf_value.append(form.model_dump())
     await Config.filter(name='api_default_validator').update(value=conf.dumps(conf_value))
+    Config.clear_config_cache('api_default_validator')
     return request.app.put_success()
 
 
@@ -92,14 +93,17 @@ async def get_config_detail(request: Request, form: schema.GetConfigForm = Depen
 
 async def add_config(request: Request, form: schema.PostConfigForm):
     await Config.model_create(form.dict(), request.state.user)
+    Config.clear_config_cache()
     return request.app.post_success()
 
 
 async def change_config(request: Request, form: schema.PutConfigForm):
     await Config.filter(id=form.id).update(**form.get_update_data(request.state.user.id))
+    Config.clear_config_cache()  # 配置名也可能被修改，全部清除
     return request.app.put_success()
 
 
 async def delete_config(request: Request, form: schema.GetConfigByIdForm):
     await Config.filter(id=form.id).delete()
+    Config.clear_config_cache()
     return request.app.delete_success()
@@ -1,5 +1,6 @@
 import datetime
 import asyncio
+import time
 import copy
 import json
 
@@ -16,9 +17,9 @@ from ...models.autotest.step import ApiStep, UiStep, AppStep
 from ...models.autotest.suite import ApiCaseSuite, UiCaseSuite, AppCaseSuite
 from ...models.autotest.task import ApiTask, UiTask, AppTask
 from ...models.system.model_factory import ApschedulerJobs, JobRunLog
-from ...models.config.model_factory import BusinessLine
+from ...models.config.model_factory import BusinessLine, Config
 from ...models.autotest.model_factory import ApiProject as Project, ApiReport, ApiReportCase, ApiReportStep, \
-    UiReport, UiReportCase, UiReportStep, AppReport, AppReportCase, AppReportStep
+    UiReport, UiReportCase, UiReportStep, AppReport, AppReportCase, AppReportStep, ReportStat
 from utils.util.file_util import FileUtil
 from utils.message.send_report import send_business_stage_count
 from app.configs.config import job_server_host
@@ -63,39 +64,103 @@ class JobFuncs:
             "cron": "0 35 2 * * ?"
         }
         """
-        time_point = (datetime.datetime.now() - datetime.timedelta(days=15))
-
-        # 清理api测试报告数据
-        hits_report_id = await Hits.filter(test_type='api').all().values("report_id")
-        hits_report_id = [data["report_id"] for data in hits_report_id]
-        await ApiReportCase.filter(report_id__not_in=hits_report_id, create_time__lt=time_point).delete()
-        await ApiReportStep.filter(report_id__not_in=hits_report_id, create_time__lt=time_point).delete()
-
-        # 清理app测试报告数据和截图
-        hits_report_id = await Hits.filter(test_type='app').all().values("report_id")
-        hits_report_id = [data["report_id"] for data in hits_report_id]
-
-        delete_report_id = await AppReport.filter(id__not_in=hits_report_id, create_time__lt=time_point).values("id")
-        delete_report_id = [data["id"] for data in delete_report_id]
-
-        # 删除截图
-        FileUtil.delete_report_img_by_report_id(delete_report_id, 'app')
-        # 删除数据
-        await AppReportCase.filter(report_id__in=delete_report_id).delete()
-        await AppReportStep.filter(report_id__in=delete_report_id).delete()
+        cleanup = await Config.get_report_detail_cleanup()
+        time_point = datetime.datetime.now() - datetime.timedelta(days=cleanup.get("keep_days", 15))
+        dry_run = cleanup.get("dry_run", False)
+        run_log = await JobRunLog.model_create({"business_id": -99, "func_name": "cron_clear_report_detail"})
+        detail = {
+            "dry_run": dry_run,
+            "time_point": time_point.strftime("%Y-%m-%d %H:%M:%S"),
+            "finished": False,
+            "progress": await cls.get_clear_report_detail_progress(),
+            "count": {}
+        }
+        deadline = time.monotonic() + cleanup.get("max_run_seconds", 3600)
+
+        async def delete_report_img(report_model, id_list):
+            """ app、ui报告的截图按报告删除，报告数据保留 """
+            report_type = "app" if report_model is AppReport else "ui"
+            await asyncio.to_thread(FileUtil.delete_report_img_by_report_id, id_list, report_type)
+
+        async def delete_rows(model, id_list):
+            await model.filter(id__in=id_list).delete()
+
+        try:
+            for test_type, report_model, case_model, step_model in (
+                    ("api", ApiReport, ApiReportCase, ApiReportStep),
+                    ("app", AppReport, AppReportCase, AppReportStep),
+                    ("ui", UiReport, UiReportCase, UiReportStep)
+            ):
+                hits_report_id = set(await Hits.filter(test_type=test_type).values_list("report_id", flat=True))
+                table_list = [(case_model, "report_id", delete_rows), (step_model, "report_id", delete_rows)]
+                if test_type != "api":
+                    table_list.insert(0, (report_model, "id", delete_report_img))
+                for model, report_id_field, delete_func in table_list:
+                    is_finished = await cls.clear_by_id_range(
+                        model, report_id_field, delete_func, time_point, hits_report_id, cleanup, detail, run_log,
+                        deadline)
+                    if not is_finished:
+                        return await run_log.run_success(detail)
+            detail["finished"] = True
+            await run_log.run_success(detail)
+        except Exception:
+            await run_log.run_fail(detail)
+            raise
 
-        # 清理ui测试报告数据和截图
-        hits_report_id = await Hits.filter(test_type='ui').all().values("report_id")
-        hits_report_id = [data["report_id"] for data in hits_report_id]
+    @staticmethod
+    async def get_clear_report_detail_progress():
+        """ 上一次实际执行清理的进度，{表名: 已处理到的id}，试运行的不算 """
+        for run_log in await JobRunLog.filter(func_name="cron_clear_report_detail").order_by("-id").limit(20).values(
+                "detail"):
+            detail = run_log["detail"] or {}
+            if "progress" in detail and not detail.get("dry_run"):
+                return detail["progress"]
+        return {}
 
-        delete_report_id = await AppReport.filter(id__not_in=hits_report_id, create_time__lt=time_point).values("id")
-        delete_report_id = [data["id"] for data in delete_report_id]
+    @staticmethod
+    async def get_clear_end_id(model, time_point):
+        """ 创建时间早于 time_point 的最大id，id随创建时间递增，按主键二分查找，不扫表 """
+        first = await model.all().order_by("id").first().values("id", "create_time")
+        if not first or first["create_time"].replace(tzinfo=None) >= time_point:
+            return 0
+        low, high = first["id"], (await model.all().order_by("-id").first().values("id"))["id"]
+        while low < high:
+            mid = (low + high + 1) // 2
+            data = await model.filter(id__gte=mid).order_by("id").first().values("id", "create_time")
+            if data["create_time"].replace(tzinfo=None) < time_point:
+                low = data["id"]
+            else:
+                high = mid - 1
+        return low
 
-        # 删除截图
-        FileUtil.delete_report_img_by_report_id(delete_report_id, 'ui')
-        # 删除数据
-        await AppReportCase.filter(report_id__in=delete_report_id).delete()
-        await AppReportStep.filter(report_id__in=delete_report_id).delete()
+    @classmethod
+    async def clear_by_id_range(
+            cls, model, report_id_field, delete_func, time_point, hits_report_id, cleanup, detail, run_log, deadline):
+        """ 按主键范围分批清理，每批之间暂停，每批记录进度，超过执行时间则停止，返回是否已清理完
+        试运行只统计，不删除，不记录进度
+        """
+        table_name, dry_run = model._meta.db_table, detail["dry_run"]
+        batch_size, batch_interval = cleanup.get("batch_size", 1000), cleanup.get("batch_interval", 0.5)
+        last_id, end_id = detail["progress"].get(table_name, 0), await cls.get_clear_end_id(model, time_point)
+        count = detail["count"].setdefault(table_name, 0)
+        while last_id < end_id:
+            if time.monotonic() > deadline:
+                return False
+            data_list = await model.filter(id__gt=last_id, id__lte=end_id).order_by("id").limit(
+                batch_size).values_list("id", report_id_field)
+            if not data_list:
+                break
+            delete_id_list = [data_id for data_id, report_id in data_list if report_id not in hits_report_id]
+            if delete_id_list and not dry_run:
+                await delete_func(model, delete_id_list)
+            last_id = data_list[-1][0]
+            count += len(delete_id_list)
+            detail["count"][table_name] = count
+            if not dry_run:
+                detail["progress"][table_name] = last_id
+                await run_log.model_update({"detail": detail})
+            await asyncio.sleep(batch_interval)
+        return True
 
     @classmethod
     async def cron_clear_step(cls):
@@ -171,6 +236,25 @@ class JobFuncs:
         """
         await cls.run_task_report_count("cron_count_of_month", "month")
 
+    @classmethod
+    async def cron_rebuild_report_stat(cls):
+        """
+        {
+            "name": "按测试报告重新汇总前一天的统计（首次执行时补历史数据）",
+            "id": "cron_rebuild_report_stat",
+            "cron": "0 20 1 * * ?"
+        }
+        """
+        today = datetime.datetime.combine(datetime.date.today(), datetime.time.min)
+        yesterday = today - datetime.timedelta(days=1)
+        for report_model in (ApiReport, UiReport, AppReport):
+            test_type = report_model.test_type
+            # 前一天之前没有汇总数据，说明是刚上线，从头汇总（不含今天，今天的数据在报告执行完毕时已经累加）
+            if await ReportStat.filter(test_type=test_type, stat_time__lt=yesterday).exists():
+                await ReportStat.rebuild(test_type, report_model, yesterday, today)
+            else:
+                await ReportStat.rebuild(test_type, report_model, None, today)
+
     @staticmethod
     async def run_task_report_count(run_func, count_time="month"):
         """ 自动化测试记录阶段统计 """
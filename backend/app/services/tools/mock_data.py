@@ -1,31 +1,84 @@
 import time
-import importlib
+import json
+import linecache
 import traceback
 
 from fastapi import Request
 from fastapi.responses import JSONResponse
 
 from ...models.assist.model_factory import Script
-from utils.util.file_util import FileUtil
+
+
+class MockScriptCache:
+    """ mock脚本编译后缓存在内存中，按 (脚本名, 最后修改时间) 判断是否需要重新编译
+    每次请求只查脚本的修改时间，脚本被修改后自动重新编译，不再写文件、重新加载模块
+    """
+
+    def __init__(self):
+        self._cache = {}  # {脚本名: (版本, 编译后的代码)}
+        self.hit_count = self.compile_count = 0
+
+    def get(self, script_name, version):
+        cache = self._cache.get(script_name)
+        if cache and cache[0] == version:
+            self.hit_count += 1
+            return cache[1]
+
+    def set(self, script_name, version, script_data):
+        """ 编译脚本，把源码放入 linecache，出错时的堆栈能显示脚本代码 """
+        file_name = f'<mock_{script_name}>'
+        script_data = script_data or ''
+        code = compile(script_data, file_name, "exec")
+        linecache.cache[file_name] = (len(script_data), None, script_data.splitlines(True), file_name)
+        self._cache[script_name] = (version, code)
+        self.compile_count += 1
+        return code
+
+    def remove(self, script_name):
+        if self._cache.pop(script_name, None):
+            linecache.cache.pop(f'<mock_{script_name}>', None)
+
+    def get_stat(self):
+        return {"size": len(self._cache), "hit_count": self.hit_count, "compile_count": self.compile_count}
+
+
+mock_script_cache = MockScriptCache()
+
+
+async def get_request_body(request: Request):
+    """ 获取请求体，表单返回字典，json返回解析后的数据，其他返回文本 """
+    content_type = request.headers.get("content-type", "")
+    if content_type.startswith(("multipart/form-data", "application/x-www-form-urlencoded")):
+        return dict(await request.form())
+    body = await request.body()
+    if not body:
+        return {}
+    try:
+        return json.loads(body)
+    except ValueError:
+        return body.decode(errors="replace")
 
 
 async def run_script(script_name, request):
-    if script := await Script.filter(name=script_name).first() is None:
+    """ 执行mock脚本，脚本中可以直接使用 path、headers、query、body 变量，结果赋值给 result """
+    if (script := await Script.filter(name=script_name).first().values("update_time")) is None:
+        mock_script_cache.remove(script_name)
         return request.app.fail('mock脚本文件不存在')
 
     try:
-        script_file_name = f"mock_{script.name}"
-        import_path = f'script_list.{script_file_name}'
-        FileUtil.save_mock_script_data(
-            script_file_name,
-            script.script_data,
-            path=request.url.path,
-            headers=dict(request.headers),
-            query=request.query_params,
-            body=request.json or request.form
-        )
-        script_obj = importlib.reload(importlib.import_module(import_path))
-        return script_obj.result
+        version = script["update_time"]
+        if (code := mock_script_cache.get(script_name, version)) is None:
+            script_data = await Script.filter(name=script_name).first().values("script_data")
+            code = mock_script_cache.set(script_name, version, script_data["script_data"])
+        namespace = {
+            "__name__": f'script_list.mock_{script_name}',
+            "path": request.url.path,
+            "headers": dict(request.headers),
+            "query": dict(request.query_params),
+            "body": await get_request_body(request)
+        }
+        exec(code, namespace)
+        return namespace.get("result")
     except Exception as e:
         error_data = "\n".join("{}".format(traceback.format_exc()).split("↵"))
         return request.app.fail(msg="脚本执行错误，请检查", result=error_data)
@@ -79,6 +79,12 @@ if [ -d "migrations/test_platform" ]; then
     python -m aerich upgrade || echo "⚠️  迁移应用失败或无新迁移"
 fi
 
+# 补测试报告统计（统计表为空时按已有报告汇总，只需在一个服务里执行）
+if [ "${INIT_REPORT_STAT:-true}" = "true" ]; then
+    echo "📊 检查并补测试报告统计..."
+    python init_database.py --report-stat || echo "⚠️  补测试报告统计失败，可在任务管理里手动执行 cron_rebuild_report_stat"
+fi
+
 # 启动应用
 echo "🚀 启动应用服务..."
 exec "$@"
\ No newline at end of file
@@ -1,9 +1,17 @@
+import os
+import logging
 import multiprocessing
 
 from app.configs.config import main_server_port
 
 bind = f'0.0.0.0:{main_server_port}'  # 访问地址
-workers = 15 if multiprocessing.cpu_count() * 2 + 1 >= 15 else multiprocessing.cpu_count() * 2 + 1
+workers = int(os.environ.get(
+    'GUNICORN_WORKERS', 15 if multiprocessing.cpu_count() * 2 + 1 >= 15 else multiprocessing.cpu_count() * 2 + 1))
+# 知识库向量的本地存储同一目录只能被一个进程打开，多worker时只有一个worker使用向量检索，其他worker降级为关键词检索
+if workers > 1 and not os.environ.get('QDRANT_URL'):
+    logging.warning(
+        f'当前配置了{workers}个worker且未配置 QDRANT_URL，知识库只有一个worker能使用向量检索，'
+        f'其他worker降级为关键词检索，如需所有worker共用向量请配置 QDRANT_URL 使用 Qdrant 服务')
 worker_class = 'uvicorn.workers.UvicornWorker'  # 工作模式协程
 threads = 4  # 每个worker的线程数
 timeout = 120
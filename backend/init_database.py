@@ -26,6 +26,7 @@ from app.schemas.enums import DataStatusEnum
 from app.models.system.model_factory import Permission, Role, RolePermissions, User, UserRoles
 from app.models.config.model_factory import BusinessLine, ConfigType, Config, RunEnv
 from app.models.assist.model_factory import Script
+from app.models.autotest.model_factory import ApiReport, UiReport, AppReport, ReportStat
 
 
 def print_banner():
@@ -465,6 +466,28 @@ async def init_scripts():
         print(f"❌ 脚本模板创建失败: {e}")
 
 
+async def init_report_stat():
+    """补测试报告统计，统计表里没有数据的测试类型，按已执行完毕的报告从头汇总一次"""
+    print_section("补测试报告统计")
+
+    try:
+        for report_model in (ApiReport, UiReport, AppReport):
+            test_type = report_model.test_type
+            if await ReportStat.filter(test_type=test_type).exists():
+                print(f"ℹ️ 【{test_type}】已有统计数据，跳过")
+                continue
+            if not await report_model.filter(process=3, status=2).exists():
+                print(f"ℹ️ 【{test_type}】没有已执行完毕的报告，跳过")
+                continue
+            await ReportStat.rebuild(test_type, report_model)
+            print(f"✅ 【{test_type}】测试报告统计汇总完成")
+        return True
+
+    except Exception as e:
+        print(f"❌ 补测试报告统计失败: {e}")
+        return False
+
+
 async def insert_default_data():
     """插入默认数据"""
     print_section("插入默认数据")
@@ -588,6 +611,7 @@ def show_help():
     --tables, -t    仅创建数据库表结构
     --data, -d      仅插入默认数据（需要表已存在）
     --check, -c     检查数据库状态和兼容性
+    --report-stat   补测试报告统计（统计表为空时按已有报告汇总）
     --help, -h      显示此帮助信息
 
 示例:
@@ -595,6 +619,7 @@ def show_help():
     python init_database.py --tables    # 只创建表
     python init_database.py --data      # 只插入数据
     python init_database.py --check     # 检查状态
+    python init_database.py --report-stat   # 升级后补测试报告统计
 
 注意事项:
 1. 确保数据库服务已启动
@@ -614,7 +639,11 @@ async def main():
         return
     
     try:
-        if '--check' in args or '-c' in args:
+        if '--report-stat' in args:
+            await Tortoise.init(config=tortoise_orm_conf)
+            if not await init_report_stat():
+                sys.exit(1)
+        elif '--check' in args or '-c' in args:
             await Tortoise.init(config=tortoise_orm_conf)
             await check_database_status()
         elif '--tables' in args or '-t' in args:
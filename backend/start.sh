@@ -25,9 +25,16 @@ nohup python3.11 -m gunicorn -c gunicorn_job.py scheduledtask.job:job > logs/job
 JOB_PID=$!
 echo "✅ 定时任务已启动 (PID: $JOB_PID)"
 
+# 启动测试运行进程（执行接口/UI/APP自动化测试，可按需启动多个）
+echo "📝 启动测试运行进程..."
+nohup python3.11 -m utils.client.run_worker > logs/run_worker.log 2>&1 &
+WORKER_PID=$!
+echo "✅ 测试运行进程已启动 (PID: $WORKER_PID)"
+
 # 保存 PID
 echo $MAIN_PID > pids/main.pid
 echo $JOB_PID > pids/job.pid
+echo $WORKER_PID > pids/run_worker.pid
 
 echo ""
 echo "================================"
@@ -42,6 +49,7 @@ echo ""
 echo "日志文件:"
 echo "  主应用: logs/main.log"
 echo "  定时任务: logs/job.log"
+echo "  测试运行: logs/run_worker.log"
 echo ""
 echo "停止服务: ./kill.sh"
 echo ""
\ No newline at end of file
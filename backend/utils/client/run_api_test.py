@@ -1,9 +1,6 @@
 # -*- coding: utf-8 -*-
-from app.models.autotest.model_factory import ApiCaseSuite as CaseSuite, ApiMsg as Api, ApiStep as Step,\
-    ApiReportCase as ReportCase, ApiReportStep as reportStep
-from app.models.assist.model_factory import Script
+from app.models.autotest.model_factory import ApiReportCase as ReportCase, ApiReportStep as reportStep
 from app.models.config.model_factory import Config
-from app.schemas.enums import DataStatusEnum
 from utils.client.parse_model import StepModel, FormatModel
 from utils.client.run_test_runner import RunTestRunner
 from utils.logs.log import logger
@@ -33,7 +30,6 @@ class RunApi(RunTestRunner):
             self.test_plan["response_time_level"] = await Config.get_response_time_level()
             self.front_report_addr = f'{await Config.get_report_host()}{await Config.get_api_report_addr()}'
             self.test_plan["pause_step_time_out"] = await Config.get_pause_step_time_out()
-            await Script.create_script_file(self.env_code)  # 创建所有函数文件
             self.report = await self.report_model.filter(id=self.report_id).first()
             self.project = await self.get_format_project(self.report.project_id)  # 解析当前服务信息
             await self.format_data_for_template()  # 解析api
@@ -111,7 +107,6 @@ class RunCase(RunTestRunner):
         self.test_plan["response_time_level"] = await Config.get_response_time_level()
         self.front_report_addr = f'{await Config.get_report_host()}{await Config.get_api_report_addr()}'
         self.test_plan["pause_step_time_out"] = await Config.get_pause_step_time_out()
-        await Script.create_script_file(self.env_code)  # 创建所有函数文件
         self.report = await self.report_model.filter(id=self.report_id).first()
         await self.parse_all_case()
         await self.report.parse_data_finish()
@@ -179,8 +174,7 @@ class RunCase(RunTestRunner):
         case = await self.get_format_case(case_id)
 
         if self.parse_case_is_skip(case.skip_if) is not True:  # 不满足跳过条件才解析
-            step_list = await Step.filter(case_id=case.id, status=DataStatusEnum.ENABLE).order_by("num").all()
-            for step in step_list:
+            for step in await self.get_case_steps(case.id):
                 if step.quote_case:
                     await self.get_all_steps(step.quote_case)
                 else:
@@ -190,6 +184,7 @@ class RunCase(RunTestRunner):
 
     async def parse_all_case(self):
         """ 解析所有用例 """
+        await self.prefetch_case_data(self.case_id_list)  # 批量预取用例、步骤、接口、服务数据
 
         # 遍历要运行的用例
         for case_id in self.case_id_list:
@@ -233,7 +228,7 @@ class RunCase(RunTestRunner):
                         await report_case.test_is_skip()
                         continue
 
-                    case_suite = await CaseSuite.filter(id=current_case.suite_id).first()
+                    case_suite = await self.get_suite(current_case.suite_id)
                     current_project = await self.get_format_project(case_suite.project_id)
                     await self.get_all_steps(case_id)  # 递归获取测试步骤（中间有可能某些测试步骤是引用的用例）
 
@@ -242,7 +237,7 @@ class RunCase(RunTestRunner):
                     for step in self.all_case_steps:
                         step = StepModel(**dict(step))
                         step_case = await self.get_format_case(step.case_id)
-                        api_temp = await Api.filter(id=step.api_id).first()
+                        api_temp = await self.get_api(step.api_id)
                         api_project = await self.get_format_project(api_temp.project_id)
                         api_data = await self.get_format_api(api_project, api_obj=api_temp)
 
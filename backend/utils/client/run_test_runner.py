@@ -1,19 +1,17 @@
-import copy
-import types
-import importlib
-
 from app.models.autotest.model_factory import ApiProject, ApiProjectEnv, ApiCaseSuite, ApiCase, ApiStep, ApiMsg, \
     ApiReport, ApiReportCase, ApiReportStep, UiProject, UiProjectEnv, UiElement, UiCaseSuite, UiCase, UiStep, UiReport, \
     UiReportCase, UiReportStep, AppProject, AppProjectEnv, AppElement, AppCaseSuite, AppCase, AppStep, AppReport, \
     AppReportCase, AppReportStep
 from app.models.assist.hits import Hits
 from app.models.config.webhook import WebHook
-from app.schemas.enums import TriggerTypeEnum, ReceiveTypeEnum, ReportStepStatusEnum
+from app.schemas.enums import TriggerTypeEnum, ReceiveTypeEnum, ReportStepStatusEnum, DataStatusEnum
 from app.models.system.user import User
 from app.models.config.model_factory import RunEnv
 from app.models.assist.model_factory import Script
 from app.models.config.model_factory import Config
 from utils.client.test_runner.api import TestRunner
+from utils.client.test_runner.client.http import HttpClientPool
+from utils.client.test_runner.client.webdriver import screenshot_writer
 from utils.client.test_runner.utils import build_url
 from utils.client.parse_model import ProjectModel, ApiModel, CaseModel, ElementModel
 from utils.message.send_report import send_report, call_back_for_pipeline
@@ -42,6 +40,9 @@ class RunTestRunner:
         self.parsed_case_dict = {}
         self.parsed_api_dict = {}
         self.parsed_element_dict = {}
+        self.parsed_suite_dict = {}
+        self.case_step_dict = {}  # 预取的用例步骤，{用例id: [步骤]}
+        self.api_obj_dict = {}  # 预取的接口原始数据，{接口id: 接口}
         self.run_env = None
         self.report = None
         self.api_model = ApiMsg
@@ -101,6 +102,9 @@ class RunTestRunner:
         self.parsed_case_dict = {}
         self.parsed_api_dict = {}
         self.parsed_element_dict = {}
+        self.parsed_suite_dict = {}
+        self.case_step_dict = {}
+        self.api_obj_dict = {}
         self.run_env = None
 
     # async def get_report_addr(self):
@@ -118,18 +122,85 @@ class RunTestRunner:
 
     async def get_format_project(self, project_id):
         """ 从已解析的服务字典中取指定id的服务，如果没有，则取出来解析后放进去 """
+        if project_id not in self.parsed_project_dict:
+            await self.prefetch_project([project_id])
+        return self.parsed_project_dict[project_id]
+
+    async def prefetch_project(self, project_id_list):
+        """ 批量获取并解析服务，服务、服务环境、自定义函数各查一次 """
         if not self.run_env:
             self.run_env = await RunEnv.filter(code=self.env_code).first()
 
-        if project_id not in self.parsed_project_dict:
-            project = await self.project_model.filter(id=project_id).first()
-            await self.parse_functions(project.script_list)
-
-            project_env = await self.project_env_model.filter(env_id=self.run_env.id, project_id=project.id).first()
+        project_id_list = [project_id for project_id in project_id_list if project_id not in self.parsed_project_dict]
+        if not project_id_list:
+            return
+        project_list = await self.project_model.filter(id__in=project_id_list).all()
+        project_env_list = await self.project_env_model.filter(
+            env_id=self.run_env.id, project_id__in=project_id_list).all()
+        project_env_dict = {project_env.project_id: project_env for project_env in project_env_list}
+
+        script_id_list = []
+        for project in project_list:
+            script_id_list.extend(script_id for script_id in project.script_list if script_id not in script_id_list)
+        await self.parse_functions(script_id_list)
+
+        for project in project_list:
+            data = dict(project_env_dict.get(project.id)) | dict(project) | dict(self.run_env)
+            self.parsed_project_dict.update({project.id: ProjectModel(**data)})
+
+    async def prefetch_case_data(self, case_id_list):
+        """ 运行前批量预取要用到的用例、步骤、接口/元素、用例集、服务，解析时直接从内存中取，不再逐条查数据库
+        引用的用例逐层获取，每一层的用例和步骤各查一次
+        """
+        case_id_set, step_list = set(case_id_list), []
+        while case_id_set:
+            case_list = await self.case_model.filter(id__in=case_id_set).all()
+            self.parsed_case_dict.update({case.id: CaseModel(**dict(case)) for case in case_list})
+            level_step_list = await self.step_model.filter(
+                case_id__in=[case.id for case in case_list], status=DataStatusEnum.ENABLE).order_by("num").all()
+            for case in case_list:
+                self.case_step_dict.setdefault(case.id, [])
+            for step in level_step_list:
+                self.case_step_dict[step.case_id].append(step)
+            step_list.extend(level_step_list)
+            case_id_set = {step.quote_case for step in level_step_list if step.quote_case} - set(self.parsed_case_dict)
+
+        suite_id_list = list({case.suite_id for case in self.parsed_case_dict.values()})
+        suite_list = await self.suite_model.filter(id__in=suite_id_list).all()
+        self.parsed_suite_dict.update({suite.id: suite for suite in suite_list})
+        project_id_set = {suite.project_id for suite in suite_list}
 
-            data = dict(project_env) | dict(project) | dict(self.run_env)
-            self.parsed_project_dict.update({project_id: ProjectModel(**data)})
-        return self.parsed_project_dict[project_id]
+        if self.run_type == "api":
+            api_id_list = list({step.api_id for step in step_list if not step.quote_case})
+            api_list = await self.api_model.filter(id__in=api_id_list).all()
+            self.api_obj_dict.update({api.id: api for api in api_list})
+            project_id_set.update(api.project_id for api in api_list)
+        else:
+            element_id_list = list({step.element_id for step in step_list if not step.quote_case})
+            element_list = await self.element_model.filter(id__in=element_id_list).all()
+            self.parsed_element_dict.update({element.id: ElementModel(**dict(element)) for element in element_list})
+            project_id_set.update(element.project_id for element in element_list)
+
+        await self.prefetch_project(list(project_id_set))
+
+    async def get_case_steps(self, case_id):
+        """ 获取用例下启用的步骤，优先从预取的数据中取 """
+        if case_id not in self.case_step_dict:
+            self.case_step_dict[case_id] = await self.step_model.filter(
+                case_id=case_id, status=DataStatusEnum.ENABLE).order_by("num").all()
+        return self.case_step_dict[case_id]
+
+    async def get_suite(self, suite_id):
+        """ 获取用例集，优先从预取的数据中取 """
+        if suite_id not in self.parsed_suite_dict:
+            self.parsed_suite_dict[suite_id] = await self.suite_model.filter(id=suite_id).first()
+        return self.parsed_suite_dict[suite_id]
+
+    async def get_api(self, api_id):
+        """ 获取接口原始数据，优先从预取的数据中取 """
+        if api_id not in self.api_obj_dict:
+            self.api_obj_dict[api_id] = await self.api_model.filter(id=api_id).first()
+        return self.api_obj_dict[api_id]
 
     async def get_format_case(self, case_id):
         """ 从已解析的用例字典中取指定id的用例，如果没有，则取出来解析后放进去 """
@@ -160,14 +231,9 @@ class RunTestRunner:
         return self.parsed_api_dict[api_id]
 
     async def parse_functions(self, func_file_id_list):
-        """ 获取自定义函数 """
-        for func_file_id in func_file_id_list:
-            query_set = await Script.filter(id=func_file_id).values("name")
-            func_file_data = importlib.reload(
-                importlib.import_module(f'script_list.{self.env_code}_{query_set[0]["name"]}'))
-            self.test_plan["project_mapping"]["functions"].update({
-                name: item for name, item in vars(func_file_data).items() if isinstance(item, types.FunctionType)
-            })
+        """ 获取自定义函数，脚本没有修改过则直接使用缓存中编译好的函数 """
+        self.test_plan["project_mapping"]["functions"].update(
+            await Script.get_script_functions(func_file_id_list, self.env_code))
 
     def parse_case_is_skip(self, skip_if_list, server_id=None, phone_id=None):
         """ 判断是否跳过用例，暂时只支持对运行环境的判断 """
@@ -220,6 +286,8 @@ class RunTestRunner:
         logger.info(f'开始保存测试报告')
         await self.report.save_report_start()
         await self.report.update_report_result(result["result"], summary=result)
+        if getattr(self, "report_img_folder", None):  # ui、app 等截图写完再标记报告完成
+            await screenshot_writer.wait_folder(self.report_img_folder)
         await self.report.save_report_finish()
         await self.push_hit_if_fail(result["result"])
         logger.info(f'测试报告保存完成')
@@ -298,24 +366,44 @@ class RunTestRunner:
     async def run_case(self):
         """ 调 testRunner().run() 执行测试 """
         logger.info(f'\n测试执行数据：\n{self.test_plan}')
-
-        if self.test_plan.get("is_async", 0):
-            # 并行执行, 遍历case，以case为维度多线程执行，测试报告按顺序排列
-            run_case_res_dict = {}
-            await self.report.run_case_start()
-            for index, case in enumerate(self.test_plan["report_case_list"]):
-                run_case_res_dict[index] = False  # 用例运行标识，索引：是否运行完成
-                test_plan = copy.deepcopy(self.test_plan)
-                test_plan["report_case_list"] = [case]
-                # self._async_run_case(temp_case, run_case_dict, index) # TODO 并行执行
-        else:  # 串行执行
-            await self.sync_run_case()
+        if self.run_type == "api":  # 整个运行共用一个连接池，报告生成完毕后关闭
+            self.test_plan["http_client_pool"] = HttpClientPool(**await Config.get_http_client_pool())
+        self.test_plan["report_step_buffer"] = await Config.get_report_step_buffer()
+        try:
+            if self.test_plan.get("is_async", 0):  # 并行执行，以用例为维度并发执行，测试报告按用例顺序汇总
+                await self.async_run_case()
+            else:  # 串行执行
+                await self.sync_run_case()
+        finally:
+            if self.test_plan.get("http_client_pool"):
+                await self.test_plan.pop("http_client_pool").close()
+
+    async def get_run_case_concurrency(self):
+        """ 获取并行执行时的用例并发数，服务和环境都设置了并发数，则取小的那个，都没有设置则取默认值 """
+        if self.run_type not in ("api", "ui"):  # app自动化同一时间只能操作一台设备，不并行
+            return 1
+        concurrency_config = await Config.get_run_case_concurrency()
+        limit_list = [limit for limit in [
+            concurrency_config.get("project", {}).get(f'{self.run_type}_{self.report.project_id}'),
+            concurrency_config.get("env", {}).get(self.env_code)
+        ] if limit]
+        return max(int(min(limit_list) if limit_list else concurrency_config.get("default", 5)), 1)
 
     async def sync_run_case(self):
         """ 单线程运行用例 """
+        await self.run_test_runner()
+
+    async def async_run_case(self):
+        """ 并行运行用例，每条用例有自己的变量、日志和报告记录 """
+        concurrency = await self.get_run_case_concurrency()
+        logger.info(f'并行执行用例，并发数：{concurrency}')
+        await self.run_test_runner(concurrency)
+
+    async def run_test_runner(self, concurrency=1):
+        """ 执行测试并保存报告 """
         await self.report.run_case_start()
         runner = TestRunner()
-        await runner.run(self.test_plan)
+        await runner.run(self.test_plan, concurrency)
         await self.report.run_case_finish()
         logger.info(f'测试执行完成，开始保存测试报告和发送报告')
         summary = runner.summary
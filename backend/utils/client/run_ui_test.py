@@ -2,9 +2,7 @@
 import json
 
 from app.models.config.config import Config
-from app.schemas.enums import DataStatusEnum
 from app.models.autotest.model_factory import UiCaseSuite, UiStep, UiReportStep, UiReportCase, AppCaseSuite, AppStep, AppReportStep, AppReportCase, AppRunPhone
-from app.models.assist.model_factory import Script
 from utils.client.run_test_runner import RunTestRunner
 from utils.client.parse_model import StepModel, FormatModel
 from utils.client.test_runner.utils import build_url
@@ -56,7 +54,8 @@ class RunCase(RunTestRunner):
             self.front_report_addr = f'{await Config.get_report_host()}{await Config.get_app_ui_report_addr()}'
 
         self.test_plan["pause_step_time_out"] = await Config.get_pause_step_time_out()
-        await Script.create_script_file(self.env_code)  # 创建所有函数文件
+        self.test_plan["screenshot_policy"] = await Config.get_screenshot_policy()
+        self.element_wait = await Config.get_element_wait()
         if self.run_type != "ui":
             self.device_dict = {device.id: dict(device) for device in await AppRunPhone.all()}
         self.report = await self.report_model.filter(id=self.report_id).first()
@@ -64,6 +63,14 @@ class RunCase(RunTestRunner):
         await self.report.parse_data_finish()
         await self.run_case()
 
+    def get_wait_profile(self, element):
+        """ 元素的等待策略，元素单独设置的 > 元素所在服务设置的 > 默认 """
+        return {
+            **self.element_wait.get("default", {}),
+            **self.element_wait.get("project", {}).get(f'{self.run_type}_{element.project_id}', {}),
+            **self.element_wait.get("element", {}).get(str(element.id), {})
+        }
+
     async def parse_step(self, project, element, step, report_case_id):
         """ 解析测试步骤
         project: 当前步骤对应元素所在的项目(解析后的)
@@ -89,7 +96,8 @@ class RunCase(RunTestRunner):
                 "element": build_url(project.host, element.element) if element.by == "url" else element.element,
                 "text": step.send_keys,
                 "wait_time_out": float(step.wait_time_out or element.wait_time_out),
-                "report_img_folder": self.report_img_folder  # 步骤截图的存放路径
+                "report_img_folder": self.report_img_folder,  # 步骤截图的存放路径
+                "wait_profile": self.get_wait_profile(element)  # 查找元素的等待策略
             }
         }
 
@@ -212,8 +220,7 @@ class RunCase(RunTestRunner):
 
         # 不满足跳过条件才解析
         if self.parse_case_is_skip(case.skip_if, self.run_server_id, self.run_phone_id) is not True:
-            steps = await self.step_model.filter(case_id=case.id, status=DataStatusEnum.ENABLE).order_by("num").all()
-            for step in steps:
+            for step in await self.get_case_steps(case.id):
                 if step.quote_case:
                     await self.get_all_steps(step.quote_case)
                 else:
@@ -223,6 +230,7 @@ class RunCase(RunTestRunner):
 
     async def parse_all_case(self):
         """ 解析所有用例 """
+        await self.prefetch_case_data(self.case_id_list)  # 批量预取用例、步骤、元素、服务数据
 
         # 遍历要运行的用例
         for case_id in self.case_id_list:
@@ -256,7 +264,7 @@ class RunCase(RunTestRunner):
                     await report_case.test_is_skip()
                     continue
 
-                case_suite = await self.suite_model.filter(id=current_case.suite_id).first()
+                case_suite = await self.get_suite(current_case.suite_id)
                 current_project = await self.get_format_project(case_suite.project_id)
 
                 if self.run_type == 'ui':
@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import os
+import signal
+import socket
+import traceback
+
+from tortoise import Tortoise
+
+from app.configs.config import tortoise_orm_conf, run_worker_max_running, run_worker_poll_interval, \
+    run_worker_heartbeat_interval
+from app.models.autotest.model_factory import RunQueue, ApiTask, ApiReport, ApiReportCase, ApiReportStep, AppTask, \
+    AppReport, AppReportCase, AppReportStep, UiTask, UiReport, UiReportCase, UiReportStep
+from app.models.config.config import Config
+from utils.client.run_api_test import RunCase as RunApiCase
+from utils.client.run_ui_test import RunCase as RunUiCase
+from utils.client.test_runner.driver_pool import webdriver_pool
+from utils.logs.log import logger
+
+# 测试类型对应的 (执行器, 任务表, 报告表, 用例报告表, 步骤报告表)
+run_model_mapping = {
+    "api": (RunApiCase, ApiTask, ApiReport, ApiReportCase, ApiReportStep),
+    "app": (RunUiCase, AppTask, AppReport, AppReportCase, AppReportStep),
+    "ui": (RunUiCase, UiTask, UiReport, UiReportCase, UiReportStep)
+}
+
+
+class RunWorker:
+    """ 测试运行进程，与接口服务分开部署，可起多个
+    1、按入队顺序领取运行队列中的数据执行，遵守全局、单个服务的最多同时执行数
+    2、定时刷新心跳，其他运行进程发现心跳超时的数据（进程被杀、机器宕机），重新放回队列，从头执行
+    3、收到退出信号后不再领取，等正在执行的执行完毕再退出
+    4、ui、app执行的浏览器/app会话在进程内复用，领取时顺带关闭空闲超时的会话，退出前全部关闭
+    """
+
+    def __init__(self, max_running=run_worker_max_running, poll_interval=run_worker_poll_interval,
+                 heartbeat_interval=run_worker_heartbeat_interval):
+        self.worker_id = f'{socket.gethostname()}_{os.getpid()}'
+        self.max_running = max_running
+        self.poll_interval = poll_interval
+        self.heartbeat_interval = heartbeat_interval
+        self.running_dict = {}  # 正在执行的，{队列id: asyncio.Task}
+        self.stop_event = asyncio.Event()
+
+    def stop(self):
+        logger.info(f'运行进程【{self.worker_id}】收到退出信号，不再领取，等待正在执行的{len(self.running_dict)}个执行完毕')
+        self.stop_event.set()
+
+    async def start(self):
+        await Tortoise.init(config=tortoise_orm_conf)
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.add_signal_handler(sig, self.stop)
+            except NotImplementedError:  # windows 不支持
+                pass
+
+        logger.info(f'\n\n\n{"*" * 20} 运行进程【{self.worker_id}】启动完成 {"*" * 20}\n\n\n')
+        heartbeat_task = asyncio.create_task(self.keep_heartbeat())
+        try:
+            while not self.stop_event.is_set():
+                try:
+                    await self.poll()
+                except Exception:
+                    logger.error(f'运行进程【{self.worker_id}】领取队列异常：\n{traceback.format_exc()}')
+                try:
+                    await asyncio.wait_for(self.stop_event.wait(), timeout=self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+
+            if self.running_dict:
+                await asyncio.wait(list(self.running_dict.values()))
+        finally:
+            heartbeat_task.cancel()
+            await webdriver_pool.close_all()
+            await Tortoise.close_connections()
+            logger.info(f'\n\n\n{"*" * 20} 运行进程【{self.worker_id}】已退出 {"*" * 20}\n\n\n')
+
+    async def keep_heartbeat(self):
+        """ 定时刷新正在执行的数据的心跳时间 """
+        while True:
+            await asyncio.sleep(self.heartbeat_interval)
+            try:
+                await RunQueue.heartbeat(self.worker_id, list(self.running_dict.keys()))
+            except Exception:
+                logger.error(f'运行进程【{self.worker_id}】刷新心跳异常：\n{traceback.format_exc()}')
+
+    async def poll(self):
+        """ 处理失联的数据，并按空闲数量领取新的数据执行 """
+        queue_config = await Config.get_run_queue()
+        requeue_list, fail_list = await RunQueue.requeue_orphan(
+            queue_config["heartbeat_time_out"], queue_config["max_retry"])
+        for item in requeue_list:
+            logger.info(f'运行进程【{item.worker_id}】失联，报告【{item.test_type}_{item.report_id}】重新放回队列')
+        for item in fail_list:
+            await self.set_report_fail(item)
+        await webdriver_pool.clear_expired()
+
+        free_count = self.max_running - len(self.running_dict)
+        if free_count <= 0:
+            return
+        for item in await RunQueue.claim(self.worker_id, queue_config, free_count):
+            self.running_dict[item.id] = asyncio.create_task(self.run(item))
+
+    async def run(self, item):
+        logger.info(f'运行进程【{self.worker_id}】开始执行报告【{item.test_type}_{item.report_id}】')
+        try:
+            runner = await self.get_runner(item)
+            await runner.parse_and_run()
+            await item.run_finish(self.worker_id)
+        except Exception:
+            error_msg = traceback.format_exc()
+            logger.error(f'报告【{item.test_type}_{item.report_id}】执行异常：\n{error_msg}')
+            await item.run_finish(self.worker_id, error_msg)
+            await self.set_report_fail(item)
+        finally:
+            self.running_dict.pop(item.id, None)
+
+    async def get_runner(self, item):
+        """ 根据队列中的运行参数实例化执行器，重新排队的先清掉上一次执行产生的数据 """
+        runner_class, task_model, report_model, report_case_model, report_step_model = run_model_mapping[item.test_type]
+        if item.retry_count:
+            await report_case_model.filter(report_id=item.report_id).delete()
+            await report_step_model.filter(report_id=item.report_id).delete()
+            report = await report_model.filter(id=item.report_id).first()
+            summary = report_model.get_summary_template()
+            summary["env"] = report.summary.get("env", summary["env"])
+            await report_model.filter(id=item.report_id).update(is_passed=1, process=1, status=1, summary=summary)
+
+        run_kwargs = dict(item.run_kwargs)
+        task_id = run_kwargs.pop("task_id", None)
+        if task_id:
+            run_kwargs["task_dict"] = dict(await task_model.filter(id=task_id).first())
+        return runner_class(report_id=item.report_id, run_type=item.test_type, **run_kwargs)
+
+    @staticmethod
+    async def set_report_fail(item):
+        """ 执行失败，报告置为已完成、不通过，避免一直显示执行中 """
+        report_model = run_model_mapping[item.test_type][2]
+        report = await report_model.filter(id=item.report_id).first()
+        await report_model.filter(id=item.report_id).update(is_passed=0, process=3, status=2)
+        if report and not (report.process == 3 and report.status == 2):  # 保存报告完毕(save_report_finish)时已经计入统计
+            report.is_passed = 0
+            await report.add_to_stat()
+
+
+if __name__ == '__main__':
+    asyncio.run(RunWorker().start())
@@ -1,6 +1,8 @@
+import asyncio
 import datetime
 import traceback
 
+from app.models.autotest.report_step import ReportStepUpdateBuffer
 from utils.logs.log import logger
 from . import exceptions, parser, runner
 
@@ -18,48 +20,73 @@ class TestRunner:
         test_case_mapping = parsed_tests_mapping["test_case_mapping"]  # 执行测试用例
 
         report_case = await report_case_model.filter(id=test_case_mapping["config"]["report_case_id"]).first()
-        case_runner = runner.Runner(test_case_mapping["config"], functions)
+        # 当前用例的步骤进度、结果先写到缓冲中，批量写库
+        report_step_buffer = ReportStepUpdateBuffer(**parsed_tests_mapping.get("report_step_buffer", {}))
+        case_runner = runner.Runner(
+            test_case_mapping["config"], functions, http_client_pool=parsed_tests_mapping.get("http_client_pool"),
+            report_step_buffer=report_step_buffer)
         await case_runner.init_session_context()
 
         report_case.summary["stat"]["total"] = len(test_case_mapping["step_list"])
         await report_case.test_is_running()
 
         report_case.summary["time"]["start_at"] = datetime.datetime.now()  # 开始执行用例时间
-        for test_step in test_case_mapping["step_list"]:
-            try:
-                await case_runner.run_step(test_step, report_step_model)  # 执行测试步骤
-                step_error_traceback = None
-            except Exception as error:
-                step_error_traceback = traceback.format_exc()
+        try:
+            for test_step in test_case_mapping["step_list"]:
+                try:
+                    await case_runner.run_step(test_step, report_step_model)  # 执行测试步骤
+                    step_error_traceback = None
+                except Exception as error:
+                    step_error_traceback = traceback.format_exc()
 
-                # 没有执行结果，代表是执行异常，否则代表是步骤里面捕获了异常过后再抛出来的
-                if case_runner.client_session.meta_data["result"] is None:
-                    logger.error(traceback.format_exc())
-                    case_runner.client_session.meta_data["result"] = "error"
+                    # 没有执行结果，代表是执行异常，否则代表是步骤里面捕获了异常过后再抛出来的
+                    if case_runner.client_session.meta_data["result"] is None:
+                        logger.error(traceback.format_exc())
+                        case_runner.client_session.meta_data["result"] = "error"
 
-            await case_runner.report_step.save_step_result_and_summary(case_runner, step_error_traceback)
-            if case_runner.run_type == "api":
-                case_runner.report_step.add_run_step_result_count(report_case.summary, case_runner.client_session.meta_data, parsed_tests_mapping["response_time_level"], test_step["report_step_id"])
-            else:
-                case_runner.report_step.add_run_step_result_count(report_case.summary, case_runner.client_session.meta_data)
+                await case_runner.report_step.save_step_result_and_summary(case_runner, step_error_traceback)
+                if case_runner.run_type == "api":
+                    case_runner.report_step.add_run_step_result_count(report_case.summary, case_runner.client_session.meta_data, parsed_tests_mapping["response_time_level"], test_step["report_step_id"])
+                else:
+                    case_runner.report_step.add_run_step_result_count(report_case.summary, case_runner.client_session.meta_data)
+        finally:
+            await report_step_buffer.close()  # 用例执行结束，把缓冲中剩下的步骤数据写库
         report_case.summary["time"]["end_at"] = datetime.datetime.now()  # 用例执行结束时间
-        case_runner.try_close_browser()  # 执行完一条用例，不管是不是ui自动化，都强制执行关闭浏览器，防止执行时报错，导致没有关闭到浏览器造成driver进程一直存在
+        await case_runner.try_close_browser()  # 执行完一条用例，不管是不是ui自动化，都把浏览器还给会话池（重置或关闭），防止执行时报错，导致浏览器一直被占用、driver进程一直存在
         await report_case.save_case_result_and_summary()
 
         return report_case.summary
 
-    async def run(self, test_plan):
-        """ 执行测试的流程 """
+    async def parse_and_run_test(self, test_plan, report_case_id):
+        """ 解析并执行一条用例，返回用例的summary """
+        parsed_test_res = await parser.parse_test_data(test_plan, report_case_id)  # 解析测试计划
+        if parsed_test_res.get("result") == "error":  # 解析测试计划报错了，会返回当前用例的初始summary
+            return parsed_test_res
+        return await self.run_test(parsed_test_res)  # 执行测试用例
+
+    async def run(self, test_plan, concurrency=1):
+        """ 执行测试的流程，concurrency 大于1时，以用例为维度并发执行，同时最多执行 concurrency 条用例 """
         report = await test_plan["report_model"].filter(id=test_plan["report_id"]).first()
         self.summary = report.summary  # 防止任务中没有用例导致报错
         start_run_test_time = datetime.datetime.now()
-        for report_case_id in test_plan["report_case_list"]: # 解析一条用例就执行一条用例，减少内存开销
-            parsed_test_res = await parser.parse_test_data(test_plan, report_case_id)  # 解析测试计划
-            if parsed_test_res.get("result") == "error":  # 解析测试计划报错了，会返回当前用例的初始summary
-                case_summary = parsed_test_res
-            else:
-                case_summary = await self.run_test(parsed_test_res)  # 执行测试用例
-            self.summary = report.merge_test_result(case_summary)  # 汇总测试结果
+        if concurrency > 1:
+            semaphore = asyncio.Semaphore(concurrency)
+
+            async def run_with_semaphore(report_case_id):
+                async with semaphore:  # 拿到信号量才开始解析，避免一次性解析所有用例
+                    return await self.parse_and_run_test(test_plan, report_case_id)
+
+            async with asyncio.TaskGroup() as task_group:
+                task_list = [
+                    task_group.create_task(run_with_semaphore(report_case_id))
+                    for report_case_id in test_plan["report_case_list"]
+                ]
+            for task in task_list:  # 按用例顺序汇总测试结果
+                self.summary = report.merge_test_result(task.result())
+        else:
+            for report_case_id in test_plan["report_case_list"]:  # 解析一条用例就执行一条用例，减少内存开销
+                case_summary = await self.parse_and_run_test(test_plan, report_case_id)
+                self.summary = report.merge_test_result(case_summary)  # 汇总测试结果
         run_case_finish_time = datetime.datetime.now()
         self.summary["time"]["start_at"] = start_run_test_time.strftime("%Y-%m-%d %H:%M:%S")
         self.summary["time"]["end_at"] = run_case_finish_time.strftime("%Y-%m-%d %H:%M:%S")
@@ -12,6 +12,58 @@ from utils.client.test_runner.client import BaseSession
 from utils.client.test_runner.utils import build_url, lower_dict_keys, omit_long_data
 from utils.logs.log import logger
 
+try:
+    import h2  # http2 依赖 h2 包，没有安装时降级为 http1.1
+except ImportError:
+    h2 = None
+
+
+class HttpClientPool:
+    """
+    运行维度的连接池，同一次运行中的所有用例、步骤共用，避免每个请求都重新建立TCP连接和TLS握手。
+    连接池按 scheme + host + port 区分，每个host的连接数单独限制。
+    只共享 transport（连接），每个请求仍使用独立的client，cookie 不会在用例之间串用。
+    """
+
+    def __init__(
+            self, max_connections_per_host=20, max_keepalive_connections=10, keepalive_expiry=30, http2=False, **kwargs
+    ):
+        self.limits = httpx.Limits(
+            max_connections=max_connections_per_host,
+            max_keepalive_connections=max_keepalive_connections,
+            keepalive_expiry=keepalive_expiry
+        )
+        self.http2 = bool(http2 and h2)
+        self.transport_dict = {}
+
+    @staticmethod
+    def get_host_key(url):
+        """ 获取连接池的key """
+        url = httpx.URL(url)
+        return url.scheme, url.host, url.port
+
+    def get_transport(self, url):
+        """ 获取url对应host的transport，没有则创建 """
+        host_key = self.get_host_key(url)
+        if host_key not in self.transport_dict:
+            self.transport_dict[host_key] = httpx.AsyncHTTPTransport(
+                verify=False, limits=self.limits, http2=self.http2)
+        return self.transport_dict[host_key]
+
+    def get_client(self, url):
+        """ 获取一个复用连接池的client """
+        return httpx.AsyncClient(verify=False, transport=self.get_transport(url))
+
+    async def close(self):
+        """ 运行结束，关闭所有连接 """
+        for transport in self.transport_dict.values():
+            try:
+                await transport.aclose()
+            except Exception as error:
+                logger.error(f"关闭连接池错误：{error}")
+        self.transport_dict = {}
+
+
 class ApiResponse(Response):
 
     def raise_for_status(self):
@@ -30,9 +82,10 @@ class HttpSession(BaseSession):
     url允许只传接口地址，不传host，此时在发请求时会自动加上base_url
     """
 
-    def __init__(self, base_url=None, *args, **kwargs):
+    def __init__(self, base_url=None, client_pool=None, *args, **kwargs):
         # super(HttpSession, self).__init__(*args, **kwargs)
         self.base_url = base_url if base_url else ""
+        self.client_pool = client_pool  # 运行维度的连接池，没有传则每次请求新建连接
         self.request_at = self.response_at = datetime.now()
         self.init_step_meta_data()
 
@@ -150,8 +203,12 @@ class HttpSession(BaseSession):
             self.request_at = datetime.now()
             logger.info(f"method: {method}, url: {url}, kwargs: {kwargs}")
             # requests库出现过卡死发不出请求的情况，换为httpx后没有出现问题
-            async with httpx.AsyncClient(verify=False) as client:
-                response = await client.request(method, url, **kwargs)
+            if self.client_pool:
+                # 复用连接池里的连接，client只是一层包装，不关闭，避免把共享的连接关掉
+                response = await self.client_pool.get_client(url).request(method, url, **kwargs)
+            else:
+                async with httpx.AsyncClient(verify=False) as client:
+                    response = await client.request(method, url, **kwargs)
             self.response_at = datetime.now()
             return response
         except HTTPStatusError as ex:
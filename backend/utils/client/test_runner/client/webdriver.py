@@ -1,67 +1,197 @@
 import os
 import asyncio
+import threading
+import traceback
+import concurrent.futures
 from concurrent.futures import ThreadPoolExecutor
 from functools import partial
 from datetime import datetime
 
 from selenium.common.exceptions import SessionNotCreatedException, InvalidArgumentException, WebDriverException
 
+from app.configs.config import webdriver_executor_max_workers, webdriver_action_timeout, \
+    screenshot_writer_max_pending
 from utils.client.test_runner.client import BaseSession
 from utils.client.test_runner.exceptions import TimeoutException, RunTimeException, InvalidElementStateException
+from utils.logs.log import logger
 from utils.util.file_util import FileUtil
+from utils.util.thread_pool import BoundedExecutor
+
+# 执行浏览器/app操作的线程池，整个进程的ui、app执行共用
+webdriver_executor = BoundedExecutor("webdriver-executor", webdriver_executor_max_workers)
+
+
+class ScreenshotWriter:
+    """ 截图压缩、落盘的线程池，不占用执行浏览器/app操作的线程
+    1、排队的截图最多 max_pending 张，排满后截图的线程等待空位，等待超过 block_timeout 秒则丢弃并记录日志
+    2、按报告截图目录记录未写完的截图，报告保存完成前等待写完，避免查看报告时截图还没落盘
+    """
+
+    block_timeout = 5
+
+    def __init__(self, max_workers, max_pending):
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="screenshot-writer")
+        self.slots = threading.BoundedSemaphore(max_pending)
+        self.lock = threading.Lock()
+        self.pending = {}  # {报告截图目录: {future}}
+        self.drop_count = 0
+        if not FileUtil.can_compress_img():
+            logger.warning('未安装 Pillow，截图不压缩，直接保存为png，截图策略中的 quality 不生效，请按 requirements.txt 安装依赖')
+
+    def submit(self, report_img_folder, file_path, png_data, quality):
+        if not self.slots.acquire(timeout=self.block_timeout):
+            with self.lock:
+                self.drop_count += 1
+            logger.warning(f'截图写入排队已满，丢弃截图【{file_path}】，已丢弃：{self.drop_count}张')
+            return
+        try:
+            future = self.executor.submit(self.write, file_path, png_data, quality)
+        except Exception:
+            self.slots.release()
+            raise
+        with self.lock:
+            self.pending.setdefault(report_img_folder, set()).add(future)
+        future.add_done_callback(partial(self.on_done, report_img_folder))
+
+    def on_done(self, report_img_folder, future):
+        self.slots.release()
+        with self.lock:
+            futures = self.pending.get(report_img_folder)
+            if futures is not None:
+                futures.discard(future)
+                if not futures:
+                    self.pending.pop(report_img_folder, None)
+
+    @staticmethod
+    def write(file_path, png_data, quality):
+        try:
+            FileUtil.save_report_step_img(file_path, png_data, quality)
+        except Exception:
+            logger.error(f'保存截图【{file_path}】异常：\n{traceback.format_exc()}')
+
+    async def wait_folder(self, report_img_folder, timeout=webdriver_action_timeout):
+        """ 等待报告截图目录下排队中的截图写完 """
+        with self.lock:
+            futures = list(self.pending.get(report_img_folder, ()))
+        if futures:
+            done, not_done = await asyncio.to_thread(concurrent.futures.wait, futures, timeout)
+            if not_done:
+                logger.warning(f'报告截图目录【{report_img_folder}】还有{len(not_done)}张截图没有写完')
+
+    def get_stat(self):
+        with self.lock:
+            return {
+                "pending": sum(len(futures) for futures in self.pending.values()),
+                "drop_count": self.drop_count,
+                "compress": FileUtil.can_compress_img()
+            }
+
+
+screenshot_writer = ScreenshotWriter(2, screenshot_writer_max_pending)
 
 
 class WebDriverSession(BaseSession):
     """ 实例化webdriver，并执行webdriver动作 """
 
-    def __init__(self):
+    def __init__(self, screenshot_policy=None):
         self.driver = None
+        self.screenshot_policy = screenshot_policy or {}
+        self.screenshot_mode = self.screenshot_policy.get("mode") or "always"
+        self.action_count = 0  # 已执行的操作数，every_n 模式用
+        self.after_page_step_id = None  # 最近一次保存了执行后截图的步骤，失败时不重复截图
         self.init_step_meta_data()
 
-    async def async_do_action(self, driver, name=None, case_id=None, variables_mapping={}, **kwargs):
+    async def async_do_action(self, driver, name=None, case_id=None, variables_mapping={}, has_validate=False, **kwargs):
         """ 操作比较耗时，改为异步执行 """
         kwargs.update(dict(
             driver=driver,
             name=name,
             case_id=case_id,
-            variables_mapping=variables_mapping
+            variables_mapping=variables_mapping,
+            has_validate=has_validate
         ))
-        max_workers = min(50, os.cpu_count() * 5)
-        with ThreadPoolExecutor(max_workers=max_workers) as executor:
-            try:
-                bound_func = partial(self.do_action, *(), **kwargs)
-                return await asyncio.wait_for(
-                    asyncio.get_running_loop().run_in_executor(executor, bound_func), timeout=600)
-            except Exception as e:
-                executor.shutdown(wait=True)  # 强制终止超时任务
-                raise
-
-    def do_action(self, driver, name=None, case_id=None, variables_mapping={}, **kwargs):
+        try:
+            return await webdriver_executor.run(partial(self.do_action, **kwargs), timeout=webdriver_action_timeout)
+        except asyncio.TimeoutError:
+            # 线程中卡住的 selenium/appium 调用无法强制终止，关闭浏览器/app让调用尽快返回，释放线程
+            threading.Thread(target=driver.close_all, daemon=True).start()
+            raise RunTimeException(f'执行操作超时（{webdriver_action_timeout}秒），已关闭浏览器/app')
+
+    async def async_save_fail_screenshot(self, driver, report_img_folder, report_step_id):
+        """ 步骤失败（如断言不通过）时补一张截图，执行后已经截过图的不再截 """
+        if driver is None or not report_img_folder or self.after_page_step_id == report_step_id:
+            return
+        try:
+            await webdriver_executor.run(
+                self.save_screenshot, (driver, report_img_folder, report_step_id, "after_page"),
+                timeout=webdriver_action_timeout)
+        except Exception:
+            logger.error(f'步骤【{report_step_id}】失败截图异常：\n{traceback.format_exc()}')
+
+    def need_screenshot(self, has_validate=False):
+        """ 根据截图策略判断当前操作是否截图，失败时的截图不受此限制 """
+        if self.screenshot_mode == "on_fail":
+            return False
+        if self.screenshot_mode == "assert_only":
+            return has_validate
+        if self.screenshot_mode == "every_n":
+            every_n = max(int(self.screenshot_policy.get("every_n") or 1), 1)
+            return (self.action_count - 1) % every_n == 0
+        return True
+
+    def save_screenshot(self, driver, report_img_folder, report_step_id, img_type):
+        """ 截图在当前线程完成（需要操作driver），压缩、写文件交给 screenshot_writer 异步执行 """
+        png_data = driver.get_screenshot_as_png()
+        if img_type == "after_page":
+            self.after_page_step_id = report_step_id
+        screenshot_writer.submit(
+            report_img_folder,
+            os.path.join(report_img_folder, f'{report_step_id}_{img_type}'),
+            png_data,
+            self.screenshot_policy.get("quality") or 60
+        )
+
+    def do_action(self, driver, name=None, case_id=None, variables_mapping={}, has_validate=False, **kwargs):
         self.meta_data["name"] = name  # 记录测试名
         self.meta_data["case_id"] = case_id  # 步骤对应的用例id
         self.meta_data["variables_mapping"] = variables_mapping  # 记录发起此次请求时内存中的自定义变量
         self.meta_data["data"][0]["test_action"] = kwargs  # 记录原始的请求信息
         report_img_folder, report_step_id = kwargs.pop("report_img_folder"), kwargs.pop("report_step_id")
+        self.action_count += 1
+        need_screenshot = self.need_screenshot(has_validate)
 
         # 执行前截图
-        before_page_folder = os.path.join(report_img_folder, f'{report_step_id}_before_page.txt')
-        FileUtil.save_file(before_page_folder, driver.get_screenshot_as_base64())
+        if need_screenshot:
+            self.save_screenshot(driver, report_img_folder, report_step_id, "before_page")
 
         # 执行测试步骤
+        driver.set_wait_profile(kwargs.pop("wait_profile", None))  # 当前元素的等待策略
         start_at = datetime.now()
-        result = self._do_action(driver, **kwargs)  # 执行步骤
-        end_at = datetime.now()
+        try:
+            result = self._do_action(driver, **kwargs)  # 执行步骤
+        except Exception:
+            # 执行失败，不管截图策略都截一张，截图失败（如浏览器已关闭）不影响原异常
+            try:
+                self.save_screenshot(driver, report_img_folder, report_step_id, "after_page")
+            except Exception:
+                pass
+            raise
+        finally:
+            # 记录消耗的时间，失败的也记录，便于找出等待慢的元素
+            end_at = datetime.now()
+            elapsed_ms = round((end_at - start_at).total_seconds() * 1000, 3)  # 执行步骤耗时, 秒转毫秒
+            self.meta_data["stat"] = {
+                "elapsed_ms": elapsed_ms,
+                "wait_ms": driver.wait_stat["wait_ms"],  # 其中等待元素的耗时
+                "action_ms": round(max(elapsed_ms - driver.wait_stat["wait_ms"], 0), 3),  # 其中执行操作的耗时
+                "poll_count": driver.wait_stat["poll_count"],  # 查找元素的次数
+                "request_at": start_at.strftime("%Y-%m-%d %H:%M:%S.%f"),
+                "response_at": end_at.strftime("%Y-%m-%d %H:%M:%S.%f"),
+            }
 
         # 执行后截图
-        after_page_folder = os.path.join(report_img_folder, f'{report_step_id}_after_page.txt')
-        FileUtil.save_file(after_page_folder, driver.get_screenshot_as_base64())
-
-        # 记录消耗的时间
-        self.meta_data["stat"] = {
-            "elapsed_ms": round((end_at - start_at).total_seconds() * 1000, 3),  # 执行步骤耗时, 秒转毫秒
-            "request_at": start_at.strftime("%Y-%m-%d %H:%M:%S.%f"),
-            "response_at": end_at.strftime("%Y-%m-%d %H:%M:%S.%f"),
-        }
+        if need_screenshot:
+            self.save_screenshot(driver, report_img_folder, report_step_id, "after_page")
 
         return result
 
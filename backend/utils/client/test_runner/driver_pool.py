@@ -0,0 +1,176 @@
+# -*- coding: utf-8 -*-
+import json
+import time
+import threading
+import traceback
+
+from app.configs.config import webdriver_action_timeout, webdriver_pool_max_idle, webdriver_pool_max_age, \
+    webdriver_pool_max_uses, webdriver_pool_idle_timeout
+from utils.logs.log import logger
+from .client.webdriver import webdriver_executor
+from .webdriver_action import get_web_driver
+
+
+class PooledDriver:
+    """ 池中的会话及其使用情况 """
+
+    def __init__(self, key, device_key, driver):
+        self.key = key
+        self.device_key = device_key
+        self.driver = driver
+        self.created_at = time.monotonic()
+        self.idle_since = None
+        self.use_count = 0
+
+
+class WebDriverPool:
+    """ 浏览器/app会话池
+    1、按浏览器/设备能力分组，用例执行完重置会话（cookie、存储、空白页 / 重启app）放回池中，下一条相同能力的用例直接复用，
+       不能完全重置的（非 chromium 内核的浏览器、app不保留数据的）直接关闭
+    2、取出时检查会话是否可用，不可用的关闭后重建
+    3、会话存活超过 max_age 秒、执行超过 max_uses 条用例、空闲超过 idle_timeout 秒的关闭
+    4、一台设备同时只能有一个appium会话，新建app会话前先关闭同一台设备上其他能力的空闲会话
+    """
+
+    def __init__(self, max_idle=webdriver_pool_max_idle, max_age=webdriver_pool_max_age,
+                 max_uses=webdriver_pool_max_uses, idle_timeout=webdriver_pool_idle_timeout):
+        self.max_idle = max_idle
+        self.max_age = max_age
+        self.max_uses = max_uses
+        self.idle_timeout = idle_timeout
+        self._lock = threading.Lock()
+        self._idle = {}  # 空闲会话，{key: [PooledDriver]}
+        self._in_use = {}  # 使用中的会话，{id(driver): PooledDriver}
+        self.create_count = self.reuse_count = self.close_count = 0
+
+    @staticmethod
+    def get_key(driver_type, kwargs):
+        """ 浏览器/设备能力相同的会话才能复用 """
+        return f'{driver_type}:{json.dumps(kwargs, sort_keys=True, default=str)}'
+
+    @staticmethod
+    def get_device_key(driver_type, kwargs):
+        """ app会话所在的设备 """
+        if driver_type != 'app':
+            return None
+        return f'{kwargs.get("host")}:{kwargs.get("port")}:{kwargs.get("udid") or kwargs.get("deviceName")}'
+
+    def is_expired(self, item):
+        return time.monotonic() - item.created_at > self.max_age or item.use_count >= self.max_uses
+
+    async def acquire(self, driver_type, **kwargs):
+        """ 获取会话，有可用的空闲会话则复用，否则新建 """
+        key, device_key = self.get_key(driver_type, kwargs), self.get_device_key(driver_type, kwargs)
+        while True:
+            with self._lock:
+                idle_list = self._idle.get(key)
+                item = idle_list.pop() if idle_list else None
+            if item is None:
+                break
+            try:
+                alive = not self.is_expired(item) and await self._run(item.driver.is_alive)
+            except Exception:
+                alive = False
+            if not alive:
+                await self._close(item)
+                continue
+            self.reuse_count += 1
+            return self._use(item)
+
+        if device_key:
+            with self._lock:
+                same_device = [item for items in self._idle.values() for item in items if item.device_key == device_key]
+                for item in same_device:
+                    self._idle[item.key].remove(item)
+            for item in same_device:
+                await self._close(item)
+
+        driver = await get_web_driver(driver_type, **kwargs)
+        self.create_count += 1
+        return self._use(PooledDriver(key, device_key, driver))
+
+    def _use(self, item):
+        item.use_count += 1
+        item.idle_since = None
+        with self._lock:
+            self._in_use[id(item.driver)] = item
+        return item.driver
+
+    async def release(self, driver):
+        """ 用例执行完毕，重置会话放回池中，不能复用的直接关闭 """
+        if driver is None:
+            return
+        with self._lock:
+            item = self._in_use.pop(id(driver), None)
+        if item is None:  # 不是从池中获取的
+            item = PooledDriver(None, None, driver)
+            await self._close(item)
+            return
+
+        if self.max_idle <= 0 or self.is_expired(item):
+            await self._close(item)
+            return
+        try:
+            reusable = await self._run(driver.reset_session)
+        except Exception:
+            logger.warning(f'重置浏览器/app会话失败，关闭会话：\n{traceback.format_exc()}')
+            reusable = False
+        if not reusable:
+            await self._close(item)
+            return
+
+        with self._lock:
+            idle_list = self._idle.setdefault(item.key, [])
+            if len(idle_list) < self.max_idle:
+                item.idle_since = time.monotonic()
+                idle_list.append(item)
+                return
+        await self._close(item)
+
+    async def clear_expired(self):
+        """ 关闭空闲超时、超过存活时间的会话，由运行进程定时调用 """
+        now = time.monotonic()
+        with self._lock:
+            expired = []
+            for items in self._idle.values():
+                for item in items:
+                    if now - item.idle_since > self.idle_timeout or self.is_expired(item):
+                        expired.append(item)
+            for item in expired:
+                self._idle[item.key].remove(item)
+        for item in expired:
+            await self._close(item)
+
+    async def close_all(self):
+        """ 关闭所有空闲会话，进程退出前调用 """
+        with self._lock:
+            items = [item for items in self._idle.values() for item in items]
+            self._idle = {}
+        for item in items:
+            await self._close(item)
+
+    async def _close(self, item):
+        self.close_count += 1
+        try:
+            await webdriver_executor.run(item.driver.close_all, timeout=webdriver_action_timeout)
+        except Exception:
+            logger.error(f'关闭浏览器/app会话异常：\n{traceback.format_exc()}')
+
+    @staticmethod
+    async def _run(func):
+        return await webdriver_executor.run(func, timeout=webdriver_action_timeout)
+
+    def get_stat(self):
+        """ 会话池指标 """
+        with self._lock:
+            return {
+                "idle": sum(len(items) for items in self._idle.values()),
+                "in_use": len(self._in_use),
+                "create_count": self.create_count,
+                "reuse_count": self.reuse_count,
+                "close_count": self.close_count
+            }
+
+
+# 进程内的ui、app执行共用一个会话池
+webdriver_pool = WebDriverPool()
@@ -10,6 +10,11 @@ from .compat import basestring, builtin_str, numeric_types
 from .validate_func import load_builtin_functions
 from utils.variables.regexp import variable_regexp, function_regexp, function_regexp_compile
 
+builtin_functions_mapping = load_builtin_functions()  # 内置函数表，模块是固定的，只加载一次
+
+variable_regexp_compile = re.compile(variable_regexp)
+function_content_regexp_compile = re.compile(function_regexp)
+
 
 def parse_string_value(str_value):
     """ 把能转成数字的字符串转成数字
@@ -316,14 +321,8 @@ def get_mapping_function(function_name, functions_mapping):
     if function_name in functions_mapping:
         return functions_mapping[function_name]
 
-    try:
-        # check if TestRunner builtin functions
-        # from . import loader
-        # built_in_functions = loader.load_builtin_functions()
-        built_in_functions = load_builtin_functions()
-        return built_in_functions[function_name]
-    except KeyError:
-        pass
+    if function_name in builtin_functions_mapping:  # TestRunner 内置函数
+        return builtin_functions_mapping[function_name]
 
     try:
         # check if Python builtin functions
@@ -336,6 +335,106 @@ def get_mapping_function(function_name, functions_mapping):
         raise exceptions.FunctionNotFound(f"自定义函数 【{function_name}】 没有找到")
 
 
+class StringTemplate:
+    """ 编译后的字符串模板，由字面量片段和 函数/变量 占位组成，同一个字符串只用正则解析一次，之后每次只需要渲染
+    parts: [字面量字符串 或 (函数内容, 函数元数据) 或 (变量名, None)]，没有函数/变量则为 None
+    """
+
+    __slots__ = ("content", "function_parts", "variable_parts")
+
+    def __init__(self, content):
+        self.content = content
+        self.function_parts = self.split(content, function_content_regexp_compile, parse_function)
+        # 有函数时，变量要从函数执行后的结果中提取
+        self.variable_parts = None if self.function_parts else self.split(content, variable_regexp_compile)
+
+    @staticmethod
+    def split(content, pattern, parse_slot=None):
+        """ 按正则切分为字面量片段和占位 """
+        parts, position = [], 0
+        for matched in pattern.finditer(content):
+            if matched.start() > position:
+                parts.append(content[position:matched.start()])
+            slot = matched.group(1)
+            parts.append((slot, parse_slot(slot) if parse_slot else None))
+            position = matched.end()
+        if not parts:
+            return None
+        if position < len(content):
+            parts.append(content[position:])
+        return parts
+
+    @staticmethod
+    async def join(parts, get_slot_value):
+        """ 渲染：只有一个占位且占满整个字符串时，直接返回占位的值（保留原数据类型），否则拼接为字符串 """
+        if len(parts) == 1 and isinstance(parts[0], tuple):
+            return await get_slot_value(*parts[0])
+        values = []
+        for part in parts:
+            if isinstance(part, tuple):
+                value = await get_slot_value(*part)
+                part = value if isinstance(value, str) else builtin_str(value)
+            values.append(part)
+        return "".join(values)
+
+    async def render_functions(self, variables_mapping, functions_mapping):
+        """ 执行字符串中的自定义函数 """
+
+        async def get_function_value(func_content, function_meta):
+            args = await parse_data(function_meta.get("args", []), variables_mapping, functions_mapping)
+            kwargs = await parse_data(function_meta.get("kwargs", {}), variables_mapping, functions_mapping)
+            func = get_mapping_function(function_meta["func_name"], functions_mapping)
+            # 执行自定义函数，有可能会报错
+            return await Script.run_func(func, args, kwargs)
+
+        return await self.join(self.function_parts, get_function_value)
+
+    @staticmethod
+    async def render_variables(variable_parts, variables_mapping, functions_mapping):
+        """ 替换字符串中引用的变量 """
+
+        async def get_variable_value(variable_name, _):
+            variable_value = get_mapping_variable(variable_name, variables_mapping)
+
+            if variable_name == "request" and isinstance(variable_value, dict) \
+                    and "url" in variable_value and "method" in variable_value:
+                # call setup_hooks action with $request
+                for key, value in variable_value.items():
+                    variable_value[key] = await parse_data(
+                        value,
+                        variables_mapping,
+                        functions_mapping
+                    )
+                return variable_value
+            elif "${}".format(variable_name) == variable_value:
+                return variable_value
+            parsed_variable_value = await parse_data(
+                variable_value,
+                variables_mapping,
+                functions_mapping,
+                raise_if_variable_not_found=False
+            )
+            variables_mapping[variable_name] = parsed_variable_value
+            return parsed_variable_value
+
+        return await StringTemplate.join(variable_parts, get_variable_value)
+
+
+_string_template_cache = {}  # {字符串: StringTemplate}，只缓存包含 $ 的字符串
+string_template_cache_max_size = 10000  # 超出后清空重新缓存，避免函数返回值等不固定的字符串把缓存撑大
+
+
+def get_string_template(content):
+    """ 获取字符串编译后的模板 """
+    template = _string_template_cache.get(content)
+    if template is None:
+        template = StringTemplate(content.strip())
+        if len(_string_template_cache) >= string_template_cache_max_size:
+            _string_template_cache.clear()
+        _string_template_cache[content] = template
+    return template
+
+
 async def parse_string_functions(content, variables_mapping, functions_mapping):
     """ 映射字符串中的函数
     Args:
@@ -345,46 +444,12 @@ async def parse_string_functions(content, variables_mapping, functions_mapping):
     Returns:
         parse_string_functions(content, functions_mapping) >>> "abc4def"
     """
-    functions_list = extract_functions(content)
-    for func_content in functions_list:
-        function_meta = parse_function(func_content)
-        args = await parse_data(function_meta.get("args", []), variables_mapping, functions_mapping)
-        kwargs = await parse_data(function_meta.get("kwargs", {}), variables_mapping, functions_mapping)
-        func = get_mapping_function(function_meta["func_name"], functions_mapping)
-        # 执行自定义函数，有可能会报错
-        try:
-
-            # eval_value = func(*args, **kwargs)
-            eval_value = await Script.run_func(func, args, kwargs)
-        except Exception as error:
-            # 记录错误信息
-            # FuncErrorRecord.create(
-            #     name='执行自定义函数错误',
-            #     detail=f'执行自定义函数【{func_name}】报错了 \n  args参数: {args} \n  kwargs参数: {kwargs} \n\n  '
-            #            f'错误信息: \n{traceback.format_exc()}'
-            # )
-            #
-            # # 发送自定义函数执行错误的信息
-            # send_run_func_error_message(content={
-            #     "title": "执行自定义函数错误",
-            #     "detail": f'### {datetime.now().strftime("%Y-%m-%d %H:%M:%S")} \n> '
-            #               f'### 执行自定义函数【{func_name}】报错了 \n  args参数: {args} \n  kwargs参数: {kwargs} \n  '
-            #               f'### 错误信息: {traceback.format_exc()} \n> '
-            # })
-            raise
-
-        func_content = "${" + func_content + "}"
-        if func_content == content:
-            # content is a function, e.g. "${add_one(3)}"
-            content = eval_value
-        else:
-            # content contains one or many functions, e.g. "abc${add_one(3)}def"
-            content = content.replace(
-                func_content,
-                str(eval_value), 1
-            )
-
-    return content
+    if not isinstance(content, str) or "$" not in content:
+        return content
+    template = StringTemplate(content)
+    if not template.function_parts:
+        return content
+    return await template.render_functions(variables_mapping, functions_mapping)
 
 
 async def parse_string_variables(content, variables_mapping, functions_mapping):
@@ -404,45 +469,12 @@ async def parse_string_variables(content, variables_mapping, functions_mapping):
             "/api/users/1000"
 
     """
-    variables_list = extract_variables(content)
-    for variable_name in variables_list:
-        variable_value = get_mapping_variable(variable_name, variables_mapping)
-
-        if variable_name == "request" and isinstance(variable_value, dict) \
-                and "url" in variable_value and "method" in variable_value:
-            # call setup_hooks action with $request
-            for key, value in variable_value.items():
-                variable_value[key] = await parse_data(
-                    value,
-                    variables_mapping,
-                    functions_mapping
-                )
-            parsed_variable_value = variable_value
-        elif "${}".format(variable_name) == variable_value:
-            parsed_variable_value = variable_value
-        else:
-            parsed_variable_value = await parse_data(
-                variable_value,
-                variables_mapping,
-                functions_mapping,
-                raise_if_variable_not_found=False
-            )
-            variables_mapping[variable_name] = parsed_variable_value
-        # TODO: replace variable label from $var to {{var}}
-        if "${}".format(variable_name) == content:
-            # content is a variable
-            content = parsed_variable_value
-        else:
-            # content contains one or several variables
-            if not isinstance(parsed_variable_value, str):
-                parsed_variable_value = builtin_str(parsed_variable_value)
-
-            content = content.replace(
-                "${}".format(variable_name),
-                parsed_variable_value, 1
-            )
-
-    return content
+    if not isinstance(content, str) or "$" not in content:
+        return content
+    variable_parts = StringTemplate.split(content, variable_regexp_compile)
+    if not variable_parts:
+        return content
+    return await StringTemplate.render_variables(variable_parts, variables_mapping, functions_mapping)
 
 
 async def parse_data(content, variables_mapping=None, functions_mapping=None, raise_if_variable_not_found=True):
@@ -507,16 +539,23 @@ async def parse_data(content, variables_mapping=None, functions_mapping=None, ra
 
     if isinstance(content, basestring):
         # content is in string format here
+        if isinstance(content, bytes) or "$" not in content:  # 没有引用变量和函数，不需要解析
+            return content.strip()
+
         variables_mapping = utils.list_to_dict(variables_mapping or {})
         functions_mapping = functions_mapping or {}
-        content = content.strip()
+        template = get_string_template(content)
+        content = template.content
 
         try:
-            # 提取并执行自定义函数
-            content = await parse_string_functions(content, variables_mapping, functions_mapping)
-
-            # 用公用变量替换字符串中的占位符
-            content = await parse_string_variables(content, variables_mapping, functions_mapping)
+            if template.function_parts:
+                # 提取并执行自定义函数，再用公用变量替换函数执行结果中的占位符
+                content = await template.render_functions(variables_mapping, functions_mapping)
+                content = await parse_string_variables(content, variables_mapping, functions_mapping)
+            elif template.variable_parts:
+                # 用公用变量替换字符串中的占位符
+                content = await template.render_variables(
+                    template.variable_parts, variables_mapping, functions_mapping)
         except exceptions.VariableNotFound:
             if raise_if_variable_not_found:
                 raise
@@ -666,6 +705,8 @@ async def parse_test_data(tests_dict, report_case_id):
         "report_case_model": tests_dict["report_case_model"],
         "report_step_model": tests_dict["report_step_model"],
         "response_time_level": tests_dict["response_time_level"],
+        "http_client_pool": tests_dict.get("http_client_pool"),
+        "report_step_buffer": tests_dict.get("report_step_buffer", {}),
         "test_case": []
     }
 
@@ -677,6 +718,7 @@ async def parse_test_data(tests_dict, report_case_id):
         "step_list": await tests_dict["report_step_model"].get_test_step_by_report_case(report_case.id)
     }
     test_case_mapping["config"]["pause_step_time_out"] = tests_dict["pause_step_time_out"]
+    test_case_mapping["config"]["screenshot_policy"] = tests_dict.get("screenshot_policy", {})
     try:
         await parse_test_case(test_case_mapping, tests_dict.get("project_mapping", {}))
     except Exception as error:
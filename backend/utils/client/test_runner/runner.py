@@ -7,7 +7,8 @@ from .client.http import HttpSession
 from .client.webdriver import WebDriverSession
 from .exceptions import StopTest
 from .runner_context import SessionContext
-from .webdriver_action import GetUiDriver, GetAppDriver, get_web_driver
+from .webdriver_action import GetUiDriver, GetAppDriver
+from .driver_pool import webdriver_pool
 from utils.logs.redirect_print_log import RedirectPrintLogToMemory
 from utils.logs.log import logger
 
@@ -35,7 +36,7 @@ class Runner:
 
     """
 
-    def __init__(self, config, functions, task_type="api"):
+    def __init__(self, config, functions, task_type="api", http_client_pool=None, report_step_buffer=None):
         """ 运行测试用例
 
         Args:
@@ -47,6 +48,8 @@ class Runner:
                     "setup_hooks", [],
                     "teardown_hooks", []
                 }
+            http_client_pool (HttpClientPool): 运行维度共用的连接池
+            report_step_buffer (ReportStepUpdateBuffer): 步骤进度、结果的写缓冲
         """
         self.base_url = config.get("base_url")
         self.run_env = config.get("run_env")
@@ -57,6 +60,7 @@ class Runner:
         self.resp_obj = None
         self.driver = None
         self.client_session = None
+        self.http_client_pool = http_client_pool
         self.redirect_print = None
         self.client_init_error = None
 
@@ -66,7 +70,9 @@ class Runner:
 
         # 记录当前步骤的执行进度
         self.report_step = None
+        self.report_step_buffer = report_step_buffer
         self.pause_step_time_out = config.get("pause_step_time_out", 10 * 60) # 暂停测试步骤状态变更的超时时间（暂停 => 放行），默认10分钟
+        self.screenshot_policy = config.get("screenshot_policy", {})  # ui、app执行的截图策略
         self.testcase_teardown_hooks = config.get("teardown_hooks", [])  # 用例级别的后置条件
         self.session_context = SessionContext(self.functions)
 
@@ -79,22 +85,23 @@ class Runner:
         """ 根据不同的测试类型获取不同的client_session """
         if self.client_session is None:
             if self.run_type == "api":
-                self.client_session = HttpSession(self.base_url)
+                self.client_session = HttpSession(self.base_url, client_pool=self.http_client_pool)
             elif self.run_type == "ui":
-                self.client_session = WebDriverSession()
-                self.driver = await get_web_driver(
+                self.client_session = WebDriverSession(self.screenshot_policy)
+                self.driver = await webdriver_pool.acquire(
                     driver_type="ui", browser_driver_path=self.browser_driver_path, browser_name=self.browser_name)
             else:
-                self.client_session = WebDriverSession()
-                self.driver = await get_web_driver(driver_type="app", **self.appium_config)
+                self.client_session = WebDriverSession(self.screenshot_policy)
+                self.driver = await webdriver_pool.acquire(driver_type="app", **self.appium_config)
 
-    def try_close_browser(self):
-        """ 强制关闭浏览器、app """
+    async def try_close_browser(self):
+        """ 用例执行完毕，把浏览器、app会话还给会话池，重置后供下一条用例复用，不能复用的会关闭 """
         # 可能出现没有获取到driver的情况
         try:
-            self.driver.close_all()
+            await webdriver_pool.release(self.driver)
         except Exception as e:
             print(f"try_close_browser 错误：{e}")
+        self.driver = None
 
     # def __del__(self):
     #     if self.testcase_teardown_hooks:
@@ -274,6 +281,7 @@ class Runner:
                 name=step_name,
                 case_id=case_id,
                 variables_mapping=copy.deepcopy(variables_mapping),
+                has_validate=bool(step_dict.get("validate")),
                 **parsed_step
             )
 
@@ -377,6 +385,7 @@ class Runner:
                 logger.error(traceback.format_exc())
 
         self.report_step = await report_step_model.get_resport_step_with_status(step_dict.get("report_step_id"), self.pause_step_time_out)
+        self.report_step.update_buffer = self.report_step_buffer
         if self.report_step.status == "stop": # 停止测试
             self.__clear_step_test_data()
             raise StopTest("中断测试执行")
@@ -397,6 +406,10 @@ class Runner:
                 await self.report_step.test_is_skip()
             else:
                 self.session_context.update_session_variables({"case_run_result": "fail"})
+                if self.run_type != "api":  # 按截图策略执行后没有截图的，失败时补一张
+                    await self.client_session.async_save_fail_screenshot(
+                        self.driver, step_dict.get("test_action", {}).get("report_img_folder"),
+                        step_dict.get("report_step_id"))
 
                 if isinstance(error, (
                         exceptions.ParamsError,
@@ -3,26 +3,28 @@ import os
 import time
 import json
 import base64
-import asyncio
 import platform
 import subprocess
 from functools import partial
+from urllib.parse import urlparse
 from unittest.case import SkipTest
-from concurrent.futures import ThreadPoolExecutor
 
 from appium import webdriver as appium_webdriver
 from appium.webdriver.common.touch_action import TouchAction
 from appium.webdriver.mobilecommand import MobileCommand
 from selenium import webdriver
+from selenium.common.exceptions import NoSuchElementException, TimeoutException
 from selenium.webdriver.chrome.options import Options as chromeOptions
 from selenium.webdriver.firefox.options import Options as firefoxOptions
 from selenium.webdriver.common.action_chains import ActionChains
 from selenium.webdriver.support.select import Select
 from selenium.webdriver.support import expected_conditions as ec
-from selenium.webdriver.support.ui import WebDriverWait
 
 from .utils import get_dict_data
 
+# 默认的元素等待策略，先每 initial_interval 秒查一次，之后每次间隔乘以 backoff，最长 max_interval 秒查一次
+default_wait_profile = {"initial_interval": 0.1, "max_interval": 1, "backoff": 1.5}
+
 
 class Actions:
     """
@@ -33,6 +35,7 @@ class Actions:
     def __init__(self, driver):
         self.driver = driver
         self.wait_time_out = 5  # 默认超时的时间设置
+        self.set_wait_profile()
 
     @property
     def width(self):
@@ -74,9 +77,39 @@ class Actions:
         """ 获取浏览器提取数据事件 """
         return cls.get_class_property('extract_')
 
-    def web_driver_wait_until(self, *args, **kwargs):
-        """ 基于 WebDriverWait().until()封装base方法 """
-        return WebDriverWait(self.driver, kwargs.get('wait_time_out', self.wait_time_out), 1).until(*args)
+    def set_wait_profile(self, wait_profile=None):
+        """ 设置当前步骤的元素等待策略，并清零等待耗时统计 """
+        self.wait_profile = {**default_wait_profile, **(wait_profile or {})}
+        self.wait_stat = {"wait_ms": 0, "poll_count": 0}
+
+    def web_driver_wait_until(self, method, *args, **kwargs):
+        """ 等待条件满足，与 WebDriverWait().until() 一致：返回条件的结果，忽略元素不存在的异常，超时抛出 TimeoutException
+        轮询间隔按 wait_profile 从短到长，元素很快出现时不必等满1秒，耗时累计到 wait_stat
+        """
+        wait_time_out = kwargs.get('wait_time_out') or self.wait_time_out
+        interval = float(self.wait_profile["initial_interval"])
+        max_interval = float(self.wait_profile["max_interval"])
+        backoff = float(self.wait_profile["backoff"])
+        start_at = time.monotonic()
+        end_at = start_at + wait_time_out
+        poll_count = 0
+        try:
+            while True:
+                poll_count += 1
+                try:
+                    value = method(self.driver)
+                    if value:
+                        return value
+                except NoSuchElementException:
+                    pass
+                remaining = end_at - time.monotonic()
+                if remaining <= 0:
+                    raise TimeoutException(f'等待{wait_time_out}秒后条件仍未满足')
+                time.sleep(min(interval, remaining))
+                interval = min(interval * backoff, max_interval)
+        finally:
+            self.wait_stat["wait_ms"] += round((time.monotonic() - start_at) * 1000, 3)
+            self.wait_stat["poll_count"] += poll_count
 
     def find_element(self, locator: tuple, wait_time_out=None, *args, **kwargs):
         """ 定位一个元素，参数locator是元祖类型，(定位方式, 定位元素)，如('id', 'username')，详见By的用法 """
@@ -649,6 +682,14 @@ class Actions:
         """ 获取屏幕截图, 保存为png格式 """
         return self.driver.get_screenshot_as_png()
 
+    def is_alive(self):
+        """ 会话是否可用，浏览器/app已关闭或会话已失效时返回False """
+        try:
+            self.driver.get_window_size()
+            return True
+        except Exception:
+            return False
+
 
 class GetUiDriver(Actions):
     """ 浏览器对象管理 """
@@ -674,6 +715,34 @@ class GetUiDriver(Actions):
         except Exception as e:
             print(f"浏览器 关闭失败：{e}")
 
+    def reset_session(self):
+        """ 重置浏览器状态，供下一条用例复用，返回是否可复用
+        只有 chromium 内核（chrome、edge）能通过 CDP 清除所有域名的数据，其他浏览器只能清除当前域名，不复用
+        1、收集各窗口访问过的页面所属的源，关闭多余的窗口
+        2、清除所有cookie、缓存，按源清除 localStorage、sessionStorage、IndexedDB、Cache Storage、Service Worker 等
+        3、打开空白页
+        """
+        if not hasattr(self.driver, 'execute_cdp_cmd'):
+            return False
+        handles = self.driver.window_handles
+        origins = set()
+        for index, handle in enumerate(handles):
+            self.driver.switch_to.window(handle)
+            history = self.driver.execute_cdp_cmd('Page.getNavigationHistory', {})
+            for entry in history.get('entries', []):
+                url = urlparse(entry.get('url') or '')
+                if url.scheme in ('http', 'https') and url.netloc:
+                    origins.add(f'{url.scheme}://{url.netloc}')
+            if index > 0:
+                self.driver.close()
+        self.driver.switch_to.window(handles[0])
+        self.driver.execute_cdp_cmd('Network.clearBrowserCookies', {})
+        self.driver.execute_cdp_cmd('Network.clearBrowserCache', {})
+        for origin in origins:
+            self.driver.execute_cdp_cmd('Storage.clearDataForOrigin', {'origin': origin, 'storageTypes': 'all'})
+        self.driver.get('about:blank')
+        return True
+
     def get_driver(self):
         """ 获取浏览器实例 """
         return getattr(self, self.browser_name)()  # 获取浏览器对象
@@ -743,6 +812,7 @@ class GetAppDriver(Actions):
         """
 
         self.host, self.port, self.remote_path = kwargs.pop('host'), kwargs.pop('port'), kwargs.pop('remote_path')
+        self.capabilities = kwargs
         try:
             self.appium_webdriver = appium_webdriver.Remote(f'http://{self.host}:{self.port}{self.remote_path}', kwargs)  # 启动app
         except Exception as error:
@@ -757,19 +827,24 @@ class GetAppDriver(Actions):
         except Exception as e:
             print(f"app 关闭失败：{e}")
 
+    def reset_session(self):
+        """ 重启app供下一条用例复用，设置了不保留数据（noReset不为true）的需要新会话重新安装/清数据，不复用 """
+        app_id = self.capabilities.get('appPackage') or self.capabilities.get('bundleId')
+        if not self.capabilities.get('noReset') or not app_id:
+            return False
+        self.appium_webdriver.terminate_app(app_id)
+        self.appium_webdriver.activate_app(app_id)
+        return True
+
 
 async def get_web_driver(driver_type, **kwargs):
     """ 实例化driver比较耗时，异步执行 """
+    # app.configs.config 导入了本模块，在这里导入避免循环导入
+    from app.configs.config import webdriver_action_timeout
+    from .client.webdriver import webdriver_executor
+
     func = GetAppDriver if driver_type == 'app' else GetUiDriver
-    max_workers = min(50, os.cpu_count() * 5)
-    with ThreadPoolExecutor(max_workers=max_workers) as executor:
-        try:
-            bound_func = partial(func, *(), **kwargs)
-            return await asyncio.wait_for(
-                asyncio.get_running_loop().run_in_executor(executor, bound_func), timeout=600)
-        except Exception as e:
-            executor.shutdown(wait=True)  # 强制终止超时任务
-            raise
+    return await webdriver_executor.run(partial(func, **kwargs), timeout=webdriver_action_timeout)
 
 
 if __name__ == '__main__':
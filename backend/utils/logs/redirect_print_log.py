@@ -1,28 +1,59 @@
 import sys
+from contextvars import ContextVar
+
+# 当前上下文（协程任务/步骤）的print缓冲区，为None时输出到console
+_print_buffer = ContextVar("print_buffer", default=None)
+
+
+class ContextStdout:
+    """ 替换 sys.stdout，根据当前上下文把print内容写到对应的缓冲区，多个用例/报告并发执行时互不干扰 """
+
+    def write(self, out_stream):
+        buffer = _print_buffer.get()
+        if buffer is None:
+            return sys.__stdout__.write(out_stream)
+        buffer.append(out_stream)
+        return len(out_stream)
+
+    def flush(self):
+        if _print_buffer.get() is None:
+            sys.__stdout__.flush()
+
+    def __getattr__(self, item):
+        """ encoding、isatty 等属性使用原始输出的 """
+        return getattr(sys.__stdout__, item)
+
+
+context_stdout = ContextStdout()
 
 
 class RedirectPrintLogToMemory:
-    """ 重定向print内容到内存中 """
+    """ 重定向当前上下文的print内容到内存中，只影响当前协程任务（以及由它复制上下文发起的线程） """
 
     def __init__(self):
-        self.text = ""
-        sys.stdout = self
+        self.text_list = []
+        if sys.stdout is not context_stdout:  # sys.stdout 只替换一次，之后按上下文区分输出
+            sys.stdout = context_stdout
+        self.token = _print_buffer.set(self.text_list)
+
+    @property
+    def text(self):
+        return "".join(self.text_list)
 
     def write(self, out_stream):
-        self.text += out_stream
+        self.text_list.append(out_stream)
 
     def flush(self):
         pass
 
     def get_text_and_redirect_to_default(self):
-        self.redirect_to_default()
+        try:
+            _print_buffer.reset(self.token)
+        except (ValueError, RuntimeError):  # 不是在设置缓冲区的上下文中恢复的，或者已经恢复过
+            self.redirect_to_default()
         return self.text
 
     @classmethod
     def redirect_to_default(cls):
-        """ 恢复输出到console """
-        sys.stdout = sys.__stdout__
-
-    # def __del__(self):
-    #     """ 恢复输出到console """
-    #     sys.stdout = sys.__stdout__
+        """ 恢复当前上下文输出到console """
+        _print_buffer.set(None)
@@ -1,52 +1,286 @@
 # -*- coding: utf-8 -*-
+import asyncio
 import datetime
+import json
 import struct
+import threading
+import time
+import traceback
 import uuid
 
 import pika
 import stomp
+from pika.exceptions import AMQPConnectionError, AMQPChannelError
+from stomp.exception import StompException
 from .mq_http_sdk.mq_producer import *
 from .mq_http_sdk.mq_client import *
 
+from app.configs.config import mq_producer_max_workers, mq_producer_idle_timeout, mq_producer_batch_size, \
+    mq_send_timeout
+from utils.logs.log import logger
+from utils.util.thread_pool import BoundedExecutor
 
-def send_rocket_mq(host, access_id, access_key, topic, instance_id, message_body, message_tag, options: dict):
-    mq_client = MQClient(host, access_id, access_key)  # 初始化client。
-    producer = mq_client.get_producer(instance_id, topic)
-    try:
-        body = message_body if isinstance(message_body, str) else json.dumps(message_body)
-        message = TopicMessage(body, message_tag)
-        for key, value in options.items():  # 自定义的属性
-            if value:
-                message.set_message_key(value) if key.upper() == "KEYS" else message.put_property(key, value)
-        re_msg = producer.publish_message(message)
-        return {"status": "success", "res": f"MessageID: {re_msg.message_id}, BodyMD5: {re_msg.message_body_md5}"}
-    except MQExceptionBase as error:
-        return {"status": "fail", "res": error}
-
-
-def send_rabbit_mq(host, port, account, password, topic, message):  # 消息生产者
-    user_info = pika.PlainCredentials(account, password)
-    connection = pika.BlockingConnection(
-        pika.ConnectionParameters(host=host, port=port, credentials=user_info))
-    channel = connection.channel()
-    channel.queue_declare(queue=topic)  # 声明消息队列，消息将在这个队列传递，如不存在，则创建
-    # 向队列插入数值 routing_key的队列名为tester，body 就是放入的消息内容，exchange指定消息在哪个队列传递，
-    # 这里是空的exchange但仍然能够发送消息到队列中，因为使用的是定义的空字符串"" exchange（默认的exchange）
-    channel.basic_publish(exchange='', routing_key=topic, body=message)
-    connection.close()  # 关闭连接
-
-
-def send_active_mq(host, port, account, password, client_id, topic, message):
-    try:
-        build_message = build_active_mq_body(message, topic, client_id)
-        message_body, message_id = build_message[0], build_message[1]
-        conn = stomp.Connection([(host, port)], keepalive=True, auto_decode=False)  # 创建STOMP连接
-        conn.connect(account, password, wait=True)  # ActiveMQ的用户名和密码，默认为admin/admin
-        conn.send(body=message_body, destination=topic)  # 发送消息
-        conn.disconnect()  # 断开连接
+
+class MqProducer:
+    """ 长连接生产者，每个队列链接一个
+    1、连接建立后一直复用，发送前检查连接是否可用，不可用则重连
+    2、连接类异常（retry_exceptions）时重连后重试一次，其他异常直接返回失败
+    3、连接不是线程安全的，同一个生产者的发送串行执行，一批消息只占用一次
+    4、发送超时后生产者被废弃（aborted），关闭连接让卡住的发送尽快结束，剩下的消息不再发送
+    """
+    retry_exceptions = ()
+
+    def __init__(self, **link):
+        self.link = link
+        self.lock = threading.Lock()
+        self.last_used_at = time.monotonic()
+        self.connected = False
+        self.aborted = False
+
+    def connect(self):
+        raise NotImplementedError
+
+    def is_alive(self):
+        return self.connected
+
+    def close(self):
+        self.connected = False
+
+    def publish(self, **message):
+        """ 发送一条消息，返回 {"status": "success" / "fail", "res": 发送结果} """
+        raise NotImplementedError
+
+    def send_batch(self, messages):
+        """ 串行发送一批消息，返回与消息一一对应的发送结果 """
+        with self.lock:
+            try:
+                results = []
+                for message in messages:
+                    if self.aborted:
+                        break
+                    results.append(self.send_one(message))
+                return results
+            finally:
+                self.last_used_at = time.monotonic()
+
+    def abort(self):
+        """ 废弃生产者，不等待锁，直接关闭连接，正在发送的调用会因连接关闭而出错返回 """
+        self.aborted = True
+        self.close()
+
+    def send_one(self, message):
+        for retry in range(2):
+            if self.aborted:  # 已超时废弃，不再重连发送
+                return {"status": "fail", "res": "发送超时，连接已关闭"}
+            try:
+                if not self.is_alive():
+                    self.close()
+                    self.connect()
+                return self.publish(**message)
+            except self.retry_exceptions as error:
+                self.close()
+                if retry:
+                    return {"status": "fail", "res": str(error)}
+                logger.warning(f'消息队列连接【{self.link.get("host")}:{self.link.get("port")}】异常，重连后重试：{error}')
+            except Exception as error:
+                return {"status": "fail", "res": str(error)}
+
+
+class RabbitMqProducer(MqProducer):
+    retry_exceptions = (AMQPConnectionError, AMQPChannelError)
+
+    def connect(self):
+        user_info = pika.PlainCredentials(self.link["account"], self.link["password"])
+        self.connection = pika.BlockingConnection(
+            pika.ConnectionParameters(host=self.link["host"], port=self.link["port"], credentials=user_info))
+        self.channel = self.connection.channel()
+        self.declared_topic = set()  # 已声明过的队列，同一个连接上不再重复声明
+        self.connected = True
+
+    def is_alive(self):
+        """ 处理积压的心跳等事件，连接已断开时会抛异常 """
+        if not self.connected or not self.connection.is_open or not self.channel.is_open:
+            return False
+        try:
+            self.connection.process_data_events(time_limit=0)
+            return True
+        except Exception:
+            return False
+
+    def close(self):
+        if self.connected:
+            try:
+                self.connection.close()
+            except Exception:
+                pass
+        self.connected = False
+
+    def publish(self, topic, message):
+        if topic not in self.declared_topic:
+            self.channel.queue_declare(queue=topic)  # 声明消息队列，消息将在这个队列传递，如不存在，则创建
+            self.declared_topic.add(topic)
+        # 向队列插入数值 routing_key的队列名为tester，body 就是放入的消息内容，exchange指定消息在哪个队列传递，
+        # 这里是空的exchange但仍然能够发送消息到队列中，因为使用的是定义的空字符串"" exchange（默认的exchange）
+        body = message if isinstance(message, (str, bytes)) else json.dumps(message, ensure_ascii=False)
+        self.channel.basic_publish(exchange='', routing_key=topic, body=body)
+        return {"status": "success", "res": "发送成功"}
+
+
+class ActiveMqProducer(MqProducer):
+    retry_exceptions = (StompException, ConnectionError)
+
+    def connect(self):
+        self.connection = stomp.Connection([(self.link["host"], self.link["port"])], keepalive=True, auto_decode=False)  # 创建STOMP连接
+        self.connection.connect(self.link["account"], self.link["password"], wait=True)  # ActiveMQ的用户名和密码，默认为admin/admin
+        self.connected = True
+
+    def is_alive(self):
+        return self.connected and self.connection.is_connected()
+
+    def close(self):
+        if self.connected:
+            try:
+                self.connection.disconnect()  # 断开连接
+            except Exception:
+                pass
+        self.connected = False
+
+    def publish(self, topic, message):
+        message_body, message_id = build_active_mq_body(message, topic, self.link["client_id"])
+        self.connection.send(body=message_body, destination=topic)  # 发送消息
         return {"status": "success", "res": f"messageId: {message_id}"}
-    except Exception as error:
-        return {"status": "fail", "res": error}
+
+
+class RocketMqProducer(MqProducer):
+    """ http协议，MQClient 内部是keep-alive的http连接，发送失败不重试，避免服务端已收到时重复发送 """
+
+    def connect(self):
+        self.mq_client = MQClient(self.link["host"], self.link["access_id"], self.link["access_key"])  # 初始化client。
+        self.topic_producer = {}  # {topic: producer}
+        self.connected = True
+
+    def close(self):
+        if self.connected:
+            try:
+                self.mq_client.close_connection()
+            except Exception:
+                pass
+        self.connected = False
+
+    def publish(self, topic, message, tag=None, options: dict = None):
+        if topic not in self.topic_producer:
+            self.topic_producer[topic] = self.mq_client.get_producer(self.link["instance_id"], topic)
+        try:
+            body = message if isinstance(message, str) else json.dumps(message)
+            topic_message = TopicMessage(body, tag)
+            for key, value in (options or {}).items():  # 自定义的属性
+                if value:
+                    topic_message.set_message_key(value) if key.upper() == "KEYS" else topic_message.put_property(key, value)
+            re_msg = self.topic_producer[topic].publish_message(topic_message)
+            return {"status": "success", "res": f"MessageID: {re_msg.message_id}, BodyMD5: {re_msg.message_body_md5}"}
+        except MQExceptionBase as error:
+            return {"status": "fail", "res": str(error)}
+
+
+class MqProducerPool:
+    """ 进程内的消息队列生产者
+    1、按队列链接（类型+地址+账号）保持一个长连接生产者，空闲超过 idle_timeout 秒的关闭
+    2、发送在线程池中执行，不阻塞事件循环
+    3、同一链接上一批还在发送时，新来的消息先排队，上一批发完后合并为一批发送，突发的大量消息只占用一个线程、一个连接
+    """
+
+    def __init__(self, max_workers=mq_producer_max_workers, idle_timeout=mq_producer_idle_timeout,
+                 batch_size=mq_producer_batch_size, send_timeout=mq_send_timeout):
+        self.executor = BoundedExecutor("mq-producer", max_workers)
+        self.idle_timeout = idle_timeout
+        self.batch_size = batch_size
+        self.send_timeout = send_timeout
+        self.producers = {}  # {链接: 生产者}
+        self.pending = {}  # 等待发送的消息，{链接: [(消息, future)]}
+        self.flush_tasks = {}  # 正在发送的任务，{链接: asyncio.Task}
+
+    async def send(self, producer_class, link: dict, message: dict):
+        """ 发送一条消息，等待发送完成，返回发送结果 """
+        key = (producer_class.__name__, *sorted(link.items()))
+        await self.close_idle(exclude=key)
+        if key not in self.producers:
+            self.producers[key] = producer_class(**link)
+
+        future = asyncio.get_running_loop().create_future()
+        self.pending.setdefault(key, []).append((message, future))
+        if key not in self.flush_tasks:
+            self.flush_tasks[key] = asyncio.create_task(self.flush(key))
+        return await future
+
+    async def flush(self, key):
+        """ 发送队列中的消息，每次取出当前排队的所有消息（最多 batch_size 条）作为一批
+        发送超时的一批消息可能已经部分发送，结果记为 unknown；超时的生产者废弃，后面的消息用新连接发送
+        """
+        try:
+            while self.pending.get(key):
+                producer = self.producers[key]
+                batch = self.pending[key][:self.batch_size]
+                del self.pending[key][:self.batch_size]
+                try:
+                    results = await self.executor.run(
+                        producer.send_batch, ([message for message, future in batch],), timeout=self.send_timeout)
+                except asyncio.TimeoutError:
+                    logger.error(f'消息队列发送超时（{self.send_timeout}秒），关闭连接，{len(batch)}条消息发送结果未知')
+                    self.producers[key] = producer.__class__(**producer.link)
+                    threading.Thread(target=producer.abort, daemon=True).start()
+                    results = [{"status": "unknown", "res": "发送超时，消息可能已发送"} for _ in batch]
+                except Exception as error:
+                    logger.error(f'消息队列发送异常：\n{traceback.format_exc()}')
+                    results = [{"status": "fail", "res": str(error)} for _ in batch]
+                for (message, future), result in zip(batch, results):
+                    if not future.done():
+                        future.set_result(result)
+        finally:
+            self.pending.pop(key, None)
+            self.flush_tasks.pop(key, None)
+
+    async def close_idle(self, exclude=None):
+        """ 关闭空闲超时的生产者 """
+        now = time.monotonic()
+        for key, producer in list(self.producers.items()):
+            if key != exclude and key not in self.flush_tasks and now - producer.last_used_at > self.idle_timeout:
+                self.producers.pop(key)
+                await self.executor.run(producer.close, timeout=self.send_timeout)
+
+    def get_stat(self):
+        return {
+            "producer_count": len(self.producers),
+            "pending_count": sum(len(items) for items in self.pending.values()),
+            "executor": self.executor.get_stat()
+        }
+
+
+# 进程内共用
+mq_producer_pool = MqProducerPool()
+
+
+async def send_rocket_mq(host, access_id, access_key, topic, instance_id, message_body, message_tag, options: dict):
+    return await mq_producer_pool.send(
+        RocketMqProducer,
+        dict(host=host, access_id=access_id, access_key=access_key, instance_id=instance_id),
+        dict(topic=topic, message=message_body, tag=message_tag, options=options)
+    )
+
+
+async def send_rabbit_mq(host, port, account, password, topic, message):  # 消息生产者
+    return await mq_producer_pool.send(
+        RabbitMqProducer,
+        dict(host=host, port=port, account=account, password=password),
+        dict(topic=topic, message=message)
+    )
+
+
+async def send_active_mq(host, port, account, password, client_id, topic, message):
+    return await mq_producer_pool.send(
+        ActiveMqProducer,
+        dict(host=host, port=port, account=account, password=password, client_id=client_id),
+        dict(topic=topic, message=message)
+    )
 
 
 class ActiveMqBinaryMessage:
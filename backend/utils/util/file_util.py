@@ -2,9 +2,15 @@
 import json
 import os
 import io
+import base64
 import platform
 import shutil
 
+try:
+    from PIL import Image
+except ImportError:  # requirements.txt 中已包含 Pillow，没装上时兜底，截图不压缩，直接保存png
+    Image = None
+
 from app.configs.config import basedir
 from utils.variables.content_type import CONTENT_TYPE
 
@@ -80,12 +86,20 @@ class FileUtil:
         with io.open(os.path.join(DIFF_RESULT, f'{diff_record_id}.json'), "w", encoding="utf-8") as fp:
             json.dump(diff_detail, fp, ensure_ascii=False, indent=4)
 
+    @classmethod
+    def build_script_data(cls, content, env="debug"):
+        """ 生成自定义函数脚本内容，在第一行加上运行环境 """
+        return "# coding:utf-8\n\n" + f'env = "{env}"\n\n' + (content or '')
+
+    @classmethod
+    def build_script_path(cls, name):
+        """ 自定义函数脚本文件路径 """
+        return os.path.join(SCRIPT_ADDRESS, f'{name}.py')
+
     @classmethod
     def save_script_data(cls, name, content, env="debug"):
         """ 保存自定义函数数据 """
-        content = content or ''
-        func_data = "# coding:utf-8\n\n" + f'env = "{env}"\n\n' + content
-        cls.save_file(os.path.join(SCRIPT_ADDRESS, f'{name}.py'), func_data)
+        cls.save_file(cls.build_script_path(name), cls.build_script_data(content, env))
 
     @classmethod
     def save_mock_script_data(cls, name, content, path={}, headers={}, query={}, body={}):
@@ -147,16 +161,36 @@ class FileUtil:
         os.makedirs(folder_path)
         return folder_path
 
+    @staticmethod
+    def can_compress_img():
+        """ 是否能把截图压缩为jpg，需要安装 Pillow """
+        return Image is not None
+
+    @classmethod
+    def save_report_step_img(cls, file_path, png_data, quality=60):
+        """ 保存步骤截图，有 Pillow 时压缩为jpg，否则保存为png，file_path 不带后缀 """
+        if Image is not None:
+            with Image.open(io.BytesIO(png_data)) as img:
+                img.convert("RGB").save(f'{file_path}.jpg', format="JPEG", quality=quality, optimize=True)
+        else:
+            with open(f'{file_path}.png', 'wb') as file:
+                file.write(png_data)
+
     @classmethod
     def get_report_step_img(cls, report_id, report_step_id, img_type, report_type='ui'):
-        """ 获取步骤的截图 """
+        """ 获取步骤的截图，返回base64字符串，兼容以前保存的base64文本文件 """
         folder_path = os.path.join(cls.get_report_img_path(report_type), str(report_id))
+        for suffix in ('jpg', 'png'):
+            file_path = os.path.join(folder_path, f'{report_step_id}_{img_type}.{suffix}')
+            if os.path.exists(file_path):
+                with open(file_path, 'rb') as file:
+                    return base64.b64encode(file.read()).decode()
+
         file_path = os.path.join(folder_path, f'{report_step_id}_{img_type}.txt')
         if os.path.exists(file_path):
-            with io.open(os.path.join(folder_path, f'{report_step_id}_{img_type}.txt')) as file:
+            with io.open(file_path) as file:
                 data = file.read()
             return data
 
-
 if __name__ == "__main__":
     pass
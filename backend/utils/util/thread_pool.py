@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import contextvars
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+from utils.logs.log import logger
+
+
+class BoundedExecutor:
+    """ 进程内共用的有界线程池，用于在异步代码中执行阻塞的调用
+    1、整个进程共用固定数量的线程，不会因为并发运行而无限制的创建线程
+    2、超时后：还在排队的任务直接取消；已经在执行的任务无法强制终止，放弃等待并记为 abandoned，执行完后自动释放
+    3、记录排队数、执行中数量、饱和度等指标
+    """
+
+    def __init__(self, name: str, max_workers: int):
+        self.name = name
+        self.max_workers = max_workers
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=name)
+        self.lock = threading.Lock()
+        self.running = 0  # 正在执行的任务数
+        self.abandoned = 0  # 已超时放弃等待，但线程还在执行的任务数
+        self.submitted_count = self.completed_count = self.timeout_count = self.error_count = 0
+
+    def _run(self, func, state):
+        """ 在线程中执行，统计执行中的任务数 """
+        with self.lock:
+            self.running += 1
+            state["started"] = True
+        try:
+            return func()
+        finally:
+            with self.lock:
+                self.running -= 1
+                self.completed_count += 1
+                if state["abandoned"]:
+                    self.abandoned -= 1
+                state["done"] = True
+
+    async def run(self, func, args=(), kwargs=None, *, timeout=None):
+        """ 在线程池中执行 func(*args, **kwargs)，带上当前上下文（如print重定向），超时抛出 asyncio.TimeoutError
+        func 的参数用 args、kwargs 传入，不与 timeout 等线程池自己的参数混在一起，func 可以有同名参数
+        """
+        bound_func = partial(contextvars.copy_context().run, func, *args, **(kwargs or {}))
+        state = {"started": False, "abandoned": False, "done": False}
+        with self.lock:
+            self.submitted_count += 1
+        future = asyncio.get_running_loop().run_in_executor(self.executor, self._run, bound_func, state)
+        try:
+            return await asyncio.wait_for(future, timeout=timeout)
+        except asyncio.TimeoutError:
+            with self.lock:
+                self.timeout_count += 1
+                if state["started"] and not state["done"]:  # 没开始执行的已经被取消了，开始执行了的只能放弃等待
+                    state["abandoned"] = True
+                    self.abandoned += 1
+            logger.warning(f"线程池【{self.name}】任务执行超时({timeout}s)，已放弃等待，当前状态：{self.get_stat()}")
+            raise
+        except Exception:
+            with self.lock:
+                self.error_count += 1
+            raise
+
+    def get_stat(self):
+        """ 线程池指标 """
+        queue_depth = self.executor._work_queue.qsize()
+        return {
+            "name": self.name,
+            "max_workers": self.max_workers,
+            "running": self.running,
+            "queue_depth": queue_depth,  # 排队等待执行的任务数
+            "saturation": round(self.running / self.max_workers, 4),  # 饱和度，1为线程已全部占用
+            "abandoned": self.abandoned,
+            "submitted_count": self.submitted_count,
+            "completed_count": self.completed_count,
+            "timeout_count": self.timeout_count,
+            "error_count": self.error_count
+        }